@@ -0,0 +1,248 @@
+""" Benchmarks for the processing of borg's output by sya.
+
+    python -m benchmarks run [-n MESSAGES] [-s STAGE ...] [-t STREAM ...]
+    python -m benchmarks startup [-r REPEAT]
+    python -m benchmarks compare OLD.json NEW.json
+
+Each combination of stream and stage runs in a fresh interpreter, such that
+the peak RSS can be attributed to it. Results are written to
+`benchmarks/results/<git describe>.json` by default, two such files can be
+compared to spot regressions. `startup` measures the startup time of the
+commandline interface instead. Run from the root of the repository, with
+the package importable (e.g. `PYTHONPATH=src`).
+"""
+
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from . import streams
+from . import pipeline
+from . import startup as startup_
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+# Relative changes beyond this are reported as regressions.
+THRESHOLD = 0.1
+
+
+def _peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _summarize(latencies, seconds):
+    values = sorted(latencies)
+    n = len(values)
+    if not n:
+        return {'messages': 0, 'seconds': seconds}
+    us = {f'p{int(q * 100)}': _percentile(values, q) * 1e6
+          for q in [0.5, 0.9, 0.99]}
+    us['max'] = values[-1] * 1e6
+    return {
+        'messages': n,
+        'seconds': seconds,
+        'msgs_per_s': n / seconds if seconds else None,
+        'latency_us': us,
+    }
+
+
+def _label():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(__file__), capture_output=True, check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return time.strftime('%Y%m%d-%H%M%S')
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command(hidden=True)
+@click.argument('stage')
+@click.argument('stream')
+@click.argument('path')
+def child(stage, stream, path):
+    """Run a single benchmark and print its results as JSON.
+    """
+    _, pipe = streams.STREAMS[stream]
+    baseline = _peak_rss_mib()
+    rec = pipeline.Recorder()
+    t0 = time.perf_counter()
+    pipeline.STAGES[stage](path, pipe, rec)
+    seconds = time.perf_counter() - t0
+    result = _summarize(rec.latencies, seconds)
+    result['baseline_rss_mib'] = baseline
+    result['peak_rss_mib'] = _peak_rss_mib()
+    json.dump(result, sys.stdout)
+
+
+@main.command(help="Run the benchmarks and store the results.")
+@click.option('-n', '--messages', default=200000,
+              help="Number of messages per stream.")
+@click.option('-s', '--stage', 'stages', multiple=True,
+              type=click.Choice(list(pipeline.STAGES)),
+              help="Only run these stages (default: all).")
+@click.option('-t', '--stream', 'stream_names', multiple=True,
+              type=click.Choice(list(streams.STREAMS)),
+              help="Only use these streams (default: all).")
+@click.option('-o', '--output', default=None,
+              help="Where to store the results, default is "
+                   "benchmarks/results/<git describe>.json")
+@click.option('--compare', 'baseline', default=None,
+              help="Compare to the results in this file.")
+def run(messages, stages, stream_names, output, baseline):
+    stages = stages or list(pipeline.STAGES)
+    stream_names = stream_names or list(streams.STREAMS)
+    label = _label()
+    report = _report(label)
+    report['messages'] = messages
+
+    with tempfile.TemporaryDirectory(prefix='sya-bench-') as tmp:
+        for stream in stream_names:
+            path = streams.write_stream(stream, messages, tmp)
+            _, pipe = streams.STREAMS[stream]
+            for stage in stages:
+                if pipe != 'stderr' and stage in pipeline.STDERR_ONLY:
+                    continue
+                name = f'{stream}/{stage}'
+                p = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks', 'child',
+                     stage, stream, path],
+                    stdout=subprocess.PIPE,
+                )
+                if p.returncode:
+                    click.echo(f'{name}: failed', err=True)
+                    continue
+                result = json.loads(p.stdout)
+                report['results'][name] = result
+                click.echo(_format_line(name, result))
+
+    output = output or os.path.join(RESULTS_DIR, f'{label}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    click.echo(f'Results written to {output}')
+
+    if baseline:
+        with open(baseline) as f:
+            if _compare(json.load(f), report):
+                sys.exit(1)
+
+
+def _format_line(name, r):
+    lat = r.get('latency_us', {})
+    return (f"{name:<24} {r.get('msgs_per_s') or 0:>12,.0f} msg/s  "
+            f"p50 {lat.get('p50', 0):>8.1f}us  "
+            f"p99 {lat.get('p99', 0):>8.1f}us  "
+            f"max {lat.get('max', 0):>10.1f}us  "
+            f"RSS {r['peak_rss_mib']:>7.1f} MiB")
+
+
+def _compare(old, new):
+    """Print the relative changes between two reports and return whether
+    any benchmark regressed.
+    """
+    regressed = False
+    click.echo(f"{old['label']} -> {new['label']}")
+    for name, r in new['results'].items():
+        o = old['results'].get(name)
+        if o is None:
+            continue
+        changes = []
+        for what, a, b, higher_is_better in [
+                ('msg/s', o.get('msgs_per_s'), r.get('msgs_per_s'), True),
+                ('p99', o.get('latency_us', {}).get('p99'),
+                 r.get('latency_us', {}).get('p99'), False),
+                ('startup', o.get('startup_ms', {}).get('median'),
+                 r.get('startup_ms', {}).get('median'), False),
+                ('RSS', o.get('peak_rss_mib'), r.get('peak_rss_mib'), False),
+                ]:
+            if not a or b is None:
+                continue
+            change = (b - a) / a
+            worse = -change if higher_is_better else change
+            flag = ' REGRESSION' if worse > THRESHOLD else ''
+            regressed = regressed or bool(flag)
+            changes.append(f'{what} {change:+.0%}{flag}')
+        click.echo(f"{name:<24} " + ', '.join(changes))
+    return regressed
+
+
+def _report(label):
+    return {
+        'label': label,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': {},
+    }
+
+
+@main.command(help="Measure the startup time of the commandline interface "
+                   "and store the results.")
+@click.option('-r', '--repeat', default=20,
+              help="Number of runs per command.")
+@click.option('-o', '--output', default=None,
+              help="Where to store the results, default is "
+                   "benchmarks/results/<git describe>-startup.json")
+@click.option('--compare', 'baseline', default=None,
+              help="Compare to the results in this file.")
+def startup(repeat, output, baseline):
+    label = _label()
+    report = _report(label)
+    interpreter = statistics.median(
+        startup_.measure(*startup_.BASELINE, repeat))
+    report['interpreter_ms'] = interpreter * 1e3
+    click.echo(f"{'interpreter':<24} {interpreter * 1e3:>8.1f}ms")
+    for name, (args, env) in startup_.COMMANDS.items():
+        times = startup_.measure(args, env, repeat)
+        median = statistics.median(times)
+        result = {
+            'startup_ms': {'min': min(times) * 1e3, 'median': median * 1e3},
+            # Without the interpreter's own startup
+            'sya_ms': (median - interpreter) * 1e3,
+        }
+        report['results'][f'startup/{name}'] = result
+        click.echo(f"{'startup/' + name:<24} {median * 1e3:>8.1f}ms  "
+                   f"(sya {result['sya_ms']:.1f}ms)")
+
+    output = output or os.path.join(RESULTS_DIR, f'{label}-startup.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    click.echo(f'Results written to {output}')
+
+    if baseline:
+        with open(baseline) as f:
+            if _compare(json.load(f), report):
+                sys.exit(1)
+
+
+@main.command(help="Compare two result files.")
+@click.argument('old', type=click.File())
+@click.argument('new', type=click.File())
+def compare(old, new):
+    if _compare(json.load(old), json.load(new)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+""" The stages of the pipeline from borg's pipes to the terminal, each of which
+can be benchmarked separately or all of them together ('end-to-end').
+
+Each stage consumes one of the synthetic `streams` and records one latency
+per message:
+
+- 'framing': Splitting the bytes into messages. The latency is the time from
+  a chunk being fed to the framer until its messages are returned.
+- 'communicate': `Borg._communicate` reading from a `cat` process. The
+  latency is the time between two consecutive messages.
+- 'dispatch': `DefaultHandlers._dispatch`, the latency is the duration of the
+  call.
+- 'cli': `cli.handlers.BorgHandlers` rendering to a `cli.terminal.Terminal`
+  on a pseudo-terminal, the latency is the duration of the `_dispatch` call.
+- 'end-to-end': `Borg._stream` reading from a `cat` process and dispatching
+  to `cli.handlers.BorgHandlers`, the latency is the time between two
+  consecutive messages.
+"""
+
+from array import array
+from contextlib import contextmanager
+import fcntl
+import json
+import logging
+import os
+import struct
+import sys
+import termios
+import threading
+import time
+
+from borg_sya.core.borg import Borg, DefaultHandlers
+from borg_sya.core.borg.framing import JsonFramer, LineFramer
+
+
+READ_SIZE = Borg.READ_SIZE
+
+
+class Recorder():
+    def __init__(self):
+        self.latencies = array('d')
+        self._last = None
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def tick(self):
+        """Record the time since the previous tick (or `start`).
+        """
+        now = time.perf_counter()
+        self.latencies.append(now - self._last)
+        self._last = now
+
+    @contextmanager
+    def measure(self):
+        t0 = time.perf_counter()
+        yield
+        self.latencies.append(time.perf_counter() - t0)
+
+
+def _chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                return
+            yield data
+
+
+def _messages(path, pipe):
+    """The decoded messages in the stream (not timed).
+    """
+    framer = JsonFramer() if pipe == 'stderr' else LineFramer()
+    for data in _chunks(path):
+        for item in framer.feed(data):
+            if isinstance(item, dict):
+                yield item
+    for item in framer.close():
+        if isinstance(item, dict):
+            yield item
+
+
+def _logger(name, stream=None):
+    log = logging.getLogger(f'benchmark.{name}')
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    log.handlers = []
+    if stream is None:
+        log.addHandler(logging.NullHandler())
+    else:
+        handler = logging.StreamHandler(stream)
+        handler.terminator = ''
+        log.addHandler(handler)
+    return log
+
+
+@contextmanager
+def _pseudo_terminal(cols=150, rows=40):
+    """Replace stdout and stderr by a pty, whose output is discarded.
+    """
+    master, slave = os.openpty()
+    fcntl.ioctl(slave, termios.TIOCSWINSZ,
+                struct.pack('HHHH', rows, cols, 0, 0))
+
+    def drain():
+        try:
+            while os.read(master, 1 << 16):
+                pass
+        except OSError:
+            pass
+
+    drainer = threading.Thread(target=drain, daemon=True)
+    drainer.start()
+    stream = open(slave, 'w')
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = stream
+    try:
+        yield stream
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        stream.close()
+        drainer.join(timeout=1)
+        os.close(master)
+
+
+@contextmanager
+def _cli_handlers():
+    from borg_sya.cli.handlers import BorgHandlers
+    from borg_sya.cli.terminal import Terminal
+
+    with _pseudo_terminal():
+        term = Terminal()
+        handlers = BorgHandlers(_logger('cli', term), term)
+        try:
+            yield handlers
+        finally:
+            # Close the spinners and let the render thread exit.
+            handlers.__del__()
+            if term._render_thread is not None:
+                term._render_thread.join(timeout=5)
+
+
+class _ReplayBorg(Borg):
+    """Runs `cat` on the synthetic streams instead of borg.
+    """
+    def __init__(self, stdout_path, stderr_path):
+        super().__init__(dryrun=False, log=_logger('borg'))
+        self._paths = (stdout_path, stderr_path)
+
+    def _commandline(self, command, options, handlers, output=False):
+        return ['sh', '-c', 'cat "$1" & cat "$2" >&2; wait', 'sh',
+                *self._paths]
+
+
+def _replay(path, pipe):
+    devnull = os.devnull
+    if pipe == 'stdout':
+        return _ReplayBorg(path, devnull)
+    return _ReplayBorg(devnull, path)
+
+
+def framing(path, pipe, rec):
+    if pipe == 'stderr':
+        framer = JsonFramer()
+        decode = None
+    else:
+        # Stdout is framed by lines and decoded by `Borg.iter_list`.
+        framer = LineFramer()
+        decode = json.loads
+    for data in _chunks(path):
+        t0 = time.perf_counter()
+        items = framer.feed(data)
+        if decode:
+            items = [decode(item) for item in items]
+        t1 = time.perf_counter()
+        rec.latencies.extend([t1 - t0] * len(items))
+
+
+def communicate(path, pipe, rec):
+    from subprocess import Popen, PIPE
+
+    borg = _replay(path, pipe)
+    p = Popen(borg._commandline(None, [], None), stdout=PIPE, stderr=PIPE)
+    rec.start()
+    for stdout, msg in borg._communicate(p, stdout='raw', stderr='json'):
+        rec.tick()
+    p.wait()
+
+
+def dispatch(path, pipe, rec):
+    handlers = DefaultHandlers(_logger('dispatch'))
+    for msg in _messages(path, pipe):
+        with rec.measure():
+            handlers._dispatch(msg)
+
+
+def cli(path, pipe, rec):
+    with _cli_handlers() as handlers:
+        for msg in _messages(path, pipe):
+            with rec.measure():
+                handlers._dispatch(msg)
+
+
+def end_to_end(path, pipe, rec):
+    borg = _replay(path, pipe)
+    with _cli_handlers() as handlers:
+        output = 'json-lines' if pipe == 'stdout' else False
+        rec.start()
+        for stdout, msg in borg._stream('create', [], output=output,
+                                        handlers=handlers):
+            if stdout is not None:
+                json.loads(stdout)
+            rec.tick()
+
+
+STAGES = {
+    'framing': framing,
+    'communicate': communicate,
+    'dispatch': dispatch,
+    'cli': cli,
+    'end-to-end': end_to_end,
+}
+
+# Stages which only apply to messages on stderr.
+STDERR_ONLY = {'dispatch', 'cli'}
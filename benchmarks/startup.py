@@ -0,0 +1,49 @@
+""" The startup time of the commandline interface, for invocations which
+should neither load the configuration nor look up borg:
+
+- 'import': Importing `borg_sya.cli`.
+- 'help': `borg-sya --help`.
+- 'command-help': `borg-sya create --help`.
+- 'completion': Completing a subcommand name, as done by the shell on TAB.
+
+All of them run with a configuration directory that doesn't exist, such that
+they fail if they try to load it anyway.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+
+_MAIN = "from borg_sya.cli import main; main(prog_name='borg-sya')"
+_NO_CONFIG = ['-d', os.path.join(os.sep, 'nonexistent', 'borg-sya')]
+
+# name -> (python args, extra environment)
+COMMANDS = {
+    'import': (['-c', 'import borg_sya.cli'], {}),
+    'help': (['-c', _MAIN, *_NO_CONFIG, '--help'], {}),
+    'command-help': (['-c', _MAIN, *_NO_CONFIG, 'create', '--help'], {}),
+    'completion': (['-c', _MAIN], {
+        '_BORG_SYA_COMPLETE': 'bash_complete',
+        'COMP_WORDS': ' '.join(['borg-sya', *_NO_CONFIG, 'cr']),
+        'COMP_CWORD': str(len(_NO_CONFIG) + 1),
+    }),
+}
+
+# The interpreter itself, to tell sya's share of the startup time.
+BASELINE = (['-c', 'pass'], {})
+
+
+def measure(args, env, repeat):
+    """Run the interpreter with `args` `repeat` times, and return the wall
+    times in seconds.
+    """
+    env = {**os.environ, **env}
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *args], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t0)
+    return times
@@ -0,0 +1,102 @@
+""" Synthetic output of borg, written to files once and then replayed by the
+benchmarks, such that generating it is not part of the measurements.
+"""
+
+import json
+import os
+import random
+
+
+def _progress(i):
+    return {
+        'type': 'archive_progress',
+        'original_size': i * 4096,
+        'compressed_size': i * 2048,
+        'deduplicated_size': i * 512,
+        'nfiles': i,
+        'path': f'home/user/src/project{i % 17}/module{i % 101}/file{i}.py',
+        'time': 1600000000.0 + i / 1000,
+    }
+
+
+def progress_flood(n):
+    """`borg create --progress`: one `archive_progress` per file.
+    """
+    for i in range(n):
+        yield json.dumps(_progress(i)) + '\n'
+
+
+def multiline_json(n):
+    """Pretty-printed objects spanning several lines each.
+    """
+    for i in range(n):
+        yield json.dumps(_progress(i), indent=4) + '\n'
+
+
+def listing(n):
+    """`borg list --json-lines` of an archive (written to stdout).
+    """
+    for i in range(n):
+        yield json.dumps({
+            'type': '-', 'mode': '-rw-r--r--', 'user': 'user',
+            'group': 'users', 'uid': 1000, 'gid': 100,
+            'path': f'home/user/dir{i // 100}/file{i}', 'healthy': True,
+            'source': '', 'linktarget': '', 'flags': None,
+            'mtime': '2020-01-01T00:00:%02d.000000' % (i % 60),
+            'size': i,
+        }) + '\n'
+
+
+def mixed(n, seed=0):
+    """Everything that `borg create --list --progress --stats` might emit,
+    including lines which are not JSON.
+    """
+    rnd = random.Random(seed)
+    for i in range(n):
+        kind = rnd.random()
+        if kind < 0.4:
+            msg = _progress(i)
+        elif kind < 0.6:
+            msg = {'type': 'file_status', 'status': 'A',
+                   'path': f'home/user/file{i}'}
+        elif kind < 0.75:
+            msg = {'type': 'log_message', 'time': 1600000000.0 + i,
+                   'levelname': 'INFO', 'name': 'borg.output.list',
+                   'message': f'A home/user/file{i}'}
+        elif kind < 0.85:
+            msg = {'type': 'progress_percent', 'operation': 1,
+                   'msgid': 'cache.commit', 'finished': False,
+                   'time': 1600000000.0 + i, 'current': i, 'total': n,
+                   'message': f'{100 * i // n}%'}
+        elif kind < 0.95:
+            msg = {'type': 'progress_message', 'operation': 2,
+                   'msgid': 'cache.begin_transaction', 'finished': False,
+                   'time': 1600000000.0 + i,
+                   'message': 'Initializing cache transaction'}
+        else:
+            yield f'Warning: not JSON, line {i}\n'
+            continue
+        yield json.dumps(msg) + '\n'
+
+
+# name -> (generator, which pipe the stream is written to)
+STREAMS = {
+    'progress': (progress_flood, 'stderr'),
+    'multiline': (multiline_json, 'stderr'),
+    'listing': (listing, 'stdout'),
+    'mixed': (mixed, 'stderr'),
+}
+
+
+def write_stream(name, n, directory):
+    """Write the stream to a file (unless it exists already) and return its
+    path.
+    """
+    path = os.path.join(directory, f'{name}-{n}.jsonl')
+    if not os.path.exists(path):
+        generate, _ = STREAMS[name]
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            f.writelines(generate(n))
+        os.replace(tmp, path)
+    return path
@@ -39,6 +39,7 @@ setup(name='borg_sya',
       entry_points={
           'console_scripts': [
               'borg-sya = borg_sya.cli:main [CLI]',
+              'borg-sya-replay = borg_sya.core.borg.recording:main',
           ],
           'gui_scripts': [
               'borg-sya-gui = borg_sya.gui:main [GUI]',
@@ -1,81 +1,32 @@
+# The core (and thus borg, yaml, ...) is only imported when a command runs,
+# such that `--help` and shell completion are fast and don't need a valid
+# configuration.
+import atexit
 import click
 from contextlib import contextmanager
+from datetime import datetime
 import logging
 import os
+import re
+import signal
 import sys
 import time
 import traceback
 
-from ..core import *
-from ..core.borg import BorgError, DefaultHandlers, InvalidBorgOptions
-from ..core.util import LockInUse, truncate_path
-from .terminal import Terminal
+from ..defaults import DEFAULT_CONFDIR, DEFAULT_CONFFILE
 
 
-class BorgHandlers(DefaultHandlers):
-    def __init__(self, log, cli, **kwargs):
-        # FIXME: actually respect the progress option
-        kwargs.pop('progress', None)
-        self.cli = cli
-        self._spinners = dict()
-        super().__init__(log, **kwargs)
+class Group(click.Group):
+    def parse_args(self, ctx, args):
+        rest = super().parse_args(ctx, args)
+        # The group's callback runs before the subcommand parses its
+        # arguments, so check here whether it will only show its help.
+        ctx.meta['sya.help'] = any(arg in ctx.help_option_names
+                                   for arg in ctx.args)
+        return rest
 
-    def __del__(self):
-        for contextmanager, _ in self._spinners.values():
-            contextmanager.__exit__(None, None, None)
-        self._spinners = dict()
 
-    def _get_spinner(self, name):
-        try:
-            _, spinner = self._spinners[name]
-        except KeyError:
-            contextmanager = self.cli.spinner('')
-            spinner = contextmanager.__enter__()
-            self._spinners[name] = (contextmanager, spinner)
-        return spinner
-
-    def _close_spinner(self, name):
-        try:
-            (contextmanager, _) = self._spinners.pop(name)
-            contextmanager.__exit__(None, None, None)
-        except KeyError:
-            pass
-
-    def onArchiveProgress(self, path, **msg):
-        spinner = self._get_spinner('onArchiveProgress')
-        text = self.format_archive_progress(**msg)
-        # FIXME: instead of ' - 15', determine the actual indentation caused by
-        # the logger
-        term_width = self.cli.stderr.width - 15
-        if len(text) <= term_width:
-            space = term_width - len(text)
-            if space >= 12:
-                text += truncate_path(path, space)
-        else:
-            text = truncate_path(path, term_width)
-
-
-        spinner.update(text)
-
-    def onProgressMessage(self, operation, msgid, finished, time, message=None,
-            **msg):
-        if finished:
-            self._close_spinner(('onProgressMessage', operation))
-        else:
-            spinner  = self._get_spinner(('onProgressMessage', operation))
-            spinner.update(f"{self.human_readable_msgid(msgid)}: {(message or '')}")
-
-    def onProgressPercent(self, operation, msgid, finished, time,
-            message=None, current=None, info=None, total=None, **msg):
-        if finished:
-            self._close_spinner(('onProgressPercent', operation))
-        else:
-            spinner  = self._get_spinner(('onProgressPercent', operation))
-            spinner.update(f"{self.human_readable_msgid(msgid)}: {(message or '')}")
-
-
-
-@click.group()
+@click.group(cls=Group)
 @click.option('-d', '--config-dir', 'confdir',
               default=DEFAULT_CONFDIR,
               help=f"Configuration directory, default is {DEFAULT_CONFDIR}")
@@ -83,8 +34,21 @@ class BorgHandlers(DefaultHandlers):
               help="Do not run backup, don't act.")
 @click.option('-v', '--verbose', is_flag=True,
               help="Be verbose and print stats.")
+@click.option('--timings', 'timings_file', default=None,
+              type=click.Path(dir_okay=False, writable=True),
+              help="Write the time spent in each phase of the task runs "
+                   "to this file (as JSON).")
 @click.pass_context
-def main(ctx, confdir, dryrun, verbose):
+def main(ctx, confdir, dryrun, verbose, timings_file):
+    if ctx.resilient_parsing or ctx.meta.get('sya.help'):
+        # Shell completion, or `borg-sya COMMAND --help`: The subcommand
+        # doesn't run, so don't load the configuration.
+        return
+
+    from ..core import Context, InvalidConfigurationError
+    from .handlers import BorgHandlers
+    from .terminal import Terminal
+
     term = Terminal()
     handler = logging.StreamHandler(term)
     handler.terminator = ''
@@ -106,14 +70,28 @@ def main(ctx, confdir, dryrun, verbose):
         cx.verbose = verbose
     cx.dryrun = dryrun
 
-    cx.handler_factory = lambda **kw: BorgHandlers(cx.log, term, **kw)
+    cx.handler_factory = (
+        lambda log=None, **kw: BorgHandlers(log or cx.log, term, **kw)
+    )
 
     ctx.obj = cx
 
+    @ctx.call_on_close
+    def report_timings():
+        # Also called if the command failed, which is when it's most useful.
+        if not cx.timings:
+            return
+        if timings_file:
+            cx.timings.write(timings_file)
+        if cx.verbose:
+            cx.info("-- Time spent per phase:\n" + cx.timings.format_table())
+
 
 @main.resultcallback()
 @click.pass_context
-def exit(cx, *args, **kwargs):
+def exit(ctx, *args, **kwargs):
+    if ctx.obj is not None and ctx.obj.python_worker:
+        ctx.obj.python_worker.close()
     logging.shutdown()
 
 
@@ -125,14 +103,22 @@ def exit(cx, *args, **kwargs):
 
 
 @contextmanager
-def handle_errors(cx, repo, action, action_failed):
+def handle_errors(cx, repo, action, action_failed, reraise_busy=False):
+    from ..core.borg import BorgError, InvalidBorgOptions
+    from ..core.snapshot import SnapshotError
+    from ..core.util import LockInUse
+
     try:
         yield
     except InvalidBorgOptions as e:
         cx.error(f"Invalid commandline options: {e}")
+    except SnapshotError as e:
+        cx.error(f"Taking a snapshot failed when {action_failed}: {e}")
     except BorgError as e:
         cx.error(f"Error {e} when {action_failed}.\nYou should investigate.")
     except LockInUse as e:
+        if reraise_busy:
+            raise
         cx.error(f"Another process seems to be accessing the "
                  f"repository {repo.name}. Could not {action}.")
     except KeyboardInterrupt as e:
@@ -140,35 +126,136 @@ def handle_errors(cx, repo, action, action_failed):
         raise
 
 
+def jobs_option(f):
+    return click.option(
+        '-j', '--jobs', default=1, type=click.IntRange(min=1),
+        help="Number of tasks to run concurrently. Tasks on the same "
+             "repository are always run one after another.",
+    )(f)
+
+
 @main.command(help="Do a backup run. If no Task is specified, run all.")
 @click.option('-p', '--progress/--no-progress',
               help="Show progress.")
+@jobs_option
 @click.argument('tasks', nargs=-1)
 @click.pass_obj
-def create(cx, progress, tasks):
+def create(cx, progress, jobs, tasks):
     # cx = cx.sub_context('CREATE') # TODO: implement
     tasks, repos = cx.validate_tasks(tasks)
-    for task in tasks:
+
+    def run(task):
         cx.info(f'-- Backing up using {task} configuration...')
         with task(lazy=True):
             with handle_errors(cx, task.repo,
                                f"create a new archive for task '{task}'",
                                f"backing up task '{task}'",
                                ) as status:
-                task.create(progress)
-                task.prune()
+                task.backup(progress)
         cx.info(f'-- Done backing up {task}.')
 
+    cx.run_tasks(run, tasks, jobs=jobs)
+
+
+@main.command(help="Keep running and back up each task according to its "
+                   "'schedule'. If no task is specified, schedule all.")
+@jobs_option
+@click.option('--busy-retry', default=60,
+              type=click.IntRange(min=1), show_default=True,
+              help="Seconds after which to retry a task whose repository "
+                   "is used by another process.")
+@click.argument('tasks', nargs=-1)
+@click.pass_obj
+def daemon(cx, jobs, busy_retry, tasks):
+    from ..core.daemon import Scheduler
+
+    tasks, repos = cx.validate_tasks(tasks)
+
+    def run(task):
+        cx.info(f'-- Backing up using {task} configuration...')
+        with task(lazy=True):
+            with handle_errors(cx, task.repo,
+                               f"create a new archive for task '{task}'",
+                               f"backing up task '{task}'",
+                               reraise_busy=True,
+                               ):
+                task.backup(progress=False)
+        cx.info(f'-- Done backing up {task}.')
+
+    scheduler = Scheduler(cx, run, tasks, jobs=jobs, busy_retry=busy_retry)
+    # Let running tasks finish on SIGTERM, e.g. when stopped by systemd.
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    try:
+        scheduler.run()
+    finally:
+        if cx.python_worker:
+            cx.python_worker.close()
+
+
+def _duration(ctx, param, value):
+    from ..core.schedule import parse_duration
+    try:
+        return parse_duration(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@main.command(help="Keep running and back up tasks shortly after files "
+                   "below their includes changed. Tasks on the same "
+                   "repository are backed up together. If no task is "
+                   "specified, watch all.")
+@jobs_option
+@click.option('--quiet', default='1m', show_default=True,
+              callback=_duration,
+              help="Back up once no further changes happened for this long.")
+@click.option('--max-delay', default='10m', show_default=True,
+              callback=_duration,
+              help="Back up at the latest this long after the first change, "
+                   "even if changes continue.")
+@click.argument('tasks', nargs=-1)
+@click.pass_obj
+def watch(cx, jobs, quiet, max_delay, tasks):
+    from ..core.watch import Watcher
+
+    tasks, repos = cx.validate_tasks(tasks)
+
+    def run(repo, tasks):
+        cx.info(f"-- Backing up {', '.join(map(str, tasks))} after "
+                f"changes...")
+        # Only lock and mount the repository once for all tasks.
+        with repo:
+            for task in tasks:
+                with task(lazy=True):
+                    with handle_errors(cx, task.repo,
+                                       f"create a new archive for task "
+                                       f"'{task}'",
+                                       f"backing up task '{task}'",
+                                       reraise_busy=True,
+                                       ):
+                        task.backup(progress=False)
+        cx.info(f"-- Done backing up {', '.join(map(str, tasks))}.")
+
+    watcher = Watcher(cx, run, tasks, quiet=quiet, max_delay=max_delay,
+                      jobs=jobs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    try:
+        watcher.run()
+    finally:
+        if cx.python_worker:
+            cx.python_worker.close()
+
 
 @main.command(help="Prune archives from the given task. If no task is "
         "specified, run all.")
 @click.option('-p', '--progress/--no-progress',
               help="Show progress.")
+@jobs_option
 @click.argument('tasks', nargs=-1)
 @click.pass_obj
-def prune(cx, progress, tasks):
+def prune(cx, progress, jobs, tasks):
     tasks, repos = cx.validate_tasks(tasks)
-    for task in tasks:
+
+    def run(task):
         cx.info(f'-- Pruning archives from {task}...')
         with task(lazy=True):
             with handle_errors(cx, task.repo,
@@ -178,6 +265,8 @@ def prune(cx, progress, tasks):
                 task.prune()
         cx.info(f'-- Done pruning archives from {task}.')
 
+    cx.run_tasks(run, tasks, jobs=jobs)
+
 
 # TODO: support --archives-only, --repository-only
 @main.command(help="Perform a check for repository consistency. "
@@ -244,6 +333,8 @@ def check(cx, progress, repo, repair, verify_data, items):
 @click.argument('mountpoint', required=True)
 @click.pass_obj
 def mount(cx, repo, all, umask, item, mountpoint):
+    from ..core.borg import BorgError
+
     index = len(item)
     item = item.rstrip('^')
     index = index - len(item)
@@ -259,8 +350,9 @@ def mount(cx, repo, all, umask, item, mountpoint):
         tasks, repos = cx.validate_tasks([item])
         assert(len(tasks) == len(repos) == 1)
         task = tasks[0]
-        repo = repos[0]
-        prefix = task.prefix
+        repo = task.repo
+        # Archives are filtered locally, thus replace borg's placeholders.
+        prefix = task.archive_prefix
 
     if index and all:
         cx.error(f"Giving {'^' * index} and '--all' conflict.")
@@ -274,18 +366,16 @@ def mount(cx, repo, all, umask, item, mountpoint):
 
     with repo(lazy=True), handle_errors(
             cx, repo,
-            "mount archive(s)"
-            f"mounting repository {repo.name}."
+            "mount archive(s)",
+            f"mounting repository {repo.name}",
             ):
         archive = None
         if not all:
             cx.info(f"-- Searching for last archive from "
                     f"repository '{repo.name}' with prefix '{prefix}'.")
             try:
-                # short will only output archive names,
-                # last returns only the index+1 most recent archives
-                archive = cx.borg.list(repo, prefix,
-                                       short=True, last=index + 1)[0]
+                # Usually answered from the local archive catalogue
+                archive = repo.archives(prefix)[-(index + 1)]['name']
             except IndexError:
                 raise click.Abort()
             cx.info(f"-- Selected archive '{archive}'")
@@ -314,3 +404,125 @@ def mount(cx, repo, all, umask, item, mountpoint):
                         raise
 
             cx.info('-- Done unmounting (the FUSE driver has exited).')
+
+
+@main.command(help="Index the contents of new archives, such that they can "
+                   "be searched by 'find'. If no task is specified, index "
+                   "all repositories.")
+@click.argument('tasks', nargs=-1)
+@click.pass_obj
+def index(cx, tasks):
+    _, repos = cx.validate_tasks(tasks)
+
+    with cx.content_index() as content_index:
+        for repo in repos:
+            cx.info(f'-- Indexing archives in repository {repo.name}...')
+            with repo(lazy=True), handle_errors(
+                    cx, repo,
+                    "index its archives",
+                    f"indexing repository {repo.name}",
+                    ):
+                for archive in repo.update_index(content_index):
+                    cx.info(f'-- Indexed {archive}')
+            cx.info(f'-- Done indexing {repo.name}.')
+
+
+@main.command(help="Find files matching a shell-style PATTERN (such as "
+                   "'/etc/nginx/*.conf') in all indexed archives, without "
+                   "accessing the repositories. Run 'index' to add new "
+                   "archives to the index.")
+@click.option('-t', '--task', default=None,
+              help="Only search the archives created by this task.")
+@click.argument('pattern', required=True)
+@click.pass_obj
+def find(cx, task, pattern):
+    from ..core.borg.helpers import format_file_size
+
+    repository = prefix = None
+    if task:
+        tasks, _ = cx.validate_tasks([task])
+        repository = tasks[0].repo.path
+        prefix = tasks[0].archive_prefix
+
+    with cx.content_index() as content_index:
+        for archive, path, size, mtime in content_index.find(
+                pattern, repository=repository, prefix=prefix):
+            mtime = (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime))
+                     if mtime is not None else '')
+            size = format_file_size(size) if size is not None else ''
+            click.echo(f'{archive}  {mtime}  {size:>10}  /{path}')
+
+
+_SINCE_UNITS = {'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_since(ctx, param, value):
+    if value is None:
+        return None
+    m = re.fullmatch(r'(\d+)([hdw])', value)
+    if m:
+        return time.time() - int(m.group(1)) * _SINCE_UNITS[m.group(2)]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise click.BadParameter("Expected e.g. '12h', '30d', '8w' or a "
+                                 "date such as '2020-01-31'.")
+
+
+def _format_size(size):
+    from ..core.borg.helpers import format_file_size
+    return format_file_size(size) if size is not None else '-'
+
+
+@main.command(help="Show the history of backup runs from TASK (or all tasks) "
+                   "and trends such as growth per day, dedup ratio and "
+                   "run time. This only uses the local history, the "
+                   "repositories are not accessed.")
+@click.option('-s', '--since', default='30d', callback=parse_since,
+              help="Only consider runs since then, e.g. '12h', '30d', '8w' "
+                   "or '2020-01-31'. The default is '30d'.")
+@click.argument('task', required=False)
+@click.pass_obj
+def history(cx, since, task):
+    from ..core.borg.helpers import format_file_size
+    from ..core.history import trends
+
+    if task:
+        tasks = [t.name for t in cx.validate_tasks([task])[0]]
+    else:
+        tasks = list(cx.tasks)
+
+    for name in tasks:
+        runs = cx.history.runs(name, since=since)
+        if not runs:
+            continue
+        click.echo(f'-- {name} ({runs[-1]["repository"]})')
+        for r in runs:
+            start = time.strftime('%Y-%m-%d %H:%M', time.localtime(r['start']))
+            status = 'ok' if r['success'] else f"FAILED ({r['error']})"
+            click.echo(f"{start}  {r['archive'] or '-':<40} "
+                       f"{r['duration'] or 0:>8.1f}s  "
+                       f"O {_format_size(r['original_size']):>10}  "
+                       f"D {_format_size(r['deduplicated_size']):>10}  "
+                       f"N {r['nfiles'] if r['nfiles'] is not None else '-':>8}"
+                       f"  {status}")
+
+        t = trends(runs)
+        summary = [f"{t['runs']} runs, {t['failed']} failed"]
+        if t['errors']:
+            summary[-1] += f" ({', '.join(t['errors'])})"
+        if 'original_growth_per_day' in t:
+            summary.append(
+                f"source growth "
+                f"{format_file_size(t['original_growth_per_day'], sign=True)}"
+                f"/day, repository growth "
+                f"{format_file_size(t['deduplicated_per_day'])}/day")
+        if 'dedup_ratio' in t:
+            summary.append(f"dedup ratio {t['dedup_ratio']:.1f}")
+        if 'last_duration' in t:
+            summary.append(
+                f"last run {t['last_duration']:.1f}s, median "
+                f"{t['median_duration']:.1f}s"
+                + (" (SLOWER)" if t['slower'] else ""))
+        for line in summary:
+            click.echo(f'   {line}')
@@ -0,0 +1,78 @@
+from ..core.borg import DefaultHandlers
+from ..core.util import truncate_path
+
+
+class BorgHandlers(DefaultHandlers):
+    def __init__(self, log, cli, **kwargs):
+        # FIXME: actually respect the progress option
+        kwargs.pop('progress', None)
+        self.cli = cli
+        self._spinners = dict()
+        super().__init__(log, **kwargs)
+
+    def __del__(self):
+        for contextmanager, _ in self._spinners.values():
+            contextmanager.__exit__(None, None, None)
+        self._spinners = dict()
+
+    @property
+    def _label(self):
+        # Prefix spinners with the task name when running on behalf of a task
+        # (cf. `Task.log`), since several of them might be shown at once.
+        if self.log.name != 'root':
+            return f"{self.log.name}: "
+        return ''
+
+    def _get_spinner(self, name):
+        try:
+            _, spinner = self._spinners[name]
+        except KeyError:
+            contextmanager = self.cli.spinner('')
+            spinner = contextmanager.__enter__()
+            self._spinners[name] = (contextmanager, spinner)
+        return spinner
+
+    def _close_spinner(self, name):
+        try:
+            (contextmanager, _) = self._spinners.pop(name)
+            contextmanager.__exit__(None, None, None)
+        except KeyError:
+            pass
+
+    def onArchiveProgress(self, msg):
+        if msg.finished:
+            self._close_spinner('onArchiveProgress')
+            return
+        path = msg.path
+        spinner = self._get_spinner('onArchiveProgress')
+        text = self._label + self.format_archive_progress(msg)
+        # FIXME: instead of ' - 15', determine the actual indentation caused by
+        # the logger
+        term_width = self.cli.width - 15
+        if len(text) <= term_width:
+            space = term_width - len(text)
+            if space >= 12:
+                text += truncate_path(path, space)
+        else:
+            text = truncate_path(path, term_width)
+
+
+        spinner.update(text)
+
+    def onProgressMessage(self, operation, msgid, finished, time, message=None,
+            **msg):
+        if finished:
+            self._close_spinner(('onProgressMessage', operation))
+        else:
+            spinner  = self._get_spinner(('onProgressMessage', operation))
+            spinner.update(f"{self._label}{self.human_readable_msgid(msgid)}: "
+                           f"{(message or '')}")
+
+    def onProgressPercent(self, operation, msgid, finished, time,
+            message=None, current=None, info=None, total=None, **msg):
+        if finished:
+            self._close_spinner(('onProgressPercent', operation))
+        else:
+            spinner  = self._get_spinner(('onProgressPercent', operation))
+            spinner.update(f"{self._label}{self.human_readable_msgid(msgid)}: "
+                           f"{(message or '')}")
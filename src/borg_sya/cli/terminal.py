@@ -1,8 +1,10 @@
 import blessings
 from contextlib import contextmanager
 import itertools
+import signal
 import sys
 import threading
+import time
 
 
 """ Other libraries providing spinners:
@@ -24,23 +26,30 @@ class Spinner():
         self._symbols = itertools.cycle(symbols)
         self.pos = pos
         self._cli = cli
+        self.dirty = False
 
     def __call__(self, msg):
         """
         >>> with cli.spinner("Starting...") as status:
                 # be productive
         ...     status("x %")
+
+        This only marks the spinner as dirty, it will be redrawn by the
+        terminal's next render tick. Thus, updates are cheap and can be
+        called for every message.
         """
-        with self._cli._locks[self._cli.stderr]:
-            self._advance(msg)
-            self._cli._redraw_spinners()
+        self.msg = msg
+        self.dirty = True
+        self._cli._request_render()
 
     def update(self, msg):
         self(msg)
 
-    def _advance(self, msg):
-        self.msg = msg
+    def _advance(self, msg=None):
+        if msg is not None:
+            self.msg = msg
         self._current_symbol = next(self._symbols)
+        self.dirty = False
 
     def render(self, width):
         return self._current_symbol + ' ' + self.msg
@@ -54,6 +63,10 @@ class DummySpinner(Spinner):
         self.silent = silent
         super().__init__(*args, **kwargs)
 
+    def __call__(self, msg):
+        # Nothing is drawn, thus there's nothing to coalesce.
+        self._advance(msg)
+
     def render(self, width):
         if not self.silent:
             return super().render(width)
@@ -62,9 +75,16 @@ class DummySpinner(Spinner):
 
 
 class Terminal():
-    def __init__(self):
-        self.stdout = blessings.Terminal(stream=sys.stdout)
-        self.stderr = blessings.Terminal(stream=sys.stderr)
+    # Spinners are redrawn at most this many times per second, no matter how
+    # often they are updated.
+    MAX_FPS = 15
+
+    def __init__(self, stdout=None, stderr=None):
+        """`stdout` and `stderr` default to `blessings.Terminal`s on the
+        standard streams.
+        """
+        self.stdout = stdout or blessings.Terminal(stream=sys.stdout)
+        self.stderr = stderr or blessings.Terminal(stream=sys.stderr)
         self._locks = {
             self.stdout: threading.Lock(),
             self.stderr: threading.Lock(),
@@ -73,14 +93,45 @@ class Terminal():
         # self.print_err(self.stderr.hide_cursor, end='')
 
         self._spinners = []
+        # What is currently displayed on each of the spinner lines.
+        self._rendered = []
+        self._render_requested = threading.Event()
+        self._render_thread = None
+
+        self._size = None
+        try:
+            self._prev_sigwinch = signal.signal(signal.SIGWINCH,
+                                                self._on_sigwinch)
+        except ValueError:
+            # Not in the main thread, don't cache the size.
+            self._prev_sigwinch = None
+
+    def _on_sigwinch(self, signum, frame):
+        # Don't take any locks here, the main thread might be holding them.
+        self._size = None
+        self._rendered = []
+        self._render_requested.set()
+        if callable(self._prev_sigwinch):
+            self._prev_sigwinch(signum, frame)
+
+    def _get_size(self):
+        """The size of the terminal on stderr, which is only queried after
+        it has been resized (if a SIGWINCH handler could be installed).
+        """
+        size = self._size
+        if size is None:
+            size = (self.stderr.height or 0, self.stderr.width or 0)
+            if self._prev_sigwinch is not None:
+                self._size = size
+        return size
 
     @property
     def height(self):
-        return self.term.height
+        return self._get_size()[0]
 
     @property
     def width(self):
-        return self.term.width
+        return self._get_size()[1]
 
     @contextmanager
     def hidden_cursor(self):
@@ -154,41 +205,89 @@ class Terminal():
         if text:
             self.print(text)
 
-    def _redraw_spinners(self):
-        """
-        
+    def _redraw_spinners(self, force=True):
+        """ Redraw the spinner lines below the cursor. Unless `force` is
+        given, only lines whose content changed since the last redraw are
+        written. Everything is emitted by a single write.
+
         Lock must be held.
         """
         term = self.stderr
-        with term.location():
-            last = self._spinners[-1] if self._spinners else None
-            for spinner in self._spinners:
-                self._print(
-                    term.move_x(0) + term.clear_eol + spinner.render(term.width),
-                    term=term,
-                    end='',
-                )
-                if spinner is not last:
-                    self._print(term.move_down, term=term, end='')
-            self._print(term.clear_eos, end='', term=term)
-        self._print(term.move_x(0), term=term, end='', flush=True)  # flush
+        width = self.width
+        if force:
+            self._rendered = []
+        out = [term.save]
+        rendered = []
+        changed = False
+        for i, spinner in enumerate(self._spinners):
+            if spinner.dirty:
+                spinner._advance()
+            text = spinner.render(width)
+            rendered.append(text)
+            if i > 0:
+                out.append(term.move_down)
+            if i >= len(self._rendered) or self._rendered[i] != text:
+                out.append(term.move_x(0) + term.clear_eol + text)
+                changed = True
+        if len(self._rendered) != len(rendered):
+            out.append(term.clear_eos)
+            changed = True
+        self._rendered = rendered
+        if changed:
+            out.append(term.restore + term.move_x(0))
+            self._print(''.join(out), term=term, end='', flush=True)
+
+    def _request_render(self):
+        """ Schedule a redraw of the spinners by the render thread, which
+        coalesces all updates within one frame.
+        """
+        self._render_requested.set()
+        thread = self._render_thread
+        if thread is None or not thread.is_alive():
+            with self._locks[self.stderr]:
+                thread = self._render_thread
+                if thread is None or not thread.is_alive():
+                    self._render_thread = threading.Thread(
+                        target=self._render_loop,
+                        name='sya-terminal-render',
+                        daemon=True,
+                    )
+                    self._render_thread.start()
+
+    def _render_loop(self):
+        term = self.stderr
+        interval = 1 / self.MAX_FPS
+        while True:
+            if not self._render_requested.wait(timeout=1):
+                with self._locks[term]:
+                    if not self._spinners:
+                        self._render_thread = None
+                        return
+                continue
+            self._render_requested.clear()
+            with self._locks[term]:
+                if self._spinners:
+                    self._redraw_spinners(force=False)
+            time.sleep(interval)
 
     @contextmanager
     def spinner(self, msg, symbols=None, silent_for_pipes=False):
         term = self.stderr
 
-        with self._locks[term]:
-            if term.does_styling:
+        if term.does_styling:
+            with self._locks[term]:
                 s = Spinner(self, len(self._spinners), symbols)
                 s._advance(msg)
                 self._spinners.append(s)
                 self._print('\n' + term.move_up, term=term, end='', flush=True)
                 self._redraw_spinners()
-            else:
-                s = DummySpinner(self, len(self._spinners), msg, symbols,
-                                 silent=silent_for_pipes
-                                 )
-                self.print(s.render())
+        else:
+            s = DummySpinner(self, len(self._spinners), symbols,
+                             silent=silent_for_pipes,
+                             )
+            s._advance(msg)
+            if msg and not silent_for_pipes:
+                self.print(s.render(self.width))
 
         yield s
 
@@ -206,7 +305,6 @@ if __name__ == '__main__':
     and
     >>> python terminal.py 2>&1 | tee
     """
-    import time
     T = 0.5
     t = Terminal()
     time.sleep(T)
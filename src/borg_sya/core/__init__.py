@@ -5,25 +5,41 @@
 #       managers.
 # TODO: different levels of verbosity
 # TODO: Use colorama
-# TODO: Bypass main() when doing `borg-sya {create|check|...} --help` in order
-#       not to crash on broken configs
 # TODO: Command that executes the pre-scripts and then drops the user in a
 #       shell
 
 
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from contextlib import contextmanager, ExitStack, nullcontext
 from functools import wraps
 import itertools
 import logging
 import os
+import statistics
+import threading
+import time
 
 import yaml
-from yaml.loader import SafeLoader
-from yaml.nodes import ScalarNode, MappingNode, SequenceNode
 
+from ..defaults import DEFAULT_CONFDIR, DEFAULT_CONFFILE, APP_NAME
 from . import util
 from .util import (ProcessLock, LazyReentrantContextmanager)
 from . import borg
-from .borg import (Borg, BorgError)
+from .borg import (Borg, BorgError, BorgPool, InvalidBorgOptions)
+from .cache import ArchiveCatalogue
+from . import config
+from .config import ConfigCache
+from .index import ContentIndex, index_repository
+from .journal import ChangeJournal, changed_since
+from .history import History
+from .metrics import Metrics
+from .operation import track
+from .patterns import PatternsFile
+from . import scriptgraph
+from .schedule import Schedule
+from . import snapshot as snapshots
+from .timing import Timings, no_timer
+from .transport import SSHTransport
 
 
 __all__ = ['InvalidConfigurationError',
@@ -36,17 +52,15 @@ __all__ = ['InvalidConfigurationError',
            ]
 
 
-DEFAULT_CONFDIR = '/etc/borg-sya'
-DEFAULT_CONFFILE = 'config.yaml'
-APP_NAME = 'borg-sya'
-
-
 class InvalidConfigurationError(Exception):
     pass
 
 
 class PrePostScript(LazyReentrantContextmanager):
-    def __init__(self, pre, pre_desc, post, post_desc, dryrun, log, dir):
+    def __init__(self, pre, pre_desc, post, post_desc, dryrun, log, dir,
+                 timer=no_timer, phases=('pre', 'post'),
+                 jobs=scriptgraph.DEFAULT_JOBS, passthrough=True,
+                 context=None, python_worker=None):
         super().__init__()
 
         self.pre = pre
@@ -57,16 +71,44 @@ class PrePostScript(LazyReentrantContextmanager):
         if not isinstance(self.post, list):
             self.post = [self.post]
         self.post_desc = post_desc
+        # Raises ValueError for invalid dependencies
+        self.pre_steps = scriptgraph.steps(self.pre)
+        self.post_steps = scriptgraph.steps(self.post)
+        self.jobs = jobs
+        # Whether the output of the scripts is copied to ours
+        self.passthrough = passthrough
+        # Passed to !python scripts, together with the phase
+        self.context = context or dict()
+        self.python_worker = python_worker
         self.dryrun = dryrun
         self.log = log
         self.dir = dir
+        # Accounts the time spent in the pre and post scripts to `phases`,
+        # cf. `timing.Timings.timer`.
+        self.timer = timer
+        self.phases = phases
 
-    def _run_script(self, script, args=None, env=None):
+    def _run_script(self, script, args=None, env=None, phase=None):
         if script:
             assert(isinstance(script, util.Script))
             res = script.run(args=args, env=env,
                        log=self.log, dryrun=self.dryrun,
-                       dir=self.dir)
+                       dir=self.dir, passthrough=self.passthrough,
+                       context=dict(self.context, phase=phase),
+                       python_worker=self.python_worker)
+
+    def _run_steps(self, steps, phase, desc, args=None):
+        times = scriptgraph.run(
+            steps,
+            lambda step: self._run_script(step.script, args=args,
+                                          phase=phase),
+            jobs=self.jobs,
+        )
+        if not scriptgraph.is_sequential(steps):
+            path = scriptgraph.critical_path(steps, times)
+            self.timer.critical_path(phase, path)
+            self.log.info(f"Critical path of the {desc}: "
+                          f"{scriptgraph.format_path(path)}")
 
     def _announce(self, msg):
         if not self.dryrun:
@@ -79,18 +121,20 @@ class PrePostScript(LazyReentrantContextmanager):
         # propagate!
         self._announce(self.pre_desc)
         if self.pre:
-            for script in self.pre:
-                self._run_script(script)
+            with self.timer(self.phases[0]):
+                self._run_steps(self.pre_steps, self.phases[0],
+                                self.pre_desc)
         elif self.dryrun:
             self.log.info("    (no scripts specified)")
 
     def _exit(self, type, value, traceback):
         self._announce(self.post_desc)
         if self.post:
-            for script in self.post:
+            with self.timer(self.phases[1]):
                 # Maybe use an environment variable instead?
                 # (BACKUP_STATUS=<borg returncode>)
-                self._run_script(script, args=[str(1 if type else 0)])
+                self._run_steps(self.post_steps, self.phases[1],
+                                self.post_desc, args=[str(1 if type else 0)])
         elif self.dryrun:
             self.log.info("    (no scripts specified)")
 
@@ -113,17 +157,27 @@ class Repository(borg.Repository):
     def __init__(self, name, path, cx,
                  compression=None, remote_path=None, passphrase=None,
                  pre=None, pre_desc=None, post=None, post_desc=None,
+                 ssh=None,
                  ):
         self.cx = cx
         super().__init__(name, path=path,
                          compression=compression, remote_path=remote_path,
                          passphrase=passphrase,
                          borg=cx.borg,
+                         transport=SSHTransport.from_config(name, path, ssh,
+                                                            cx),
                          )
+        self.ssh = ssh
         self._lock = self.cx.lock(str(self))
         self.scripts = PrePostScript(pre, pre_desc, post, post_desc,
-                                     cx.dryrun, cx.log, cx.confdir)
+                                     cx.dryrun, cx.log, cx.confdir,
+                                     timer=cx.timings.timer(name),
+                                     phases=('mount', 'umount'),
+                                     passthrough=cx.script_passthrough,
+                                     context={'repository': name},
+                                     python_worker=cx.python_worker)
         self.lazy = False
+        self.catalogue = ArchiveCatalogue(cx.cachedir, path)
 
     @classmethod
     def from_yaml(cls, name, cfg, cx):
@@ -131,27 +185,32 @@ class Repository(borg.Repository):
         passphrase = cfg.get('passphrase', '')
         passphrase_file = cfg.get('passphrase-file', None)
         if passphrase_file:
-            passphrase_file = os.path.join(cx, passphrase_file)
+            passphrase_file = os.path.join(cx.confdir, passphrase_file)
             try:
                 with open(passphrase_file) as f:
                     passphrase = f.readline().strip()
             except OSError as e:
                 raise InvalidConfigurationError()
 
-        return cls(
-            # BorgRepository args
-            name,
-            path=cfg['path'],
-            compression=cfg.get('compression', None),
-            remote_path=cfg.get('remote-path', None),
-            passphrase=passphrase,
-            cx=cx,
-            # PrePostScript args
-            pre=cfg.get('mount', None),
-            pre_desc=f'mount script for repository {name}',
-            post=cfg.get('umount', None),
-            post_desc=f'unmount script for repository {name}',
-        )
+        try:
+            return cls(
+                # BorgRepository args
+                name,
+                path=cfg['path'],
+                compression=cfg.get('compression', None),
+                remote_path=cfg.get('remote-path', None),
+                passphrase=passphrase,
+                cx=cx,
+                # PrePostScript args
+                pre=cfg.get('mount', None),
+                pre_desc=f'mount script for repository {name}',
+                post=cfg.get('umount', None),
+                post_desc=f'unmount script for repository {name}',
+                ssh=cfg.get('ssh', None),
+            )
+        except (ValueError, TypeError) as e:
+            # Invalid dependencies between the scripts, or ssh settings
+            raise InvalidConfigurationError(f"Repository '{name}': {e}")
 
     def to_yaml(self):
         """ NOTE: This doesn't round-trip, since defaults and any information
@@ -166,6 +225,7 @@ class Repository(borg.Repository):
         if self.remote_path: out['remote-path'] = self.remote_path
         if self.scripts.pre: out['mount'] = self.scripts.pre
         if self.scripts.post: out['umount'] = self.scripts.post
+        if self.ssh: out['ssh'] = self.ssh
 
         return out
 
@@ -177,16 +237,60 @@ class Repository(borg.Repository):
         return(self)
 
     def __enter__(self):
-        self._lock.__enter__()
+        # Only the outermost enter actually takes the lock, which doesn't
+        # wait but raises LockInUse if it is held by another process.
+        with (nullcontext() if self._lock.held
+              else self.cx.timings.phase(self.name, 'acquire-lock')):
+            self._lock.__enter__()
         self.scripts(lazy=self.lazy).__enter__()
+        if self.transport:
+            # After the mount scripts, which might e.g. bring up a VPN
+            self.transport(lazy=self.lazy).__enter__()
         self.lazy = False
+        self.catalogue.validate()
 
     def __exit__(self, *exc):
+        if self.transport:
+            self.transport.__exit__(*exc)
         self.scripts.__exit__(*exc)
         self._lock.__exit__(*exc)
 
-    def check(self, progress, **kwargs):
+    def archives(self, prefix=None):
+        """The archives in this repository (optionally only those whose name
+        starts with `prefix`), ordered by time. Answered from the local
+        catalogue if it is fresh, otherwise by `borg list`.
+        """
         with self:
+            archives = self.catalogue.get()
+            if archives is None:
+                listing = self.cx.borg.list_repository(
+                    self,
+                    handlers=self.cx.handler_factory(),
+                )
+                if self.cx.dryrun:
+                    archives = listing['archives']
+                else:
+                    archives = self.catalogue.store(listing)
+        if prefix:
+            archives = [a for a in archives if a['name'].startswith(prefix)]
+        return archives
+
+    def update_index(self, index):
+        """Add the contents of all archives which are not yet in the
+        `ContentIndex` to it. Returns the names of the newly indexed archives.
+        """
+        if self.cx.dryrun:
+            # Nothing would be listed, don't drop the indexed archives.
+            return []
+        with self:
+            return list(index_repository(
+                index, self, self.cx.borg,
+                handlers=self.cx.handler_factory(),
+                archives=self.archives(),
+            ))
+
+    def check(self, progress, **kwargs):
+        with self.cx.operation('check', self.name), self:
             self.cx.borg.check(self,
                                handlers=self.cx.handler_factory(
                                    progress=progress,
@@ -203,6 +307,8 @@ class Task():
                  repo, enabled, prefix, keep,
                  includes, include_file, exclude_file, path_prefix,
                  pre, pre_desc, post, post_desc,
+                 schedule=None, skip_if_unchanged=False, snapshot=None,
+                 script_jobs=scriptgraph.DEFAULT_JOBS,
                  ):
         self.name = name
         self.cx = cx
@@ -214,10 +320,21 @@ class Task():
         self.include_file = include_file
         self.exclude_file = exclude_file
         self.path_prefix = path_prefix
+        self.schedule = schedule
+        self.skip_if_unchanged = skip_if_unchanged
+        self.snapshot = snapshot
 
         self.lazy = False
         self.scripts = PrePostScript(pre, pre_desc, post, post_desc,
-                                     cx.dryrun, cx.log, cx.confdir)
+                                     cx.dryrun, cx.log, cx.confdir,
+                                     timer=cx.timings.timer(name),
+                                     jobs=script_jobs,
+                                     passthrough=cx.script_passthrough,
+                                     context={'task': name,
+                                              'repository': repo.name},
+                                     python_worker=cx.python_worker)
+        self.patterns = PatternsFile(cx.cachedir, name)
+        self.journal = ChangeJournal(cx.cachedir, name)
 
     @classmethod
     def from_yaml(cls, name, cfg, cx):
@@ -256,6 +373,20 @@ class Task():
             if exclude_file:
                 exclude_file = os.path.join(cx.confdir, exclude_file)
 
+            snapshot = cfg.get('snapshot', None)
+            if snapshot:
+                if cfg.get('path-prefix'):
+                    raise InvalidConfigurationError(
+                        f"'path-prefix' and 'snapshot' are mutually "
+                        f"exclusive in configuration for task {name}"
+                    )
+                snapshot = snapshots.from_config(name, cx, snapshot)
+
+            schedule = cfg.get('schedule', None)
+            if schedule:
+                schedule = Schedule(schedule, jitter=cfg.get('jitter', 0),
+                                    seed=name)
+
             return cls(
                 name,
                 cx=cx,
@@ -272,6 +403,10 @@ class Task():
                 pre_desc=f"'{name}' pre-backup script",
                 post=cfg.get('post', None),
                 post_desc=f"'{name}' post-backup script",
+                schedule=schedule,
+                skip_if_unchanged=cfg.get('skip-if-unchanged', False),
+                snapshot=snapshot,
+                script_jobs=cfg.get('script-jobs', scriptgraph.DEFAULT_JOBS),
             )
         except (KeyError, ValueError, TypeError) as e:
             raise InvalidConfigurationError(str(e))
@@ -291,6 +426,13 @@ class Task():
         if self.prefix != '{hostname}': out['prefix'] = self.prefix
         if self.scripts.pre: out['pre'] = self.scripts.pre
         if self.scripts.post: out['post'] = self.scripts.post
+        if self.skip_if_unchanged: out['skip-if-unchanged'] = True
+        if self.schedule:
+            out['schedule'] = self.schedule.spec
+            if self.schedule.jitter: out['jitter'] = self.schedule.jitter
+        if self.snapshot: out['snapshot'] = self.snapshot.config
+        if self.scripts.jobs != scriptgraph.DEFAULT_JOBS:
+            out['script-jobs'] = self.scripts.jobs
 
         return out
 
@@ -300,6 +442,21 @@ class Task():
     def __str__(self):
         return(self.name)
 
+    @property
+    def archive_prefix(self):
+        """The prefix of this task's archive names with borg's placeholders
+        replaced, i.e. as it appears in listings.
+        """
+        return borg.helpers.replace_placeholders(f'{self.prefix}-')
+
+    @property
+    def log(self):
+        """A child of the context's logger named after this task, such that
+        output remains attributable when several tasks run concurrently.
+        """
+        if self.cx.log:
+            return self.cx.log.getChild(self.name)
+
     def __call__(self, *, lazy=False):
         self.lazy = lazy
         return(self)
@@ -307,71 +464,184 @@ class Task():
     @if_enabled
     def __enter__(self):
         self.repo(lazy=self.lazy).__enter__()
-        self.scripts(lazy=self.lazy).__enter__()
+        # With a snapshot, the scripts only run while taking it.
+        if not self.snapshot:
+            self.scripts(lazy=self.lazy).__enter__()
         self.lazy = False
 
     @if_enabled
     def __exit__(self, *exc):
-        self.scripts.__exit__(*exc)
+        if not self.snapshot:
+            self.scripts.__exit__(*exc)
         self.repo.__exit__(*exc)
 
+    @if_enabled
+    def backup(self, progress):
+        """`create` an archive and `prune` the old ones. Nothing is pruned if
+        the archive was skipped, since nothing changed.
+        """
+        if self.create(progress) is not False:
+            self.prune()
+
     @if_enabled
     def create(self, progress):
+        """Returns the JSON output of borg (None in dry runs), or False if
+        `skip-if-unchanged` applies.
+        """
         # TODO: Human-readable logging.
-        # include and exclude patterns
-        includes = self.includes[:]
-        excludes = []
-        if self.include_file:
-            with open(self.include_file) as f:
-                for line in f.readlines():
-                    if line.startswith('- '):
-                        excludes.append(line[2:])
-                    else:
-                        includes.append(line)
-        if self.exclude_file:
-            with open(self.exclude_file) as f:
-                excludes.extend(f.readlines())
-
-        includes = [i.rstrip('\r\n') for i in includes]
-        excludes = [e.rstrip('\r\n') for e in excludes]
-
-        # TODO: Proper error handling for invalid paths
-        assert(all(os.path.isabs(i) for i in includes))
-        assert(all(os.path.isabs(e) for e in excludes))
-
-        if self.path_prefix:
-            assert(os.path.isabs(self.path_prefix))
-            # Strip the initial '/' such that os.path.join will treat these
-            # as relative paths
-            assert(all(i.startswith(os.sep) for i in includes))
-            assert(all(e.startswith(os.sep) for e in excludes))
-
-            includes = [i.lstrip(os.sep) for i in includes]
-            excludes = [e.lstrip(os.sep) for e in excludes]
-
-            includes = [os.path.join(self.path_prefix, i) for i in includes]
-            excludes = [os.path.join(self.path_prefix, e) for e in excludes]
-
-        # run the backup
-        with self:
-            self.cx.borg.create(
-                self.repo,
-                includes, excludes,
-                prefix=f'{self.prefix}-{{now:%Y-%m-%d_%H:%M:%S}}',
-                stats=True,
-                handlers=self.cx.handler_factory(progress=progress)
+        summary = self.update_patterns()
+        if self.log:
+            self.log.info(
+                f"{summary['roots']} paths to back up, "
+                f"{summary['excludes']} exclude patterns "
+                f"({'regenerated' if summary['regenerated'] else 'unchanged'}"
+                f", {self.patterns.path})"
             )
 
+        # Scan before locking the repository and running the pre-scripts
+        # (or taking the snapshot), which are not needed when skipping.
+        if self.skip_if_unchanged and self._unchanged(summary['key']):
+            return False
+
+        # Files changed after this point might be missing from the archive,
+        # hence they need to be newer than the journalled start. With a
+        # snapshot, that is before the pre-scripts ran and it was taken.
+        start = time.time()
+        with ExitStack() as stack:
+            if self.snapshot:
+                stack.enter_context(self)
+                stack.enter_context(self._snapshot())
+
+            # run the backup
+            with self.cx.operation('create', self.repo.name,
+                                   self.name) as op, \
+                    self, self.cx.timings.phase(self.name, 'create'):
+                result = self.cx.borg.create(
+                    self.repo,
+                    [], patterns_from=self.patterns.path,
+                    prefix=f'{self.prefix}-{{now:%Y-%m-%d_%H:%M:%S}}',
+                    stats=True,
+                    handlers=self.cx.handler_factory(progress=progress,
+                                                     log=self.log)
+                )
+                if result:
+                    op.archive = result['archive']
+                    self.repo.catalogue.update(
+                        added=[result['archive']],
+                        repository=result.get('repository'),
+                    )
+        if result:
+            self.journal.record(start, summary['key'])
+        return result
+
+    @contextmanager
+    def _snapshot(self):
+        """Take the snapshot between the pre- and post-scripts, and release
+        it on exit.
+        """
+        t0 = time.perf_counter()
+        with self.scripts, self.cx.timings.phase(self.name, 'snapshot'):
+            self.snapshot.take(list(self.roots()))
+        self.cx.info(f"-- {self}: Took a snapshot at "
+                     f"'{self.snapshot.prefix}' in "
+                     f"{time.perf_counter() - t0:.2f}s (including the pre- "
+                     f"and post-scripts).")
+        try:
+            yield
+        finally:
+            with self.cx.timings.phase(self.name, 'release'):
+                self.snapshot.release()
+
+    def roots(self):
+        """The paths to back up, as they are on the live system.
+        """
+        return self.patterns.roots(strip=self._snapshot_prefix)
+
+    def excludes(self):
+        """The exclude patterns, as they apply on the live system.
+        """
+        return self.patterns.excludes(strip=self._snapshot_prefix)
+
+    @property
+    def _snapshot_prefix(self):
+        return self.snapshot.prefix if self.snapshot else ''
+
+    def update_patterns(self):
+        """Regenerate the patterns file if necessary, cf.
+        `PatternsFile.update`.
+        """
+        try:
+            summary = self.patterns.update(
+                self.includes, self.include_file, self.exclude_file,
+                self._snapshot_prefix or self.path_prefix,
+            )
+        except ValueError as e:
+            raise InvalidConfigurationError(f"Task '{self.name}': {e}")
+        if not summary['roots']:
+            raise InvalidBorgOptions(
+                'No paths given to include in the archive',
+            )
+        return summary
+
+    def _unchanged(self, key):
+        """Whether nothing changed in the paths to back up since the last
+        archive, cf. `journal`. Logs the decision.
+        """
+        last = self.journal.last()
+        if not last or last.get('key') != key:
+            self.cx.info(f"-- {self}: No archive with the current patterns "
+                         f"yet, backing up.")
+            return False
+        with self.cx.timings.phase(self.name, 'scan'):
+            t0 = time.perf_counter()
+            path, scanned = changed_since(self.roots(),
+                                          last['start'])
+            elapsed = time.perf_counter() - t0
+        since = time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(last['start']))
+        stats = f"scanned {scanned} entries in {elapsed:.2f}s"
+        if path:
+            self.cx.info(f"-- {self}: '{path}' changed since the last "
+                         f"archive ({since}), backing up ({stats}).")
+            return False
+
+        with self.cx.operation('skip', self.repo.name, self.name):
+            pass
+        durations = [r['duration'] for r in self.cx.history.runs(self.name)
+                     if r['success'] and r['duration'] is not None][-10:]
+        if durations:
+            saved = max(statistics.median(durations) - elapsed, 0)
+            stats += f", saving about {saved:.0f}s"
+        self.cx.info(f"-- {self}: Nothing changed since the last archive "
+                     f"({since}), skipping it ({stats}).")
+        return True
+
     @if_enabled
     def prune(self):
+        with self.cx.operation('prune', self.repo.name, self.name) as op:
+            op.pruned = 0
+            self._prune(op)
+
+    def _prune(self, op):
         try:
             with self:
                 for intervals in self.keep:
-                    self.cx.borg.prune(self.repo,
-                                       intervals,
-                                       prefix=f'{self.prefix}-',
-                                       handlers=self.cx.handler_factory()
-                                       )
+                    detail = ', '.join(f'{k}={v}'
+                                       for k, v in intervals.items())
+                    with self.cx.timings.phase(self.name, 'prune', detail):
+                        pruned = self.cx.borg.prune(
+                            self.repo,
+                            intervals,
+                            prefix=f'{self.prefix}-',
+                            handlers=self.cx.handler_factory(log=self.log),
+                        )
+                    if pruned is None:
+                        self.repo.catalogue.update(removed=None)
+                    elif pruned:
+                        op.pruned += len(pruned)
+                        self.repo.catalogue.update(
+                            removed=[id for _, id in pruned],
+                        )
         except BorgError as e:
             self.cx.error(e)
             self.cx.error(f"'{self.name}' old files cleanup failed. "
@@ -384,33 +654,35 @@ class Task():
             raise InvalidConfigurationError(e)
 
 
-class SyaSafeLoader(SafeLoader):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        seq = [(SequenceNode, None)]
-        for a, b in [('tasks', 'pre'),
-                     ('tasks', 'post'),
-                     ('repositories', 'mount'),
-                     ('repositories', 'umount')]:
-            path = [(MappingNode, a),
-                    (MappingNode, None),  # name
-                    (MappingNode, b),
-                    ]
-            self.add_path_resolver('!external_script', path, ScalarNode)
-            self.add_path_resolver('!external_script', path + seq, ScalarNode)
-
-
 class Context():
-    def __init__(self, confdir, dryrun, verbose, log, repos, tasks):
+    def __init__(self, confdir, dryrun, verbose, log, repos, tasks,
+                 cachedir=None):
         self.confdir = confdir
-        self.borg = Borg(dryrun)
+        self.cachedir = cachedir or util.user_cache_dir(APP_NAME)
+        self.timings = Timings()
+        self.metrics = Metrics(None, None)
+        self.history = History(os.path.join(self.cachedir, 'history.sqlite'))
+        self._borg = Borg(dryrun)
+        self.borg_pool = BorgPool(dryrun)
+        self._local = threading.local()
         self.dryrun = dryrun
         self.log = log
         self.verbose = verbose
         self.repos = repos or dict()
         self.tasks = tasks or dict()
         self.handler_factory = None
+        self.script_passthrough = True
+        self.python_worker = None
+
+    def operation(self, operation, repository, task=None):
+        """Track an operation for the metrics and the history, cf.
+        `operation.track`.
+        """
+        return track(operation, repository, task,
+                     sinks=[self.metrics, self.history], warn=self.warning)
+
+    def content_index(self):
+        return ContentIndex(os.path.join(self.cachedir, 'index.sqlite'))
 
     @classmethod
     def from_configuration(cls, log_handler, confdir, conffile):
@@ -423,13 +695,24 @@ class Context():
 
         if not os.path.isabs(conffile):
             conffile = os.path.join(confdir, conffile)
-        try:
-            with open(conffile, 'r') as f:
-                cfg = yaml.load(f, SyaSafeLoader)
-        except OSError as e:
-            log.error(f"Configuration file at '{conffile}' not found or not "
-                      f"accessible:\n{e}")
-            raise
+        cachedir = util.user_cache_dir(APP_NAME)
+        cache = ConfigCache(cachedir, conffile)
+        cfg = cache.load()
+        fingerprint = None
+        if cfg is None:
+            fingerprint = config.fingerprint([cache.conffile])
+            try:
+                cfg = config.parse(conffile)
+            except OSError as e:
+                log.error(f"Configuration file at '{conffile}' not found or "
+                          f"not accessible:\n{e}")
+                raise
+            except yaml.YAMLError as e:
+                # E.g. a !python script with a syntax error
+                raise InvalidConfigurationError(
+                    f"Invalid configuration file '{conffile}':\n{e}")
+            fingerprint += config.fingerprint(
+                config.referenced_files(cfg, confdir))
 
         # TODO: proper validation of the config file
         verbose = cfg['sya'].get('verbose', False)
@@ -439,7 +722,23 @@ class Context():
         cx = cls(confdir=confdir, dryrun=False,
                  verbose=verbose, log=log,
                  repos=None, tasks=None,
+                 cachedir=cachedir,
                  )
+        script_output = cfg['sya'].get('script-output', 'passthrough')
+        if script_output not in ('passthrough', 'quiet'):
+            raise InvalidConfigurationError(
+                "'script-output' must be either 'passthrough' or 'quiet'")
+        cx.script_passthrough = (script_output == 'passthrough')
+        python_scripts = cfg['sya'].get('python-scripts', 'inline')
+        if python_scripts not in ('inline', 'worker'):
+            raise InvalidConfigurationError(
+                "'python-scripts' must be either 'inline' or 'worker'")
+        if python_scripts == 'worker':
+            cx.python_worker = util.PythonWorker()
+        metrics_file = cfg['sya'].get('metrics-file')
+        if metrics_file:
+            cx.metrics = Metrics(os.path.join(confdir, metrics_file),
+                                 os.path.join(cx.cachedir, 'metrics.json'))
         cx.repos = {repo: Repository.from_yaml(repo, rcfg, cx)
                     for repo, rcfg in cfg['repositories'].items()
                     }
@@ -447,6 +746,17 @@ class Context():
                     for task, tcfg in cfg['tasks'].items()
                     }
 
+        if fingerprint is not None:
+            # The configuration is valid, cache it with the passphrases
+            # resolved.
+            for name, rcfg in cfg['repositories'].items():
+                if rcfg.pop('passphrase-file', None):
+                    rcfg['passphrase'] = cx.repos[name].passphrase
+            try:
+                cache.store(cfg, fingerprint)
+            except OSError as e:
+                cx.debug(f"Could not cache the configuration: {e}")
+
         return cx
     
     @classmethod
@@ -466,6 +776,13 @@ class Context():
             else:
                 self.log.setLevel(logging.WARNING)
 
+    @property
+    def borg(self):
+        """The Borg instance bound to the current worker thread by
+        `run_tasks`, or the default instance otherwise.
+        """
+        return getattr(self._local, 'borg', self._borg)
+
     @property
     def dryrun(self):
         return self._dryrun
@@ -473,7 +790,10 @@ class Context():
     @dryrun.setter
     def dryrun(self, value):
         self._dryrun = value
-        self.borg.dryrun = value
+        self._borg.dryrun = value
+        self.borg_pool.dryrun = value
+        self.metrics.dryrun = value
+        self.history.dryrun = value
         for obj in itertools.chain(
                 getattr(self, 'tasks', {}).values(),
                 getattr(self, 'repos', {}).values()
@@ -495,10 +815,64 @@ class Context():
         except KeyError as e:
             self.error(f'No such task: {e}')
             raise SystemExit()
-        tasks = tasks or self.tasks
+        tasks = tasks or list(self.tasks.values())
         repos = set(t.repo for t in tasks if t.enabled)
         return (tasks, repos)
 
+    def run_tasks(self, func, tasks, jobs=1):
+        """Call `func(task)` for all tasks.
+
+        If `jobs > 1`, tasks are grouped by repository and up to `jobs` groups
+        are processed concurrently, each by a worker thread with its own Borg
+        instance from `borg_pool`. Within a group, tasks run sequentially in
+        the given order, such that tasks on the same repository remain
+        serialized through the repository's `ProcessLock`.
+        """
+        if jobs <= 1:
+            for task in tasks:
+                func(task)
+            return
+
+        groups = dict()
+        for task in tasks:
+            groups.setdefault(task.repo, []).append(task)
+
+        def worker(group):
+            with self.pooled_borg():
+                for task in group:
+                    func(task)
+
+        with ThreadPoolExecutor(max_workers=min(jobs, len(groups)),
+                                thread_name_prefix='sya-worker',
+                                ) as executor:
+            futures = [executor.submit(worker, group)
+                       for group in groups.values()]
+            try:
+                wait(futures, return_when=FIRST_EXCEPTION)
+            except KeyboardInterrupt:
+                for f in futures:
+                    f.cancel()
+                self.borg_pool.interrupt()
+                raise
+            # Don't start any further groups once one of them failed.
+            for f in futures:
+                f.cancel()
+        for f in futures:
+            if not f.cancelled():
+                f.result()
+
+    @contextmanager
+    def pooled_borg(self):
+        """Bind a Borg instance from `borg_pool` to the current thread, cf.
+        `borg`.
+        """
+        with self.borg_pool.acquire() as borg:
+            self._local.borg = borg
+            try:
+                yield borg
+            finally:
+                del self._local.borg
+
     def lock(self, *args):
         return ProcessLock('sya' + self.confdir + '-'.join(*args))
 
@@ -508,7 +882,7 @@ class Context():
 
     @handler_factory.setter
     def handler_factory(self, func):
-        self._handler_factory = func or (lambda: None)
+        self._handler_factory = func or (lambda **kwargs: None)
 
     # def print(self, msg):
     #     if self.log:
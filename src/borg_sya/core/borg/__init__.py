@@ -1,11 +1,14 @@
-from functools import wraps
+from contextlib import closing, contextmanager
+from functools import lru_cache, wraps
 import json
 import logging
-from queue import Queue
+import os
+import re
+import selectors
 import signal
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, TimeoutExpired
 import sys
-from threading import Condition, Thread
+from threading import Lock
 
 from .defs import (
     BorgError,
@@ -16,9 +19,12 @@ from .defs import (
     _MESSAGE_IDS,
     _VERBOSITY_OPTIONS,
 )
+from .framing import JsonFramer, LineFramer
 from .helpers import (
     format_file_size,
 )
+from .messages import MESSAGE_CLASSES
+from . import recording
 
 from ..util import which, format_commandline
 
@@ -29,19 +35,36 @@ from ..util import which, format_commandline
 #   directly display the JSON?
 
 
-try:
-    BINARY = which('borg')
-except RuntimeError as e:
-    sys.exit(str(e))
+@lru_cache(maxsize=None)
+def binary():
+    """The borg executable, looked up when it is first run. Can point to a
+    stand-in, such as the replay tool from `recording`.
+    """
+    try:
+        return os.environ.get('SYA_BORG_BINARY') or which('borg')
+    except RuntimeError as e:
+        sys.exit(str(e))
 
 
 class InvalidBorgOptions(Exception):
     pass
 
 
+# Cf. borg.helpers.format_archive: '%-36s %s [%s]' % (name, time, id),
+# prefixed by 'Pruning archive: ' (borg 1.1) or 'Pruning archive (1/3): '
+# (borg >= 1.2)
+_PRUNING = 'Pruning archive'
+_PRUNED_ARCHIVE = re.compile(
+    r'Pruning archive(?: \(\d+/\d+\))?: (?P<name>.*?)\s+'
+    r'\w{3}, \d{4}-\d\d-\d\d \d\d:\d\d:\d\d '
+    r'\[(?P<id>[0-9a-f]+)\]'
+)
+
+
 class Repository():
     def __init__(self, name, path, borg,
                  compression=None, remote_path=None, passphrase=None,
+                 transport=None,
                  ):
         self.name = name
         self.path = path
@@ -49,6 +72,8 @@ class Repository():
         self.compression = compression
         self.remote_path = remote_path
         self.passphrase = passphrase
+        # For remote repositories, cf. `transport.SSHTransport`
+        self.transport = transport
 
     def borg_args(self, create=False):
         args = []
@@ -65,6 +90,8 @@ class Repository():
         env = {}
         if self.passphrase:
             env['BORG_PASSPHRASE'] = self.passphrase
+        if self.transport:
+            env['BORG_RSH'] = self.transport.rsh()
 
         return(env)
 
@@ -91,15 +118,47 @@ def _while_running(while_running=True):
     return decorator
 
 
+# Classes of msgids of log messages, used as part of the key to look up
+# handlers. Log messages with other msgids are classified by their name.
+_MSGID_CLASSES = {
+    **{msgid: 'error' for msgid in _ERROR_MESSAGE_IDS},
+    **{msgid: 'prompt' for msgid in _PROMPT_MESSAGE_IDS},
+}
+
+
+def handles(type, msgid_class=None):
+    """Decorator that registers a method of a `DefaultHandlers` subclass as
+    handler for messages of the given `type` (and, for log messages, the given
+    `msgid_class`, which is one of 'error', 'prompt', 'borg' or None).
+    """
+    def decorator(func):
+        func._handles = getattr(func, '_handles', ()) + ((type, msgid_class),)
+        return func
+    return decorator
+
+
+def _collect_handlers(cls):
+    handlers = dict(getattr(cls, '_HANDLERS', {}))
+    for name, attr in vars(cls).items():
+        for key in getattr(attr, '_handles', ()):
+            handlers[key] = name
+    return handlers
+
+
 class DefaultHandlers():
     """State machine base class for handling any status emitted by borg or
     user interaction. The implementation is very basic, actual interaction
     (e.g. reacting to prompts by borg) need to be handled in sublasses.
 
     What the base class does is some basic dispatching based on message type
-    and content. It also passes the contents of the bare json as keyword
-    arguments.
-
+    and content. Handlers are registered by the `handles` decorator and looked
+    up in a table keyed on `(type, msgid_class)`, which is built once per
+    class. Overriding a registered method in a subclass is sufficient to
+    replace the handler.
+
+    The most frequent messages (`archive_progress` and `file_status`) are
+    passed as a single object from `messages.MESSAGE_CLASSES`, for all other
+    messages the contents of the bare json are passed as keyword arguments.
     """
     # The following flags control a number of common options that will be
     # passed to borg, such as `--progress`, `--verbose`, etc.
@@ -107,61 +166,46 @@ class DefaultHandlers():
     handles_progress = True
     wants_loglevel = logging.INFO
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._HANDLERS = _collect_handlers(cls)
+
     def __init__(self, log):
         self.log = log
         self._spinners = dict()
+        self._table = {
+            key: (getattr(self, name), MESSAGE_CLASSES.get(key[0]))
+            for key, name in self._HANDLERS.items()
+        }
+        self._unhandled = (self._onUnhandled, None)
 
     def _dispatch(self, msg):
-        if msg.get('type') == 'log_message':
-            name = msg.get('name')
-            if msg.get('msgid') in _ERROR_MESSAGE_IDS:
-                f = self.onError
-            elif msg.get('msgid') in _PROMPT_MESSAGE_IDS:
-                f = self.onPrompt
-            # elif msg.get('msgid') in _OPERATION_MESSAGE_IDS:
-            #     pass
-            elif name.startswith('borg.'):
-                f = self.onBorgOutput
-            else:
-                # Debug messages, ...
-                f = self.onOtherMessage
-        # TODO: Maybe combine progress_message/_percent into one handler
-        # onProgress(message=msg.get("msgcontent", ""), percent=msg.get("percent", None), **...)
-        elif msg['type'] == 'progress_message':
-            f = self.onProgressMessage
-        elif msg['type'] == 'progress_percent':
-            f = self.onProgressPercent
-        elif msg['type'] == 'archive_progress':
-            f = self.onArchiveProgress
-        elif msg['type'] == 'file_status':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_prompt':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_prompt_retry':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_invalid_answer':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_accepted_default':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_accepted_true':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_accepted_false':
-            f = self._onUnhandled
-        elif msg['type'] == 'question_env_answer':
-            f = self._onUnhandled
+        type = msg.get('type')
+        if type == 'log_message':
+            msgid_class = _MSGID_CLASSES.get(msg.get('msgid'))
+            if msgid_class is None and msg.get('name', '').startswith('borg.'):
+                msgid_class = 'borg'
+            key = (type, msgid_class)
         else:
-            f = self._onUnhandled
+            # Debug messages, ...
+            key = (type, None)
 
-        f(**msg)
+        f, message_class = self._table.get(key, self._unhandled)
+        if message_class is None:
+            f(**msg)
+        else:
+            f(message_class(msg))
 
     def _onUnhandled(self, **msg):
-        self.log.debug(f"Unknown message received from borg, type={msg['type']}")
+        self.log.debug(f"Unknown message received from borg, type={msg.get('type')}")
 
+    @handles('log_message', 'error')
     def onError(self, **msg):
         # Does this always mean that there was a fatal error, or would it be
         # sensible to communicate this to the outside in a reentrant way?
         raise BorgError(**msg)
 
+    @handles('log_message', 'borg')
     def onBorgOutput(self, **msg):
         """Receives the messages that borg would write to sterr on a standard
         (non-JSON) CLI session
@@ -178,10 +222,14 @@ class DefaultHandlers():
 
         return s or msgid
 
+    # TODO: Maybe combine progress_message/_percent into one handler
+    # onProgress(message=msg.get("msgcontent", ""), percent=msg.get("percent", None), **...)
+    @handles('progress_message')
     def onProgressMessage(self, operation, msgid, finished, time,
             message=None, **msg):
         pass
 
+    @handles('progress_percent')
     def onProgressPercent(self, operation, msgid, finished, time,
             message=None, current=None, info=None, total=None, **msg):
         """ Parse a progress message including percentage. Note that
@@ -193,141 +241,132 @@ class DefaultHandlers():
         """
         pass
 
-    def format_archive_progress(self,
-                                original_size, compressed_size,
-                                deduplicated_size, nfiles, time,
-                                **msg):
+    def format_archive_progress(self, msg):
         # Mimic borg's progress output
         return '{osize} O {csize} C {dsize} D {nfiles} N '.format(
-                    osize=format_file_size(original_size),
-                    csize=format_file_size(compressed_size),
-                    dsize=format_file_size(deduplicated_size),
-                    nfiles=nfiles,
+                    osize=format_file_size(msg.original_size),
+                    csize=format_file_size(msg.compressed_size),
+                    dsize=format_file_size(msg.deduplicated_size),
+                    nfiles=msg.nfiles,
         )
 
-    def onArchiveProgress(self, path, **msg):
-        # TODO: truncate path
-        self.log.info(self.format_archive_progress(**msg) + path)
+    @handles('archive_progress')
+    def onArchiveProgress(self, msg):
+        if not msg.finished:
+            # TODO: truncate path
+            self.log.info(self.format_archive_progress(msg) + msg.path)
+
+    @handles('file_status')
+    def onFileStatus(self, msg):
+        pass
 
+    @handles('log_message', 'prompt')
     def onPrompt(self, **msg):
         raise RuntimeError()
 
+    @handles('log_message')
     def onOtherMessage(self, **msg):
         pass
 
 
-POISON = object()
+DefaultHandlers._HANDLERS = _collect_handlers(DefaultHandlers)
 
 
 class Borg():
 
     _HANDLERCLASS = DefaultHandlers
 
-    def __init__(self, dryrun, log=None):
+    # Size of the buffers that borg's output is read into.
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, dryrun, log=None, record_dir=None):
         self.dryrun = dryrun
         self._running = False
         self._log = log if log else logging.getLogger('borg')
         self._log_json = False # 'raw'
+        # If set, each borg invocation is recorded to a file in this
+        # directory, cf. `recording`.
+        self.record_dir = record_dir or os.environ.get('SYA_RECORD_DIR')
+
+    @staticmethod
+    def _env(repo):
+        """The environment for running borg on `repo`, i.e. ours with the
+        repository's passphrase and ssh command added.
+        """
+        return {**os.environ, **repo.borg_env}
 
-    def _readerthread(self, fh, name, as_json, buf, condition):
-        """ Reads either raw lines or JSON objects from the given stream. If
-            reading JSON and the first line starts with an opening brace,
-            subsequent lines will be aggregated until a valid JSON object
-            results. Anything not wrapped in braces will not be considered
-            to be JSON and will be dropped with an entry to the debug log.
-
-            Yields POISON when encountering the end of the stream.
+    def _framed(self, items):
+        """ Filter the output of a `JsonFramer`, logging (and dropping)
+        anything that is not JSON.
         """
-        def _pass_msg(msg):
-            with condition:
-                buf.put((name, msg))
-                condition.notify()
-
-        if as_json:
-            previous = b""
-            for line in fh:
-                line = previous + line
-                if line.lstrip().startswith(b'{'):
-                    try:
-                        msg = json.loads(line)
-                    except json.JSONDecodeError:
-                        # Assume that all of the JSON will be well-formed.
-                        # Then, a decoding error simply means that not all of
-                        # the JSON was read yet, i.e. borg has split it over
-                        # multiple lines.
-                        # TODO: This is probably not very efficient. Maybe only
-                        # try to load the json when opening { and closing }
-                        # match? Otoh, most of the json is one-line.
-                        previous = line + b'\n'
-                    else:
-                        previous = b""
-                        if self._log_json == 'raw':
-                            # Maybe not a good idea because this might include
-                            # listings with potentially many thousand items
-                            self._log.debug(('[JSON] ' + line.decode('utf8')).rstrip('\n'))
-                        _pass_msg(msg)
-                else:
-                    # Not JSON
-                    self._log.debug(('[NOT JSON] ' + line.decode('utf8')).rstrip('\n'))
-                    return None
-                    # _pass_msg(line)
-        else:
-            for line in fh:
-                _pass_msg(line)
-        fh.close()
-        _pass_msg(POISON)
+        for item in items:
+            if isinstance(item, bytes):
+                self._log.debug(('[NOT JSON] ' + item.decode('utf8', 'replace')
+                                 ).rstrip('\n'))
+            else:
+                if self._log_json == 'raw':
+                    # Maybe not a good idea because this might include
+                    # listings with potentially many thousand items
+                    self._log.debug(f'[JSON] {item}')
+                yield item
 
-    def _communicate(self, p, stdout='raw', stderr='raw'):
+    def _communicate(self, p, stdout='raw', stderr='raw', recorder=None):
         """Similar to Popen.communicate, but without the deadlocks when both
-        stdout and stderr are written to.
+        stdout and stderr are written to. Both pipes are multiplexed by a
+        selector in the calling thread and read into a reusable buffer. They
+        are always drained until EOF, such that borg can never block on
+        writing to them.
+
+        Yields `(stdout, None)` and `(None, stderr)` pairs, with either raw
+        lines or decoded JSON objects, depending on the `stdout` and `stderr`
+        arguments (which can be 'raw', 'json' or None to discard).
+
+        If a `recorder` (a `recording.Recording`) is given, all data is also
+        written to it.
         """
-        buf = Queue()
-        nthreads = 0
-        threads = []
-        new_msg = Condition()
-        if stdout in ['raw', 'json']:
-            stdout_thread = Thread(target=self._readerthread,
-                                   args=(p.stdout,
-                                         'stdout', stdout == 'json',
-                                         buf, new_msg),
-                                   )
-            stdout_thread.daemon = True
-            stdout_thread.start()
-            nthreads += 1
-            threads.append(stdout_thread)
-        if stderr in ['raw', 'json']:
-            stderr_thread = Thread(target=self._readerthread,
-                                   args=(p.stderr,
-                                         'stderr', stderr == 'json',
-                                         buf, new_msg),
-                                   )
-            stderr_thread.daemon = True
-            stderr_thread.start()
-            nthreads += 1
-            threads.append(stderr_thread)
-
-        while nthreads:
-            with new_msg:
-                new_msg.wait_for(lambda: not buf.empty())
-                source, msg = buf.get()
-                if msg is POISON:
-                    nthreads -= 1
-                elif source == 'stdout':
-                    yield (msg, None)
-                elif source == 'stderr':
-                    yield (None, msg)
+        buf = bytearray(self.READ_SIZE)
+        view = memoryview(buf)
+        sel = selectors.DefaultSelector()
+        for fh, mode, wrap, stream in [
+                (p.stdout, stdout, lambda m: (m, None), recording.STDOUT),
+                (p.stderr, stderr, lambda m: (None, m), recording.STDERR),
+                ]:
+            if fh is None:
+                continue
+            framer = JsonFramer() if mode == 'json' else LineFramer()
+            sel.register(fh.fileno(), selectors.EVENT_READ,
+                         (fh, mode, framer, wrap, stream))
+
+        try:
+            while sel.get_map():
+                for key, _ in sel.select():
+                    fh, mode, framer, wrap, stream = key.data
+                    n = os.readv(key.fd, [buf])
+                    if n:
+                        if recorder:
+                            recorder.write(stream, view[:n])
+                        items = framer.feed(view[:n])
+                    else:
+                        sel.unregister(key.fd)
+                        fh.close()
+                        items = framer.close()
+                    if mode == 'json':
+                        items = self._framed(items)
+                    elif mode != 'raw':
+                        continue
+                    for item in items:
+                        yield wrap(item)
+        finally:
+            sel.close()
 
     # TODO check `man borg-common` for more arguments to support
-    @_while_running(False)
-    def _run(self, command, options, env=None, output=False,
-             handlers=None):
-        """Run a borg commandline (possibly after extending it with a number
-        of common arguments given as parameters to this function). Messages
-        from borg are read as JSON and dispatched to the `handlers`.
+    def _commandline(self, command, options, handlers, output=False):
+        """Extend the `options` for a borg `command` by a number of common
+        arguments, depending on the `handlers` and on whether `output` from
+        borg is requested. `output` can be `'json-lines'` for commands
+        supporting it; any other true value requests `--json`.
         """
-        handlers = (handlers or self._HANDLERCLASS(self._log))
-
-        commandline = [BINARY, command]
+        commandline = [binary(), command]
         commandline.append('--log-json')
         if handlers.handles_progress:
             commandline.append('--progress')
@@ -335,37 +374,112 @@ class Borg():
         if verbosity_flag:
             options.insert(0, verbosity_flag)
 
-        outbuf = []
-        if output:
+        if output == 'json-lines':
+            commandline.append('--json-lines')
+        elif output:
             # Not supported by all commands
             commandline.append('--json')
 
         commandline.extend(options)
+        return commandline
 
-        self._log.debug(format_commandline(commandline))
-        if not self.dryrun:
-            self._p = p = Popen(commandline, env=env,
-                                stdout=PIPE, stderr=PIPE,
-                                )
+    @_while_running(False)
+    def _run(self, command, options, env=None, output=False,
+             handlers=None):
+        """Run a borg commandline (possibly after extending it with a number
+        of common arguments given as parameters to this function). Messages
+        from borg are read as JSON and dispatched to the `handlers`.
 
-            self._running = True
+        If `output` is requested, returns the lines written by borg to stdout.
+        """
+        outbuf = []
+        for stdout, _ in self._stream(command, options, env=env,
+                                      output=output, handlers=handlers):
+            if output and stdout is not None:
+                outbuf.append(stdout)
 
-            for stdout, msg in self._communicate(p, stdout='raw',
-                                                    stderr='json'):
-                if output and stdout is not None:
-                    outbuf.append(stdout)
-                elif msg:
-                    handlers._dispatch(msg)
+        if self._log_json == 'raw':
+            # Maybe not a good idea because this might include listings with
+            # potentially many thousand items
+            for line in outbuf:
+                self._log.debug(('[JSON OUT] ' + line.decode('utf8')).rstrip('\n'))
+
+        return(outbuf)
 
+    @_while_running(False)
+    def _stream(self, command, options, env=None, output=False,
+                handlers=None):
+        """Like `_run`, but a generator which yields `(stdout, msg)` pairs
+        (cf. `_communicate`) as soon as borg emits them, after dispatching
+        `msg` to the `handlers`. Nothing is accumulated, thus memory usage is
+        independent of the amount of output.
+
+        If the generator is closed before borg exited (i.e. the consumer
+        stopped early or the handlers raised), borg is stopped by
+        `_shutdown`.
+        """
+        handlers = (handlers or self._HANDLERCLASS(self._log))
+        commandline = self._commandline(command, options, handlers, output)
+
+        self._log.debug(format_commandline(commandline))
+        if self.dryrun:
+            return
+
+        self._p = p = Popen(commandline, env=env,
+                            stdout=PIPE, stderr=PIPE,
+                            )
+        self._running = True
+        recorder = None
+        if self.record_dir:
+            recorder = recording.Recording(
+                recording.recording_path(self.record_dir, command),
+                commandline,
+            )
+        try:
+            messages = closing(self._communicate(p, stdout='raw',
+                                                 stderr='json',
+                                                 recorder=recorder))
+            with messages as messages:
+                for stdout, msg in messages:
+                    if stdout is not None:
+                        yield (stdout, None)
+                    elif msg:
+                        handlers._dispatch(msg)
+                        yield (None, msg)
+            p.wait()
+        finally:
+            if p.poll() is None:
+                self._shutdown(p)
+            if recorder:
+                recorder.close(p.returncode)
             self._running = False
 
-            if self._log_json == 'raw':
-                # Maybe not a good idea because this might include listings with
-                # potentially many thousand items
-                for line in outbuf:
-                    self._log.debug(('[JSON OUT] ' + line.decode('utf8')).rstrip('\n'))
+    # Seconds to wait for borg to exit after SIGINT, and then after SIGTERM
+    INTERRUPT_TIMEOUT = 10
+    TERMINATE_TIMEOUT = 10
 
-        return(outbuf)
+    def _shutdown(self, p):
+        """ Bring down borg gracefully, escalating from SIGINT to SIGTERM to
+        SIGKILL.
+        """
+        # Nobody is going to read anymore; closing the pipes ensures that
+        # borg can't block on writing to them.
+        for fh in [p.stdout, p.stderr]:
+            if fh:
+                fh.close()
+        for stop, timeout in [(self._interrupt, self.INTERRUPT_TIMEOUT),
+                              (self._terminate, self.TERMINATE_TIMEOUT),
+                              ]:
+            try:
+                stop()
+                p.wait(timeout)
+                return
+            except ProcessLookupError:
+                return
+            except TimeoutExpired:
+                pass
+        p.kill()
+        p.wait()
 
     @_while_running()
     def _signal(self, sig):
@@ -431,11 +545,17 @@ class Borg():
 
     # borg-check also takes an archive instead of a full repo as argument, this
     # is not supported here fore now.
-    def check(self, repo,
-              repos_only=False, archives_only=False,
-              verify_data=False, repair=False, save_space=False,
-              handlers=None, **kwargs,
-              ):
+    def check(self, repo, handlers=None, **kwargs):
+        options = self._check_options(repo, **kwargs)
+        with repo:
+            self._run('check', options, env=self._env(repo),
+                      handlers=handlers)
+
+    def _check_options(self, repo,
+                       repos_only=False, archives_only=False,
+                       verify_data=False, repair=False, save_space=False,
+                       **kwargs,
+                       ):
         if repos_only and verify_data:
             raise InvalidBorgOptions('borg-check options --repository-only and '
                                      '--verify-data conflict')
@@ -450,14 +570,26 @@ class Borg():
         remaining = self._handle_common_options(**remaining)
         self._handle_unknown_arguments(remaining)
         options.append(f"{repo}")
+        return options
+
+    def create(self, repo, includes, excludes=[], handlers=None, **kwargs):
+        """Returns the JSON output of borg, i.e. a dict describing the new
+        archive and the repository (None for dry runs).
 
+        Instead of (or in addition to) `includes` and `excludes`, the paths
+        and patterns can be given as a file with `patterns_from`.
+        """
+        options = self._create_options(repo, includes, excludes, **kwargs)
         with repo:
-            self._run('check', options, handlers=handlers)
+            output = self._run('create', options, env=self._env(repo),
+                               output=True, handlers=handlers)
+        if output:
+            return json.loads(b''.join(output))
 
-    def create(self, repo, includes, excludes=[],
-               prefix='{hostname}', stats=False,
-               handlers=None, **kwargs):
-        if not includes:
+    def _create_options(self, repo, includes, excludes=[],
+                        prefix='{hostname}', stats=False, patterns_from=None,
+                        **kwargs):
+        if not includes and not patterns_from:
             raise InvalidBorgOptions(
                 'No paths given to include in the archive',
             )
@@ -468,13 +600,13 @@ class Borg():
             options.append('--stats')
         remaining = self._handle_common_options(**kwargs)
         self._handle_unknown_arguments(remaining)
+        if patterns_from:
+            options.extend(['--patterns-from', patterns_from])
         for e in excludes:
             options.extend(['--exclude', e])
         options.append(f'{repo}::{prefix}')
         options.extend(includes)
-
-        with repo:
-            self._run('create', options, handlers=handlers)
+        return options
 
     def mount(self, repo, archive=None, mountpoint='/mnt', foreground=False,
               handlers=None, **kwargs):
@@ -493,7 +625,8 @@ class Borg():
         options.append(target)
 
         with repo:
-            self._run('mount', options, handlers=handlers)
+            self._run('mount', options, env=self._env(repo),
+                      handlers=handlers)
 
     def umount(self, repo, handlers=None, **kwargs):
         raise NotImplementedError()
@@ -501,15 +634,75 @@ class Borg():
     def extract(self, repo, handlers=None, **kwargs):
         raise NotImplementedError()
 
-    def list(self, repo,
-             # TODO: support exclude patterns.
-             additional_keys=[], pandas=True, short=False,
-             handlers=None,
-             **kwargs):
+    def list(self, repo, archive=None, pandas=True, columns=False,
+             handlers=None, **kwargs):
+        """List the archives in the repository or (if `archive` is given) the
+        files in an archive.
+
+        The items are collected into typed `columns.Columns` (cf.
+        `columns.FILE_SCHEMA` and `columns.ARCHIVE_SCHEMA`) as they arrive.
+        With `columns=True`, these are returned as they are, which doesn't
+        require pandas. Otherwise, with `pandas=True`, they are converted into
+        a DataFrame, and with `pandas=False`, a list of dicts is returned.
+        """
         # NOTE: This can list either repo contents (archives) or archive
         # contents (files). Respect that, maybe even split in separate methods
         # (since e.g. repos should have the 'short' option to only return the
         # prefix, while only archives should have the pandas option(?)).
+        output = self.iter_list(repo, archive, handlers=handlers, **kwargs)
+        if not (pandas or columns):
+            return list(output)
+        from .columns import Columns, schema_for
+
+        table = Columns(schema_for(archive)).extend(output)
+        if columns:
+            return table
+        return table.to_pandas()
+
+    def iter_list(self, repo, archive=None, handlers=None, **kwargs):
+        """Like `list`, but a generator yielding the listed items as they
+        arrive. When listing an archive, the files are read from borg's
+        `--json-lines` output one at a time, i.e. with constant memory.
+        Closing the generator early stops borg, and the repository is only
+        held (locked, mounted) while iterating.
+        """
+        options = self._list_options(repo, archive, **kwargs)
+
+        with repo:
+            if archive:
+                with closing(self._stream('list', options,
+                                          env=self._env(repo),
+                                          output='json-lines',
+                                          handlers=handlers)) as stream:
+                    for line, _ in stream:
+                        if line is not None:
+                            yield json.loads(line)
+            else:
+                # The list of archives is emitted as one JSON object.
+                yield from self._list_repository(repo, options,
+                                                 handlers)['archives']
+
+    def list_repository(self, repo, handlers=None, **kwargs):
+        """Returns borg's complete JSON output when listing the archives in
+        the repository, i.e. including the repository's id and the
+        last-modified time of its manifest.
+        """
+        options = self._list_options(repo, **kwargs)
+        with repo:
+            return self._list_repository(repo, options, handlers)
+
+    def _list_repository(self, repo, options, handlers):
+        output = self._run('list', options, env=self._env(repo),
+                           output=True, handlers=handlers)
+        if output:
+            return json.loads(b''.join(output))
+        # dry run
+        return {'archives': [], 'repository': {}}
+
+    def _list_options(self, repo, archive=None,
+                      # TODO: support exclude patterns.
+                      additional_keys=[], short=False,
+                      **kwargs):
         options = repo.borg_args()
 
         if short:
@@ -526,20 +719,8 @@ class Borg():
         remaining = self._handle_archive_filter_options(True, options, **kwargs)
         remaining = self._handle_common_options(**remaining)
         self._handle_unknown_arguments(remaining)
-
-        output = []
-        with repo:
-            self._run('list', options, output=output, handlers=handlers)
-
-        output = (json.loads(line) for line in output)
-        if pandas:
-            import pandas as pd
-            # TODO: set dtype for all fields that could occur (defaults or
-            # additional_keys)
-            # dtype=...,
-            return pd.DataFrame.from_records(output)
-        else:
-            return list(output)
+        options.append(f'{repo}::{archive}' if archive else f'{repo}')
+        return options
 
     def info(self, repo, handlers=None, **kwargs):
         options = []
@@ -552,8 +733,31 @@ class Borg():
     def delete(self, repo, handlers=None):
         raise NotImplementedError()
 
-    def prune(self, repo, intervals, verbose=True, save_space=False,
-              handlers=None, **kwargs):
+    def prune(self, repo, intervals, handlers=None, **kwargs):
+        """Returns a list of `(name, id)` of the pruned archives, which are
+        parsed from the output of `--list`. Returns None if they are unknown,
+        i.e. if not `verbose` or if the output could not be parsed.
+        """
+        options = self._prune_options(repo, intervals, **kwargs)
+        pruned = []
+        unknown = not kwargs.get('verbose', True)
+        with repo:
+            for _, msg in self._stream('prune', options,
+                                       env=self._env(repo),
+                                       handlers=handlers):
+                if msg and msg.get('name') == 'borg.output.list':
+                    message = msg.get('message', '')
+                    m = _PRUNED_ARCHIVE.match(message)
+                    if m:
+                        pruned.append(m.group('name', 'id'))
+                    elif message.startswith(_PRUNING):
+                        self._log.debug(f"Unknown format of pruned archive: "
+                                        f"{message}")
+                        unknown = True
+        return None if unknown else pruned
+
+    def _prune_options(self, repo, intervals, verbose=True, save_space=False,
+                       **kwargs):
         # TODO: support --keep-within INTERVAL
         # TODO: support --list
         # TODO: support --stats
@@ -587,9 +791,58 @@ class Borg():
         remaining = self._handle_common_options(**remaining)
         self._handle_unknown_arguments(remaining)
         options.append(f"{repo}")
-
-        with repo:
-            self._run('prune', options, handlers=handlers)
+        return options
 
     def recreate(self, handlers=None):
         raise NotImplementedError()
+
+
+class BorgPool():
+    """A pool of Borg instances for running several borg processes
+    concurrently. Since each Borg instance can only ever interact with one
+    borg process at a time, every worker needs to acquire its own instance.
+    Instances are created on demand and reused afterwards.
+    """
+    def __init__(self, dryrun, log=None):
+        self._dryrun = dryrun
+        self._log = log
+        self._lock = Lock()
+        self._free = []
+        self.instances = []
+
+    @property
+    def dryrun(self):
+        return self._dryrun
+
+    @dryrun.setter
+    def dryrun(self, value):
+        with self._lock:
+            self._dryrun = value
+            for borg in self.instances:
+                borg.dryrun = value
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                borg = self._free.pop()
+            else:
+                borg = Borg(self._dryrun, self._log)
+                self.instances.append(borg)
+        try:
+            yield borg
+        finally:
+            with self._lock:
+                self._free.append(borg)
+
+    def interrupt(self):
+        """Send SIGINT to all borg processes that are currently running.
+        """
+        with self._lock:
+            running = [b for b in self.instances if b._running]
+        for borg in running:
+            try:
+                borg._interrupt()
+            except (RuntimeError, OSError):
+                # Exited in the meantime
+                pass
@@ -0,0 +1,226 @@
+""" An asyncio-based backend for running borg.
+
+`AsyncBorg` builds the same commandlines as `Borg`, but runs borg through
+`asyncio.create_subprocess_exec`, such that many borg processes can be driven
+from a single event loop without spawning any threads.
+
+>>> async for msg in AsyncBorg(dryrun=False).create(repo, ['/etc']):
+...     print(msg['type'])
+
+Entering the repository (taking its lock, running mount scripts, connecting)
+blocks, and thus happens in the default executor of the loop.
+"""
+
+import asyncio
+from asyncio.subprocess import PIPE
+from contextlib import asynccontextmanager
+import json
+import sys
+
+from . import Borg
+from .framing import JsonFramer, LineFramer
+from ..util import format_commandline
+
+
+@asynccontextmanager
+async def _closing(agen):
+    """Ensure that an async generator is finalized (and thus borg shut down)
+    immediately when the consumer stops iterating.
+    """
+    try:
+        yield agen
+    finally:
+        await agen.aclose()
+
+
+@asynccontextmanager
+async def _entered(repo):
+    """`with repo:`, but without blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, repo.__enter__)
+    exc = (None, None, None)
+    try:
+        yield repo
+    except BaseException:
+        exc = sys.exc_info()
+        raise
+    finally:
+        await loop.run_in_executor(None, repo.__exit__, *exc)
+
+
+class AsyncBorg(Borg):
+    """The public commands return async iterators. `check`, `create` and
+    `prune` yield the messages emitted by borg (after dispatching them to the
+    `handlers`, if any). `list` yields the listed archives or files instead.
+
+    If the consumer stops iterating early or the surrounding task is
+    cancelled, borg is interrupted (`_interrupt`) and, if it does not exit
+    within `INTERRUPT_TIMEOUT` seconds, terminated (`_terminate`).
+    """
+
+    async def _readlines(self, stream, source, queue, as_json):
+        """ Read either raw lines or JSON objects from the given stream into
+        the queue, cf. `Borg._communicate`.
+        """
+        framer = JsonFramer() if as_json else LineFramer()
+        while True:
+            data = await stream.read(self.READ_SIZE)
+            items = framer.feed(data) if data else framer.close()
+            if as_json:
+                items = self._framed(items)
+            for item in items:
+                await queue.put((source, item))
+            if not data:
+                break
+        await queue.put((source, None))
+
+    async def _drain(self, stream):
+        while await stream.read(self.READ_SIZE):
+            pass
+
+    async def _shutdown(self, p):
+        """ Bring down borg gracefully, escalating from SIGINT to SIGTERM to
+        SIGKILL.
+        """
+        for stop, timeout in [(self._interrupt, self.INTERRUPT_TIMEOUT),
+                              (self._terminate, self.TERMINATE_TIMEOUT),
+                              ]:
+            try:
+                stop()
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(p.wait(), timeout)
+                return
+            except asyncio.TimeoutError:
+                pass
+        p.kill()
+        await p.wait()
+
+    async def _stream(self, command, options, env=None, output=False,
+                      handlers=None):
+        """Run a borg commandline, cf. `Borg._run`, and yield
+        `(stdout, msg)` pairs similar to `Borg._communicate`, where `stdout`
+        are raw lines written by borg to stdout and `msg` are the JSON
+        messages from stderr.
+        """
+        if self._running:
+            raise RuntimeError()
+        handlers = (handlers or self._HANDLERCLASS(self._log))
+        commandline = self._commandline(command, options, handlers, output)
+
+        self._log.debug(format_commandline(commandline))
+        if self.dryrun:
+            return
+
+        self._p = p = await asyncio.create_subprocess_exec(
+            *commandline, env=env,
+            stdout=PIPE, stderr=PIPE,
+        )
+        self._running = True
+        queue = asyncio.Queue()
+        readers = [
+            asyncio.ensure_future(
+                self._readlines(p.stdout, 'stdout', queue, False)),
+            asyncio.ensure_future(
+                self._readlines(p.stderr, 'stderr', queue, True)),
+        ]
+        try:
+            nreaders = len(readers)
+            while nreaders:
+                source, msg = await queue.get()
+                if msg is None:
+                    nreaders -= 1
+                elif source == 'stdout':
+                    yield (msg, None)
+                else:
+                    handlers._dispatch(msg)
+                    yield (None, msg)
+            await p.wait()
+        finally:
+            for r in readers:
+                r.cancel()
+            # Only one coroutine may wait on a stream at a time.
+            await asyncio.gather(*readers, return_exceptions=True)
+            if p.returncode is None:
+                # Nobody is going to read anymore; keep draining the pipes
+                # such that borg can't block on writing to them.
+                drains = [asyncio.ensure_future(self._drain(stream))
+                          for stream in [p.stdout, p.stderr]]
+                try:
+                    await self._shutdown(p)
+                finally:
+                    for d in drains:
+                        d.cancel()
+                    await asyncio.gather(*drains, return_exceptions=True)
+            self._running = False
+
+    async def _messages(self, repo, command, options, handlers=None):
+        async with _entered(repo):
+            async with _closing(self._stream(command, options,
+                                             env=self._env(repo),
+                                             handlers=handlers)) as stream:
+                async for _, msg in stream:
+                    if msg is not None:
+                        yield msg
+
+    async def _list(self, repo, options, archive, handlers=None):
+        async with _entered(repo):
+            if archive:
+                stream = self._stream('list', options, env=self._env(repo),
+                                      output='json-lines', handlers=handlers)
+                async with _closing(stream):
+                    async for line, _ in stream:
+                        if line is not None:
+                            yield json.loads(line)
+            else:
+                listing = await self._list_repository(repo, options,
+                                                      handlers)
+                for archive in listing['archives']:
+                    yield archive
+
+    async def _list_repository(self, repo, options, handlers):
+        outbuf = []
+        async with _closing(self._stream('list', options, env=self._env(repo),
+                                         output=True,
+                                         handlers=handlers)) as stream:
+            async for line, _ in stream:
+                if line is not None:
+                    outbuf.append(line)
+        if outbuf:
+            return json.loads(b''.join(outbuf))
+        # dry run
+        return {'archives': [], 'repository': {}}
+
+    def check(self, repo, handlers=None, **kwargs):
+        options = self._check_options(repo, **kwargs)
+        return self._messages(repo, 'check', options, handlers)
+
+    def create(self, repo, includes, excludes=[], handlers=None, **kwargs):
+        options = self._create_options(repo, includes, excludes, **kwargs)
+        return self._messages(repo, 'create', options, handlers)
+
+    def prune(self, repo, intervals, handlers=None, **kwargs):
+        options = self._prune_options(repo, intervals, **kwargs)
+        return self._messages(repo, 'prune', options, handlers)
+
+    def list(self, repo, archive=None, handlers=None, **kwargs):
+        options = self._list_options(repo, archive, **kwargs)
+        return self._list(repo, options, archive, handlers)
+
+    def iter_list(self, repo, archive=None, handlers=None, **kwargs):
+        """The same as `list`, which already yields the items as they arrive.
+        """
+        return self.list(repo, archive, handlers=handlers, **kwargs)
+
+    async def list_repository(self, repo, handlers=None, **kwargs):
+        """Cf. `Borg.list_repository`.
+        """
+        options = self._list_options(repo, **kwargs)
+        async with _entered(repo):
+            return await self._list_repository(repo, options, handlers)
+
+    def _run(self, *args, **kwargs):
+        raise NotImplementedError(
+            "AsyncBorg only supports check, create, prune and list")
@@ -0,0 +1,281 @@
+""" Typed, columnar storage for the output of `borg list`.
+
+Records are appended as they are streamed from borg and moved into typed
+per-column arrays in small chunks, i.e. the complete list of dicts is never
+built.
+The result can be used as is (without importing pandas) or converted into a
+`pandas.DataFrame` without an intermediate object-dtype stage.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+import itertools
+from operator import itemgetter
+
+
+# Column kinds
+INT = 'int64'
+BOOL = 'bool'
+DATETIME = 'datetime64[ns]'
+CATEGORY = 'category'
+OBJECT = 'object'
+
+# The keys that `borg list --json-lines` can emit for files (cf. `borg help
+# list-format`). Keys that are not listed here are stored as objects.
+FILE_SCHEMA = {
+    'type': CATEGORY,
+    'mode': CATEGORY,
+    'user': CATEGORY,
+    'group': CATEGORY,
+    'uid': INT,
+    'gid': INT,
+    'path': CATEGORY,
+    'healthy': BOOL,
+    'source': OBJECT,
+    'linktarget': OBJECT,
+    'flags': OBJECT,
+    'size': INT,
+    'csize': INT,
+    'dsize': INT,
+    'dcsize': INT,
+    'num_chunks': INT,
+    'unique_chunks': INT,
+    'mtime': DATETIME,
+    'ctime': DATETIME,
+    'atime': DATETIME,
+}
+
+# The archives listed by `borg list --json`.
+ARCHIVE_SCHEMA = {
+    'archive': OBJECT,
+    'barchive': OBJECT,
+    'name': OBJECT,
+    'id': OBJECT,
+    'start': DATETIME,
+    'time': DATETIME,
+    'end': DATETIME,
+    'hostname': CATEGORY,
+    'username': CATEGORY,
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_US = timedelta(microseconds=1)
+# Same as numpy's NaT
+_NAT = -2**63
+
+
+def _to_ns(value):
+    """Borg writes naive local timestamps, which are kept naive.
+    """
+    if not value:
+        return _NAT
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return _NAT
+    if dt.tzinfo is not None:
+        dt = dt.replace(tzinfo=None) - dt.utcoffset()
+    return (dt - _EPOCH) // _US * 1000
+
+
+def _from_ns(value):
+    if value == _NAT:
+        return None
+    return _EPOCH + timedelta(microseconds=value // 1000)
+
+
+class _Column():
+    kind = OBJECT
+
+    def __init__(self, fill=0):
+        self.data = [None] * fill
+
+    def extend(self, values):
+        self.data.extend(values)
+
+    def values(self):
+        return list(self.data)
+
+    def to_numpy(self):
+        import numpy as np
+        a = np.empty(len(self.data), dtype=object)
+        a[:] = self.data
+        return a
+
+    def to_pandas(self):
+        return self.to_numpy()
+
+
+class _IntColumn(_Column):
+    kind = INT
+    typecode = 'q'
+
+    def __init__(self, fill=0):
+        self.data = array(self.typecode, [0] * fill)
+
+    def extend(self, values):
+        self.data.extend([v or 0 for v in values])
+
+    def values(self):
+        return self.data.tolist()
+
+    def to_numpy(self):
+        import numpy as np
+        return np.frombuffer(self.data, dtype=np.int64)
+
+
+class _BoolColumn(_IntColumn):
+    kind = BOOL
+    typecode = 'b'
+
+    def extend(self, values):
+        self.data.extend([bool(v) for v in values])
+
+    def values(self):
+        return [bool(v) for v in self.data]
+
+    def to_numpy(self):
+        import numpy as np
+        return np.frombuffer(self.data, dtype=np.int8).astype(bool)
+
+
+class _DatetimeColumn(_IntColumn):
+    kind = DATETIME
+
+    def __init__(self, fill=0):
+        self.data = array(self.typecode, [_NAT] * fill)
+
+    def extend(self, values):
+        self.data.extend(map(_to_ns, values))
+
+    def values(self):
+        return [_from_ns(v) for v in self.data]
+
+    def to_numpy(self):
+        return super().to_numpy().view('datetime64[ns]')
+
+
+class _CategoryColumn(_Column):
+    """Values are stored as integer codes into the distinct values (in order
+    of appearance), missing values as -1.
+    """
+    kind = CATEGORY
+
+    def __init__(self, fill=0):
+        self._codes = dict()
+        self.data = array('l', [-1] * fill)
+
+    @property
+    def categories(self):
+        return list(self._codes)
+
+    def extend(self, values):
+        codes = self._codes
+        code = codes.setdefault
+        self.data.extend([-1 if v is None else code(v, len(codes))
+                          for v in values])
+
+    def values(self):
+        categories = self.categories
+        return [categories[c] if c >= 0 else None for c in self.data]
+
+    def to_pandas(self):
+        import numpy as np
+        import pandas as pd
+        codes = np.frombuffer(self.data,
+                              dtype=np.dtype(f'i{self.data.itemsize}'))
+        return pd.Categorical.from_codes(codes, self.categories)
+
+
+_COLUMN_CLASSES = {
+    cls.kind: cls
+    for cls in [_Column, _IntColumn, _BoolColumn, _DatetimeColumn,
+                _CategoryColumn]
+}
+
+
+class Columns():
+    """A table with one typed column per key, cf. the `*_SCHEMA`s.
+
+    Records are buffered and moved into the columns in chunks of
+    `CHUNK_SIZE`, which is much faster than converting them one at a time
+    while the memory held by the buffer remains bounded.
+
+    Columns are created as keys appear in the records (records missing a
+    key get 0, False, NaT or None in its column). Indexing by key returns the
+    column's values as a list of Python objects, `to_pandas` converts to a
+    `pandas.DataFrame`.
+    """
+    CHUNK_SIZE = 4096
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._columns = dict()
+        self._len = 0
+        self._chunk = []
+
+    def append(self, record):
+        self._chunk.append(record)
+        if len(self._chunk) >= self.CHUNK_SIZE:
+            self._flush()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+        return self
+
+    def _flush(self):
+        chunk = self._chunk
+        if not chunk:
+            return
+        self._chunk = []
+        columns = self._columns
+        for key in dict.fromkeys(itertools.chain.from_iterable(chunk)):
+            if key not in columns:
+                cls = _COLUMN_CLASSES[self.schema.get(key, OBJECT)]
+                columns[key] = cls(fill=self._len)
+        for key, col in columns.items():
+            try:
+                values = list(map(itemgetter(key), chunk))
+            except KeyError:
+                values = [r.get(key) for r in chunk]
+            col.extend(values)
+        self._len += len(chunk)
+
+    @property
+    def columns(self):
+        self._flush()
+        return self._columns
+
+    def __len__(self):
+        return self._len + len(self._chunk)
+
+    def keys(self):
+        return list(self.columns)
+
+    def dtypes(self):
+        return {key: col.kind for key, col in self.columns.items()}
+
+    def __getitem__(self, key):
+        return self.columns[key].values()
+
+    def __iter__(self):
+        """Iterate over the rows as dicts.
+        """
+        columns = {key: col.values() for key, col in self.columns.items()}
+        for i in range(self._len):
+            yield {key: values[i] for key, values in columns.items()}
+
+    def to_pandas(self):
+        import pandas as pd
+        return pd.DataFrame(
+            {key: col.to_pandas() for key, col in self.columns.items()},
+            index=pd.RangeIndex(len(self)),
+        )
+
+
+def schema_for(archive):
+    """The schema for listing the archive's contents or (if `archive` is
+    None) the repository's archives.
+    """
+    return FILE_SCHEMA if archive else ARCHIVE_SCHEMA
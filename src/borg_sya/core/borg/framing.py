@@ -0,0 +1,154 @@
+""" Incremental framing of the byte streams written by borg.
+
+Data is fed in arbitrary chunks as it arrives from the pipes, and complete
+lines or JSON objects are returned as soon as they are available. JSON objects
+spanning several lines are decoded only once, when they are complete.
+"""
+
+import json
+import re
+
+
+class LineFramer():
+    """Split a byte stream into lines (including the trailing newline).
+    """
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """Append `data` and return a list of all lines completed by it.
+        """
+        buf = self._buf
+        start = len(buf)
+        buf += data
+        end = buf.rfind(b'\n', start)
+        if end < 0:
+            return []
+        lines = buf[:end + 1].splitlines(keepends=True)
+        del buf[:end + 1]
+        return [bytes(line) for line in lines]
+
+    def close(self):
+        """Return any trailing data not terminated by a newline.
+        """
+        rest = bytes(self._buf)
+        self._buf.clear()
+        return [rest] if rest else []
+
+
+# Outside of strings, only braces and quotes change the framer's state. Within
+# strings, only quotes and backslashes do.
+_OBJECT_TOKENS = re.compile(rb'[{}"]')
+_STRING_TOKENS = re.compile(rb'["\\]')
+
+
+class JsonFramer():
+    """Split a byte stream into JSON objects and lines that are not JSON.
+
+    A line whose first non-whitespace character is an opening brace starts
+    an object, which extends (possibly over several lines) up to the matching
+    closing brace. Brace depth is tracked while skipping over strings and
+    escape sequences, such that each object is decoded exactly once. Anything
+    else is returned as raw `bytes` lines.
+    """
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+        # Start of the current object in `_buf` or None when between objects
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+
+    def feed(self, data):
+        """Append `data` and return a list of all items completed by it: a
+        `dict` for each decoded object and `bytes` for all other lines.
+        """
+        self._buf += data
+        items = []
+        buf = self._buf
+        pos = self._pos
+        n = len(buf)
+
+        while pos < n:
+            if self._start is None:
+                # Between objects: look at the next complete line.
+                eol = buf.find(b'\n', pos)
+                if eol < 0:
+                    break
+                i = pos
+                while i < eol and buf[i] in b' \t\r':
+                    i += 1
+                if i == eol:
+                    # Skip blank lines (and the end of the last object's line)
+                    pos = eol + 1
+                elif buf[i] == 0x7b:  # '{'
+                    self._start = i
+                    self._depth = 0
+                    pos = i
+                else:
+                    items.append(bytes(buf[pos:eol + 1]))
+                    pos = eol + 1
+                continue
+
+            if self._in_string:
+                m = _STRING_TOKENS.search(buf, pos)
+                if m is None:
+                    pos = n
+                    break
+                pos = m.end()
+                if m.group() == b'\\':
+                    if pos >= n:
+                        # The escaped character has not arrived yet.
+                        pos -= 1
+                        break
+                    pos += 1
+                else:
+                    self._in_string = False
+                continue
+
+            m = _OBJECT_TOKENS.search(buf, pos)
+            if m is None:
+                pos = n
+                break
+            pos = m.end()
+            token = m.group()
+            if token == b'"':
+                self._in_string = True
+            elif token == b'{':
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    items.append(self._decode(buf, self._start, pos))
+                    self._start = None
+
+        # Discard everything that has been consumed.
+        keep = pos if self._start is None else self._start
+        del buf[:keep]
+        self._pos = pos - keep
+        if self._start is not None:
+            self._start = 0
+        return items
+
+    def _decode(self, buf, start, end):
+        raw = bytes(buf[start:end])
+        try:
+            return json.loads(raw)
+        except ValueError:
+            # Balanced braces, but still not JSON.
+            return raw
+
+    def close(self):
+        """Return all remaining items, including any trailing data which did
+        not form a complete item.
+        """
+        items = self.feed(b'\n')
+        rest = bytes(self._buf)
+        self._buf.clear()
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        if rest.strip():
+            items.append(rest)
+        return items
@@ -1,5 +1,8 @@
 # Taken from the borgbackup source (MIT)
 
+import getpass
+import socket
+
 def format_file_size(v, precision=2, sign=False):
     """Format file size into a human friendly format
     """
@@ -28,3 +31,34 @@ def sizeof_fmt_decimal(num, suffix='B', sep='', precision=2, sign=False):
     return sizeof_fmt(num, suffix=suffix, sep=sep, precision=precision, sign=sign,
                       units=['', 'k', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y'], power=1000)
 
+
+class _Unknown():
+    """Formats as the placeholder `name` itself, including the format spec.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __format__(self, spec):
+        return f'{{{self.name}:{spec}}}' if spec else f'{{{self.name}}}'
+
+
+class _Placeholders(dict):
+    def __missing__(self, key):
+        return _Unknown(key)
+
+
+def replace_placeholders(text):
+    """Replace the placeholders borg supports in archive names and prefixes
+    that don't depend on the time of the invocation. Others (e.g. `{now}`)
+    are left in place.
+    """
+    data = _Placeholders(
+        fqdn=socket.getfqdn(),
+        hostname=socket.gethostname(),
+        user=getpass.getuser(),
+    )
+    try:
+        return text.format_map(data)
+    except (AttributeError, IndexError, ValueError):
+        # E.g. `{now.year}` or `{now!r}`
+        return text
@@ -0,0 +1,47 @@
+""" Compact message objects for the types of messages that borg emits most
+frequently (i.e. for every file during `borg create`). They are constructed
+directly from the decoded JSON and passed to the handlers as a single
+argument.
+"""
+
+
+class ArchiveProgress():
+    """ Note that apart from `finished` and `time`, the fields are not
+    included in the JSON when `finished == True`.
+    """
+    __slots__ = ('original_size', 'compressed_size', 'deduplicated_size',
+                 'nfiles', 'path', 'time', 'finished')
+    type = 'archive_progress'
+
+    def __init__(self, msg):
+        get = msg.get
+        self.original_size = get('original_size', 0)
+        self.compressed_size = get('compressed_size', 0)
+        self.deduplicated_size = get('deduplicated_size', 0)
+        self.nfiles = get('nfiles', 0)
+        self.path = get('path', '')
+        self.time = get('time')
+        self.finished = get('finished', False)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}("
+                + ', '.join(f'{k}={getattr(self, k)!r}'
+                            for k in self.__slots__)
+                + ')')
+
+
+class FileStatus():
+    __slots__ = ('status', 'path')
+    type = 'file_status'
+
+    def __init__(self, msg):
+        self.status = msg.get('status')
+        self.path = msg.get('path')
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.status!r}, {self.path!r})"
+
+
+MESSAGE_CLASSES = {
+    cls.type: cls for cls in [ArchiveProgress, FileStatus]
+}
@@ -0,0 +1,185 @@
+""" Recording and replaying borg sessions.
+
+A recording holds the commandline and everything borg wrote to stdout and
+stderr, with the time elapsed since the previous chunk, such that the session
+can later be replayed by a stand-in for borg without access to the
+repository:
+
+    # Record all borg invocations
+    SYA_RECORD_DIR=/tmp/rec borg-sya create
+
+    # Replay them at twice the original speed
+    SYA_BORG_BINARY=$(which borg-sya-replay) SYA_REPLAY=/tmp/rec \\
+        SYA_REPLAY_SPEED=2 borg-sya create
+
+The file is gzip-compressed and consists of a magic line, a length-prefixed
+JSON header and a sequence of `(stream, delay, length)` records, each followed
+by `length` bytes of data. The final record has stream `EXIT` and holds the
+return code of borg in place of the length.
+"""
+
+import gzip
+import itertools
+import json
+import os
+import struct
+import sys
+import time
+
+
+MAGIC = b'SYAREC1\n'
+SUFFIX = '.borgrec'
+EXIT, STDOUT, STDERR = 0, 1, 2
+
+_HEADER = struct.Struct('<I')
+_RECORD = struct.Struct('<Bdi')
+
+_counter = itertools.count()
+
+
+def recording_path(directory, command):
+    """A new, unique file name for recording a borg `command`.
+    """
+    return os.path.join(directory, '{}-{}-{:04}-{}{}'.format(
+        time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_counter),
+        command, SUFFIX))
+
+
+class Recording():
+    """Writes a recording of a single borg invocation.
+    """
+    # Recordings are written while reading from borg, favour speed.
+    COMPRESSLEVEL = 3
+
+    def __init__(self, path, commandline):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._f = gzip.open(path, 'wb', compresslevel=self.COMPRESSLEVEL)
+        header = json.dumps({
+            'commandline': [str(arg) for arg in commandline],
+            'time': time.time(),
+        }).encode('utf8')
+        self._f.write(MAGIC + _HEADER.pack(len(header)) + header)
+        self._last = time.monotonic()
+
+    def _record(self, stream, arg):
+        now = time.monotonic()
+        self._f.write(_RECORD.pack(stream, now - self._last, arg))
+        self._last = now
+
+    def write(self, stream, data):
+        self._record(stream, len(data))
+        self._f.write(data)
+
+    def close(self, returncode):
+        if self._f is None:
+            return
+        self._record(EXIT, returncode if returncode is not None else -1)
+        self._f.close()
+        self._f = None
+
+
+def read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a borg recording")
+    n, = _HEADER.unpack(f.read(_HEADER.size))
+    return json.loads(f.read(n))
+
+
+def read_recording(path):
+    """Returns the header and a generator yielding `(stream, delay, data)`,
+    where `data` is the return code for the final `EXIT` record.
+    """
+    f = gzip.open(path, 'rb')
+    header = read_header(f)
+
+    def records():
+        with f:
+            while True:
+                raw = f.read(_RECORD.size)
+                if len(raw) < _RECORD.size:
+                    # Truncated, e.g. sya was killed while recording
+                    return
+                stream, delay, arg = _RECORD.unpack(raw)
+                if stream == EXIT:
+                    yield (stream, delay, arg)
+                    return
+                yield (stream, delay, f.read(arg))
+
+    return header, records()
+
+
+def find_recording(source, argv):
+    """The recording in `source` (a file or directory) for a borg invocation
+    with arguments `argv`. Prefers recordings of the exact same commandline
+    over recordings of the same borg command.
+    """
+    if not os.path.isdir(source):
+        return source
+    candidates = []
+    for name in sorted(os.listdir(source)):
+        if name.endswith(SUFFIX):
+            path = os.path.join(source, name)
+            with gzip.open(path, 'rb') as f:
+                candidates.append((path, read_header(f)['commandline'][1:]))
+    for path, args in candidates:
+        if args == argv:
+            return path
+    for path, args in candidates:
+        if args[:1] == argv[:1]:
+            return path
+    return None
+
+
+def replay(path, speed=1.0, stdout=1, stderr=2):
+    """Write the recorded output to the file descriptors, at `speed` times the
+    original pace (as fast as possible if `speed` is 0). Returns the recorded
+    return code.
+    """
+    _, records = read_recording(path)
+    fds = {STDOUT: stdout, STDERR: stderr}
+    start = time.monotonic()
+    elapsed = 0.0
+    returncode = 0
+    for stream, delay, data in records:
+        elapsed += delay
+        if speed:
+            wait = start + elapsed / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        if stream == EXIT:
+            returncode = data
+            break
+        view = memoryview(data)
+        while view:
+            n = os.write(fds[stream], view)
+            view = view[n:]
+    return returncode
+
+
+def main():
+    """A stand-in for the borg executable, which replays the recording
+    matching its arguments from `$SYA_REPLAY` at `$SYA_REPLAY_SPEED`.
+    """
+    source = os.environ.get('SYA_REPLAY')
+    if not source:
+        sys.exit("SYA_REPLAY is not set.")
+    try:
+        speed = float(os.environ.get('SYA_REPLAY_SPEED', '1'))
+    except ValueError:
+        sys.exit("SYA_REPLAY_SPEED must be a number.")
+    path = find_recording(source, sys.argv[1:])
+    if path is None:
+        sys.exit(f"No recording for: {' '.join(sys.argv[1:])}")
+    try:
+        returncode = replay(path, speed)
+    except KeyboardInterrupt:
+        # Like borg on SIGINT
+        returncode = -2
+    except BrokenPipeError:
+        returncode = 1
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+""" A local, persistent catalogue of the archives in each repository, such
+that looking up archives (e.g. to resolve `task^^`) doesn't require a round
+trip to the repository.
+"""
+
+import json
+import os
+import time
+
+from .util import write_atomically
+
+
+def is_remote(path):
+    return path.startswith('ssh://') or (
+        ':' in path and not path.startswith('/')
+    )
+
+
+class ArchiveCatalogue():
+    """The archives of a single repository, stored as JSON below
+    `<cachedir>/archives/`. The catalogue file is named after the repository
+    id, locations are mapped to ids by an additional index file.
+
+    A catalogue is fresh as long as the repository has not been modified by
+    anybody else: For local repositories, this is detected by the
+    modification time of the repository directory, which changes with each
+    transaction committed by borg (the manifest's last-modified time is
+    stored as well, but reading it requires borg). Remote repositories can't
+    be checked without a round trip, so their catalogues expire after
+    `REMOTE_MAX_AGE` seconds.
+
+    After our own `create` and `prune` runs, the catalogue is updated in
+    place rather than being invalidated.
+    """
+    REMOTE_MAX_AGE = 15 * 60
+
+    def __init__(self, cachedir, location):
+        self.dir = os.path.join(cachedir, 'archives')
+        self.location = location
+        self._index_file = os.path.join(self.dir, 'index.json')
+
+    def _read_json(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, data):
+        write_atomically(path, json.dumps(data).encode('utf8'))
+
+    @property
+    def repo_id(self):
+        return (self._read_json(self._index_file) or {}).get(self.location)
+
+    def _path(self, repo_id):
+        return os.path.join(self.dir, f'{repo_id}.json')
+
+    def _stamp(self):
+        if is_remote(self.location):
+            return None
+        try:
+            return os.stat(self.location).st_mtime_ns
+        except OSError:
+            return None
+
+    def _load(self):
+        repo_id = self.repo_id
+        if repo_id:
+            return self._read_json(self._path(repo_id))
+
+    def _is_fresh(self, data):
+        if is_remote(self.location):
+            return time.time() - data['updated'] < self.REMOTE_MAX_AGE
+        stamp = self._stamp()
+        return stamp is not None and data['stamp'] == stamp
+
+    def get(self):
+        """The archives (as listed by `borg list --json`, ordered by time) if
+        the catalogue is fresh, None otherwise.
+        """
+        data = self._load()
+        if data is None or not self._is_fresh(data):
+            return None
+        return data['archives']
+
+    def invalidate(self):
+        repo_id = self.repo_id
+        if repo_id:
+            try:
+                os.unlink(self._path(repo_id))
+            except FileNotFoundError:
+                pass
+
+    def validate(self):
+        """Drop the catalogue if it is stale. This needs to happen before
+        modifying the repository, since the incremental updates assume that
+        the catalogue was fresh before.
+        """
+        data = self._load()
+        if data is not None and not self._is_fresh(data):
+            self.invalidate()
+
+    def store(self, listing):
+        """Replace the catalogue by the output of `borg list --json`. Returns
+        the archives, ordered by time.
+        """
+        archives = sorted(listing['archives'],
+                          key=lambda a: a.get('start', a.get('time')))
+        repository = listing.get('repository', {})
+        repo_id = repository.get('id')
+        if not repo_id:
+            return archives
+        index = self._read_json(self._index_file) or {}
+        if index.get(self.location) != repo_id:
+            index[self.location] = repo_id
+            self._write_json(self._index_file, index)
+        self._write_json(self._path(repo_id), {
+            'id': repo_id,
+            'location': self.location,
+            'last_modified': repository.get('last_modified'),
+            'stamp': self._stamp(),
+            'updated': time.time(),
+            'archives': archives,
+        })
+        return archives
+
+    def update(self, added=(), removed=(), repository=None):
+        """Incrementally apply our own changes to the repository. `added`
+        are archives as described by `borg create --json`, `removed` are
+        archive ids, or None if unknown (which drops the catalogue).
+        """
+        if removed is None:
+            self.invalidate()
+            return
+        data = self._load()
+        if data is None:
+            return
+        removed = set(removed)
+        archives = [a for a in data['archives'] if a['id'] not in removed]
+        for a in added:
+            archives.append({
+                'archive': a['name'],
+                'barchive': a['name'],
+                'name': a['name'],
+                'id': a['id'],
+                'start': a.get('start'),
+                'time': a.get('start'),
+            })
+        data['archives'] = archives
+        if repository and repository.get('last_modified'):
+            data['last_modified'] = repository['last_modified']
+        # Only our own modification happened since the catalogue was
+        # validated, thus it's still fresh. For remote repositories, keep the
+        # time of the last full refresh since we can't be sure about that.
+        data['stamp'] = self._stamp()
+        self._write_json(self._path(data['id']), data)
@@ -0,0 +1,116 @@
+""" Loading of the configuration file, with a cache of the parsed and
+pre-resolved configuration.
+
+Parsing the YAML file is by far the most expensive part of each invocation
+for large configurations (e.g. generated by config management), thus the
+result is pickled to the cache directory. The cache is keyed on the
+fingerprints (mtime, size and inode) of the configuration file and of all
+files it references (passphrase, include and exclude files), and is only
+written once the configuration has been validated by building the `Context`
+from it.
+"""
+
+import hashlib
+import os
+import pickle
+
+import yaml
+from yaml.nodes import ScalarNode, MappingNode, SequenceNode
+
+from .util import SafeLoader, write_atomically
+
+
+# Bump when the layout of the cached configuration changes.
+CACHE_VERSION = 2
+
+
+class SyaSafeLoader(SafeLoader):
+    pass
+
+
+_seq = [(SequenceNode, None)]
+for _a, _b in [('tasks', 'pre'),
+               ('tasks', 'post'),
+               ('repositories', 'mount'),
+               ('repositories', 'umount')]:
+    _path = [(MappingNode, _a),
+             (MappingNode, None),  # name
+             (MappingNode, _b),
+             ]
+    SyaSafeLoader.add_path_resolver('!external_script', _path, ScalarNode)
+    SyaSafeLoader.add_path_resolver('!external_script', _path + _seq,
+                                    ScalarNode)
+    # Items with dependencies, cf. `scriptgraph`
+    SyaSafeLoader.add_path_resolver('!external_script',
+                                    _path + _seq + [(MappingNode, 'run')],
+                                    ScalarNode)
+
+
+def parse(conffile):
+    with open(conffile, 'r') as f:
+        return yaml.load(f, SyaSafeLoader)
+
+
+def referenced_files(cfg, confdir):
+    """The paths of the passphrase, include and exclude files referenced by
+    the configuration.
+    """
+    files = []
+    for rcfg in (cfg.get('repositories') or {}).values():
+        if rcfg.get('passphrase-file'):
+            files.append(os.path.join(confdir, rcfg['passphrase-file']))
+    for tcfg in (cfg.get('tasks') or {}).values():
+        for key in ('include-file', 'exclude-file'):
+            if tcfg.get(key):
+                files.append(os.path.join(confdir, tcfg[key]))
+    return files
+
+
+def fingerprint(paths):
+    result = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            result.append((path, st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            result.append((path, None, None, None))
+    return result
+
+
+class ConfigCache():
+    def __init__(self, cachedir, conffile):
+        conffile = os.path.abspath(conffile)
+        key = hashlib.sha1(conffile.encode('utf8')).hexdigest()[:16]
+        self.path = os.path.join(cachedir, f'config-{key}.pickle')
+        self.conffile = conffile
+
+    def load(self):
+        """The cached configuration, or None if there is none or any of the
+        files it was created from changed.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                cached = pickle.load(f)
+            if cached['version'] != CACHE_VERSION:
+                return None
+            paths = [p for p, *_ in cached['fingerprint']]
+            if (paths[:1] != [self.conffile]
+                    or fingerprint(paths) != cached['fingerprint']):
+                return None
+            return cached['cfg']
+        except Exception:
+            # Missing, or written by an incompatible version of sya
+            return None
+
+    def store(self, cfg, fingerprint):
+        """`fingerprint` must start with the configuration file, and should
+        have been taken before reading the files, such that changes while
+        reading them invalidate the cache.
+        """
+        data = pickle.dumps({
+            'version': CACHE_VERSION,
+            'fingerprint': fingerprint,
+            'cfg': cfg,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        # Might contain passphrases, thus only readable by the owner
+        write_atomically(self.path, data, mode=0o600)
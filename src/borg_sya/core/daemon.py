@@ -0,0 +1,137 @@
+""" A resident scheduler which runs tasks according to their `schedule`, cf.
+`schedule.Schedule`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import threading
+import time
+
+from .util import LockInUse
+
+
+def _format_time(t):
+    return datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Scheduler():
+    """Call `func(task)` for each task whenever its schedule is due, until
+    `stop` is called.
+
+    The time of the last run of each task is taken from the history, such
+    that runs missed while the daemon wasn't running are caught up on at
+    startup. Up to `jobs` tasks run concurrently, but never two on the same
+    repository. If `func` raises `LockInUse` since another process holds the
+    repository, the task stays queued and is retried after `busy_retry`
+    seconds. Any other error is logged, and the task is scheduled as usual.
+    """
+    BUSY_RETRY = 60
+
+    def __init__(self, cx, func, tasks, jobs=1, busy_retry=BUSY_RETRY,
+                 clock=time.time):
+        self.cx = cx
+        self.func = func
+        self.tasks = [t for t in tasks if t.enabled and t.schedule]
+        self.jobs = jobs
+        self.busy_retry = busy_retry
+        self.clock = clock
+        self.due = dict()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+
+    def start(self):
+        """Compute the first run of each task.
+        """
+        now = self.clock()
+        for task in self.tasks:
+            last = self.cx.history.last_run(task.name)
+            due = task.schedule.next_run(last, now)
+            if last is not None and due == now:
+                self.cx.info(f"-- Catching up on the missed run of {task} "
+                             f"(last run at {_format_time(last)}).")
+            self._queue(task, due)
+
+    def stop(self):
+        """Don't start any further tasks. Those already running finish.
+        """
+        self._stopping = True
+        self._wakeup.set()
+
+    def _queue(self, task, due):
+        with self._lock:
+            self.due[task] = due
+        self._announce(task, due)
+
+    def _announce(self, task, due):
+        self.cx.debug(f"-- Next run of {task} at {_format_time(due)} "
+                      f"(schedule: {task.schedule}).")
+
+    def _pop_due(self, now):
+        """Remove the tasks which are due and can run now from the queue.
+        Returns them, and the time until the next one is due (or None).
+        """
+        ready = []
+        timeout = None
+        with self._lock:
+            for task, due in sorted(self.due.items(), key=lambda i: i[1]):
+                if task.repo in self._running:
+                    # Woken up when the running task finishes.
+                    continue
+                if due > now:
+                    timeout = due - now if timeout is None else timeout
+                    continue
+                if len(self._running) >= self.jobs:
+                    break
+                del self.due[task]
+                self._running.add(task.repo)
+                ready.append(task)
+        return ready, timeout
+
+    def _run(self, task):
+        start = self.clock()
+        due = None
+        try:
+            with self.cx.pooled_borg():
+                self.func(task)
+        except LockInUse:
+            self.cx.info(f"-- Repository {task.repo.name} is busy, {task} "
+                         f"is retried in {self.busy_retry}s.")
+            due = self.clock() + self.busy_retry
+        except Exception as e:
+            self.cx.error(f"Running {task} failed: {e!r}")
+            due = task.schedule.next_run(start, self.clock())
+        else:
+            due = task.schedule.next_run(start, self.clock())
+        finally:
+            # Queue the task before waking up the main loop, which would
+            # otherwise wait forever if there's nothing else queued.
+            with self._lock:
+                if due is not None:
+                    self.due[task] = due
+                self._running.discard(task.repo)
+            self._wakeup.set()
+        self._announce(task, due)
+
+    def run(self):
+        self.start()
+        if not self.tasks:
+            self.cx.warning("No enabled task has a schedule, nothing to do.")
+            return
+        futures = set()
+        with ThreadPoolExecutor(max_workers=self.jobs,
+                                thread_name_prefix='sya-worker',
+                                ) as executor:
+            try:
+                while not self._stopping:
+                    self._wakeup.clear()
+                    ready, timeout = self._pop_due(self.clock())
+                    for task in ready:
+                        futures.add(executor.submit(self._run, task))
+                    futures = {f for f in futures if not f.done()}
+                    self._wakeup.wait(timeout)
+                wait(futures)
+            except KeyboardInterrupt:
+                self.cx.borg_pool.interrupt()
+                raise
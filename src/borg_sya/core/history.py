@@ -0,0 +1,153 @@
+""" A local SQLite history of all operations (create, prune, check) with the
+stats of the archives created, for showing trends without accessing the
+repositories.
+"""
+
+import os
+import sqlite3
+import statistics
+import threading
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    task TEXT,
+    repository TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    start REAL NOT NULL,
+    duration REAL,
+    success INTEGER NOT NULL,
+    error TEXT,
+    archive TEXT,
+    archive_id TEXT,
+    original_size INTEGER,
+    compressed_size INTEGER,
+    deduplicated_size INTEGER,
+    nfiles INTEGER,
+    pruned INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_by_task ON runs(task, operation, start);
+"""
+
+_COLUMNS = ('task', 'repository', 'operation', 'start', 'duration',
+            'success', 'error', 'archive', 'archive_id', 'original_size',
+            'compressed_size', 'deduplicated_size', 'nfiles', 'pruned')
+
+
+class History():
+    """A sink for `operation.track`. Nothing is recorded in dry runs.
+
+    The database is only opened when it is first used, and is shared by all
+    threads.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.dryrun = False
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.row_factory = sqlite3.Row
+            self._db.executescript(_SCHEMA)
+        return self._db
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def record(self, op):
+        if self.dryrun:
+            return
+        archive = op.archive or {}
+        stats = op.archive_stats or {}
+        values = (op.task, op.repository, op.operation, op.start,
+                  op.duration, int(op.success), op.error,
+                  archive.get('name'), archive.get('id'),
+                  stats.get('original_size'), stats.get('compressed_size'),
+                  stats.get('deduplicated_size'), stats.get('nfiles'),
+                  op.pruned)
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute(f"INSERT INTO runs ({', '.join(_COLUMNS)}) "
+                           f"VALUES ({', '.join('?' * len(_COLUMNS))})",
+                           values)
+
+    def runs(self, task=None, since=None, operation='create'):
+        """The runs (as `sqlite3.Row`s) of `operation` for `task` (or all
+        tasks) started at or after the timestamp `since`, ordered by time.
+        """
+        where = ['operation = ?']
+        args = [operation]
+        if task:
+            where.append('task = ?')
+            args.append(task)
+        if since is not None:
+            where.append('start >= ?')
+            args.append(since)
+        with self._lock:
+            return self._connect().execute(
+                f"SELECT * FROM runs WHERE {' AND '.join(where)} "
+                f"ORDER BY start",
+                args,
+            ).fetchall()
+
+    def last_run(self, task, operations=('create', 'skip'),
+                 ignore=('LockInUse', 'KeyboardInterrupt')):
+        """The start of the last run of any of `operations` for `task`, or
+        None. By default, runs skipped since nothing changed count as well.
+        Runs which failed with one of the errors in `ignore` didn't really
+        happen (the repository was busy, or sya was stopped) and are skipped.
+        """
+        with self._lock:
+            row = self._connect().execute(
+                f"SELECT max(start) FROM runs "
+                f"WHERE operation IN ({', '.join('?' * len(operations))}) "
+                f"AND task = ? "
+                f"AND (error IS NULL "
+                f"OR error NOT IN ({', '.join('?' * len(ignore))}))",
+                [*operations, task, *ignore],
+            ).fetchone()
+        return row[0]
+
+
+def trends(runs, slow_factor=1.5):
+    """Summarize the `create` runs of a single task: growth of the source
+    data and of the repository per day, the dedup ratio, and whether the
+    last successful run took `slow_factor` times longer than the median of
+    the runs before it.
+    """
+    ok = [r for r in runs if r['success']]
+    summary = {
+        'runs': len(runs),
+        'failed': len(runs) - len(ok),
+        'errors': sorted(set(r['error'] for r in runs if r['error'])),
+    }
+    sized = [r for r in ok if r['original_size'] is not None]
+    if len(sized) >= 2:
+        first, last = sized[0], sized[-1]
+        days = (last['start'] - first['start']) / 86400
+        if days > 0:
+            summary['original_growth_per_day'] = (
+                (last['original_size'] - first['original_size']) / days)
+            # Everything added to the repository after the first run
+            summary['deduplicated_per_day'] = sum(
+                r['deduplicated_size'] or 0 for r in sized[1:]) / days
+    if sized:
+        last = sized[-1]
+        if last['deduplicated_size']:
+            summary['dedup_ratio'] = (last['original_size']
+                                      / last['deduplicated_size'])
+    durations = [r['duration'] for r in ok if r['duration'] is not None]
+    if len(durations) >= 2:
+        median = statistics.median(durations[:-1])
+        summary['last_duration'] = durations[-1]
+        summary['median_duration'] = median
+        summary['slower'] = bool(median and
+                                 durations[-1] > slow_factor * median)
+    return summary
@@ -0,0 +1,191 @@
+""" A local SQLite index of the contents of archives, which allows to find
+files in all archives without touching the repositories.
+"""
+
+from datetime import datetime
+import os
+import sqlite3
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archives (
+    id INTEGER PRIMARY KEY,
+    archive_id TEXT NOT NULL,
+    repository TEXT NOT NULL,
+    name TEXT NOT NULL,
+    start TEXT,
+    UNIQUE (repository, archive_id)
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    archive INTEGER NOT NULL REFERENCES archives(id) ON DELETE CASCADE,
+    dir INTEGER NOT NULL REFERENCES dirs(id),
+    name TEXT NOT NULL,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_by_path ON files(dir, name);
+CREATE INDEX IF NOT EXISTS files_by_archive ON files(archive);
+"""
+
+
+def _timestamp(mtime):
+    try:
+        return int(datetime.fromisoformat(mtime).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def _has_magic(pattern):
+    return any(c in pattern for c in '*?[')
+
+
+class ContentIndex():
+    """Paths are interned by directory, i.e. each file row only references
+    its directory and stores its basename, size and mtime (as seconds).
+    """
+    BATCH_SIZE = 10000
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.executescript(_SCHEMA)
+        self._dirs = dict()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def indexed(self, repository):
+        """The ids of the archives from `repository` which are indexed.
+        """
+        return set(row[0] for row in self._db.execute(
+            'SELECT archive_id FROM archives WHERE repository = ?',
+            (repository,)))
+
+    def _dir_id(self, path):
+        try:
+            return self._dirs[path]
+        except KeyError:
+            pass
+        self._db.execute('INSERT OR IGNORE INTO dirs(path) VALUES (?)',
+                         (path,))
+        dir_id, = self._db.execute('SELECT id FROM dirs WHERE path = ?',
+                                   (path,)).fetchone()
+        self._dirs[path] = dir_id
+        return dir_id
+
+    def add(self, repository, archive, items):
+        """Index an `archive` (as listed by `borg list --json`) from the
+        given `items` (as emitted by `borg list --json-lines`). This happens
+        in a single transaction, i.e. if reading the items fails, the archive
+        is not marked as indexed.
+        """
+        # Directories inserted by this transaction vanish on rollback.
+        dirs = dict(self._dirs)
+        try:
+            self._add(repository, archive, items)
+        except BaseException:
+            self._dirs = dirs
+            raise
+
+    def _add(self, repository, archive, items):
+        with self._db:
+            cursor = self._db.execute(
+                'INSERT INTO archives(archive_id, repository, name, start) '
+                'VALUES (?, ?, ?, ?)',
+                (archive['id'], repository, archive['name'],
+                 archive.get('start')))
+            archive_row = cursor.lastrowid
+            batch = []
+            for item in items:
+                d, _, name = item['path'].rpartition('/')
+                batch.append((archive_row, self._dir_id(d), name,
+                              item.get('size'), _timestamp(item.get('mtime'))))
+                if len(batch) >= self.BATCH_SIZE:
+                    self._insert(batch)
+                    batch = []
+            self._insert(batch)
+
+    def _insert(self, batch):
+        self._db.executemany(
+            'INSERT INTO files(archive, dir, name, size, mtime) '
+            'VALUES (?, ?, ?, ?, ?)',
+            batch)
+
+    def remove(self, repository, archive_ids):
+        with self._db:
+            self._db.executemany(
+                'DELETE FROM archives WHERE repository = ? AND archive_id = ?',
+                [(repository, a) for a in archive_ids])
+
+    def find(self, pattern, repository=None, prefix=None):
+        """Yield `(archive name, path, size, mtime)` for all files whose path
+        matches the shell-style `pattern`, ordered by archive time.
+
+        Paths are stored as listed by borg, i.e. relative to the root.
+        """
+        pattern = pattern.lstrip('/')
+        dirpart, _, namepart = pattern.rpartition('/')
+        where = []
+        args = []
+        # Use the index on (dir, name) as much as possible
+        if not _has_magic(dirpart):
+            where.append('dirs.path = ?')
+            args.append(dirpart)
+        else:
+            where.append('dirs.path GLOB ?')
+            args.append(dirpart)
+        if not _has_magic(namepart):
+            where.append('files.name = ?')
+        else:
+            where.append('files.name GLOB ?')
+        args.append(namepart)
+        if repository:
+            where.append('archives.repository = ?')
+            args.append(repository)
+        if prefix:
+            where.append("substr(archives.name, 1, ?) = ?")
+            args.extend([len(prefix), prefix])
+
+        query = (
+            'SELECT archives.name, dirs.path, files.name, files.size, '
+            '       files.mtime '
+            'FROM files '
+            'JOIN dirs ON files.dir = dirs.id '
+            'JOIN archives ON files.archive = archives.id '
+            'WHERE ' + ' AND '.join(where) + ' '
+            'ORDER BY archives.start, dirs.path, files.name'
+        )
+        for archive, d, name, size, mtime in self._db.execute(query, args):
+            yield (archive, f'{d}/{name}' if d else name, size, mtime)
+
+
+def index_repository(index, repo, borg, handlers=None, archives=None):
+    """Index all archives of `repo` (a `core.Repository`) that are not yet
+    in the index, and drop those which have been deleted from the
+    repository. Yields the names of newly indexed archives.
+    """
+    if archives is None:
+        archives = repo.archives()
+    location = repo.path
+    indexed = index.indexed(location)
+    current = set(a['id'] for a in archives)
+    index.remove(location, indexed - current)
+    for archive in archives:
+        if archive['id'] in indexed:
+            continue
+        items = borg.iter_list(repo, archive['name'], handlers=handlers)
+        index.add(location, archive, items)
+        yield archive['name']
+
@@ -0,0 +1,121 @@
+""" Deciding whether anything changed in the paths backed up by a task since
+its last archive, for tasks with `skip-if-unchanged`.
+
+The journal stores the start of the last successful `create` of each task
+and the key of the patterns it used (cf. `patterns.PatternsFile`). A change
+is any file or directory below the roots whose mtime or ctime is not older
+than that. Since a directory's mtime changes when entries are added, removed
+or renamed, this also catches deletions, and the ctime catches files whose
+mtime was set into the past (e.g. by `cp -p`). Excludes are not considered,
+thus changes to excluded files still cause a backup.
+"""
+
+import json
+import os
+import queue
+import threading
+
+from .util import write_atomically
+
+
+class ChangeJournal():
+    """The journal of a single task below `<cachedir>/journal/`.
+    """
+    def __init__(self, cachedir, name):
+        self.path = os.path.join(cachedir, 'journal', f'{name}.json')
+
+    def last(self):
+        """`{'start': ..., 'key': ...}` of the last successful archive, or
+        None.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def record(self, start, key):
+        write_atomically(self.path,
+                         json.dumps({'start': start, 'key': key})
+                         .encode('utf8'))
+
+
+def changed_since(roots, since, jobs=8):
+    """Scan the trees below `roots` with `jobs` threads, until the first
+    entry modified at or after the timestamp `since` is found. Returns
+    `(path, scanned)`, where `path` is the changed path (None if nothing
+    changed) and `scanned` the number of entries examined. Errors (such as
+    a missing root) count as changes.
+    """
+    dirs = queue.Queue()
+    found = []
+    counts = []
+    done = threading.Event()
+    lock = threading.Lock()
+    # Directories queued, but not yet scanned
+    pending = 0
+
+    def put(d):
+        nonlocal pending
+        with lock:
+            pending += 1
+        dirs.put(d)
+
+    def scanned_dir():
+        nonlocal pending
+        with lock:
+            pending -= 1
+            if not pending:
+                done.set()
+
+    def changed(path):
+        found.append(path)
+        done.set()
+
+    for root in roots:
+        try:
+            st = os.lstat(root)
+        except OSError:
+            return root, 0
+        if max(st.st_mtime, st.st_ctime) >= since:
+            return root, 0
+        if os.path.isdir(root) and not os.path.islink(root):
+            put(root)
+    if not pending:
+        return None, 0
+
+    def worker():
+        scanned = 0
+        try:
+            while not done.is_set():
+                try:
+                    d = dirs.get(timeout=0.05)
+                except queue.Empty:
+                    continue
+                try:
+                    with os.scandir(d) as entries:
+                        for entry in entries:
+                            if done.is_set():
+                                break
+                            scanned += 1
+                            st = entry.stat(follow_symlinks=False)
+                            if max(st.st_mtime, st.st_ctime) >= since:
+                                changed(entry.path)
+                                break
+                            if entry.is_dir(follow_symlinks=False):
+                                put(entry.path)
+                except OSError:
+                    changed(d)
+                finally:
+                    scanned_dir()
+        finally:
+            counts.append(scanned)
+
+    threads = [threading.Thread(target=worker, daemon=True,
+                                name='sya-scan')
+               for _ in range(jobs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return (found[0] if found else None), sum(counts)
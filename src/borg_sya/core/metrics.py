@@ -0,0 +1,139 @@
+""" Export metrics about task and repository operations as a textfile for the
+node_exporter textfile collector (or any other scraper reading the Prometheus
+text format).
+
+The file is rewritten atomically after each operation. Since it has to
+describe all tasks, not only those that ran in this invocation, the values
+are persisted in a state file in the cache directory.
+"""
+
+import json
+import threading
+
+from .util import write_atomically
+
+
+# name -> (type, help)
+METRICS = {
+    'sya_last_run_timestamp_seconds': (
+        'gauge', "Time when the operation last finished."),
+    'sya_last_success_timestamp_seconds': (
+        'gauge', "Time when the operation last finished successfully."),
+    'sya_last_run_success': (
+        'gauge', "Whether the last run of the operation succeeded."),
+    'sya_last_run_duration_seconds': (
+        'gauge', "Duration of the last run of the operation."),
+    'sya_runs_total': (
+        'counter', "Number of runs of the operation, by result."),
+    'sya_borg_errors_total': (
+        'counter', "Number of errors reported by borg, by msgid."),
+    'sya_archive_original_size_bytes': (
+        'gauge', "Original size of the last archive."),
+    'sya_archive_compressed_size_bytes': (
+        'gauge', "Compressed size of the last archive."),
+    'sya_archive_deduplicated_size_bytes': (
+        'gauge', "Deduplicated size of the last archive."),
+    'sya_archive_files': (
+        'gauge', "Number of files in the last archive."),
+    'sya_last_pruned_archives': (
+        'gauge', "Number of archives deleted by the last prune."),
+    'sya_pruned_archives_total': (
+        'counter', "Number of archives deleted by prune."),
+}
+
+_ARCHIVE_STATS = {
+    'original_size': 'sya_archive_original_size_bytes',
+    'compressed_size': 'sya_archive_compressed_size_bytes',
+    'deduplicated_size': 'sya_archive_deduplicated_size_bytes',
+    'nfiles': 'sya_archive_files',
+}
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\').replace('\n', r'\n')
+            .replace('"', r'\"'))
+
+
+def _format_labels(labels):
+    return ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+
+
+class Metrics():
+    """A sink for `operation.track`. If `path` is None or in a dry run,
+    nothing is recorded.
+    """
+    def __init__(self, path, statefile):
+        self.path = path
+        self.statefile = statefile
+        self.dryrun = False
+        self._lock = threading.Lock()
+        self._values = None
+
+    def _load(self):
+        # {name: {labels (as a JSON list of pairs): value}}
+        if self._values is None:
+            try:
+                with open(self.statefile) as f:
+                    self._values = json.load(f)
+            except (OSError, ValueError):
+                self._values = dict()
+        return self._values
+
+    def _set(self, name, labels, value):
+        self._load().setdefault(name, {})[json.dumps(labels)] = value
+
+    def _inc(self, name, labels, value=1):
+        series = self._load().setdefault(name, {})
+        key = json.dumps(labels)
+        series[key] = series.get(key, 0) + value
+
+    def record(self, op):
+        """Update the metrics from an `operation.Operation` and write them.
+        """
+        if not self.path or self.dryrun:
+            return
+        labels = [['task', op.task or ''], ['repository', op.repository],
+                  ['operation', op.operation]]
+        task_labels = labels[:2]
+        end = op.start + op.duration
+        with self._lock:
+            self._set('sya_last_run_timestamp_seconds', labels, end)
+            self._set('sya_last_run_success', labels, int(op.success))
+            self._set('sya_last_run_duration_seconds', labels, op.duration)
+            self._inc('sya_runs_total',
+                      labels + [['result', 'success' if op.success
+                                 else 'failure']])
+            if op.success:
+                self._set('sya_last_success_timestamp_seconds', labels, end)
+            if op.msgid:
+                self._inc('sya_borg_errors_total',
+                          labels + [['msgid', op.msgid]])
+            stats = op.archive_stats
+            if stats:
+                for key, name in _ARCHIVE_STATS.items():
+                    if key in stats:
+                        self._set(name, task_labels, stats[key])
+            if op.pruned is not None:
+                self._set('sya_last_pruned_archives', task_labels, op.pruned)
+                self._inc('sya_pruned_archives_total', task_labels, op.pruned)
+            self._write()
+
+    def render(self):
+        values = self._load()
+        lines = []
+        for name, (type, help) in METRICS.items():
+            series = values.get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for labels, value in sorted(series.items()):
+                lines.append(f'{name}{{{_format_labels(json.loads(labels))}}}'
+                             f' {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _write(self):
+        write_atomically(self.statefile,
+                         json.dumps(self._values).encode('utf8'))
+        # Must be readable by the exporter
+        write_atomically(self.path, self.render().encode('utf8'), mode=0o644)
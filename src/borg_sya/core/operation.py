@@ -0,0 +1,61 @@
+""" Tracking the outcome of task and repository operations (create, prune,
+check), which is passed on to sinks such as `metrics.Metrics` and
+`history.History`.
+"""
+
+from contextlib import contextmanager
+import time
+
+from .borg import BorgError
+
+
+class Operation():
+    """The outcome of an operation, filled in while it runs.
+    """
+    def __init__(self, operation, repository, task=None):
+        self.operation = operation
+        self.repository = repository
+        self.task = task
+        self.start = time.time()
+        self.duration = None
+        self.success = False
+        # The msgid of a BorgError, or the name of any other exception
+        self.msgid = None
+        self.error = None
+        # As described by `borg create --json`, including the stats
+        self.archive = None
+        self.pruned = None
+
+    @property
+    def archive_stats(self):
+        if self.archive:
+            return self.archive.get('stats')
+
+
+@contextmanager
+def track(operation, repository, task=None, sinks=(), warn=None):
+    """Track the operation in the with-block, which can add details to the
+    yielded `Operation`. Afterwards, it is passed to the `record` method of
+    all `sinks`, no matter whether it succeeded. Failing sinks are reported
+    to `warn`, but neither affect the operation nor the other sinks.
+    """
+    op = Operation(operation, repository, task)
+    try:
+        yield op
+        op.success = True
+    except BorgError as e:
+        op.msgid = getattr(e, 'msgid', None) or type(e).__name__
+        op.error = op.msgid
+        raise
+    except BaseException as e:
+        op.error = type(e).__name__
+        raise
+    finally:
+        op.duration = time.time() - op.start
+        for sink in sinks:
+            try:
+                sink.record(op)
+            except Exception as e:
+                if warn:
+                    warn(f"Failed to record {operation} in "
+                         f"{type(sink).__name__}: {e}")
@@ -0,0 +1,142 @@
+""" Compilation of a task's includes and excludes into a file for
+`borg create --patterns-from`, such that they don't end up on the command
+line (which is limited in length, and logged).
+
+The file is only regenerated when its sources (the `includes` and
+`path_prefix` of the task, and the include and exclude files) change. Their
+key and a summary are stored next to it.
+"""
+
+from fnmatch import fnmatchcase
+import hashlib
+import json
+import os
+
+from .config import fingerprint
+from .util import atomic_file, write_atomically
+
+
+# Bump when the format of the generated files changes.
+VERSION = 1
+
+
+def _key(includes, include_file, exclude_file, path_prefix):
+    sources = [VERSION, includes, path_prefix,
+               fingerprint([f for f in (include_file, exclude_file) if f])]
+    return hashlib.sha1(json.dumps(sources).encode('utf8')).hexdigest()
+
+
+def _lines(path):
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line and not line.startswith('#'):
+                yield line
+
+
+def fm_match(pattern, path):
+    """Whether `path` (or any of its parents) matches the `fm:` style
+    `pattern`, as borg matches it.
+    """
+    pattern = os.path.normpath(pattern).lstrip(os.sep)
+    return fnmatchcase(path.lstrip(os.sep) + os.sep, pattern + os.sep + '*')
+
+
+def _check_absolute(path, what):
+    if not os.path.isabs(path):
+        raise ValueError(f"{what} must be an absolute path: '{path}'")
+    return path
+
+
+class PatternsFile():
+    """The patterns file of a single task below `<cachedir>/patterns/`.
+
+    Includes are written as roots (`R path`), excludes as `- fm:pattern`,
+    which is the style borg uses for `--exclude`.
+    """
+    def __init__(self, cachedir, name):
+        self.path = os.path.join(cachedir, 'patterns', f'{name}.lst')
+        self._meta_file = os.path.join(cachedir, 'patterns', f'{name}.json')
+
+    def _read_meta(self):
+        try:
+            with open(self._meta_file, 'rb') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, includes, include_file=None, exclude_file=None,
+               path_prefix=''):
+        """Regenerate the file if any of its sources changed. Returns a
+        summary `{'roots': ..., 'excludes': ..., 'key': ...,
+        'regenerated': ...}`.
+        """
+        key = _key(includes, include_file, exclude_file, path_prefix)
+        meta = self._read_meta()
+        if (meta and meta.get('key') == key
+                and os.path.exists(self.path)):
+            return dict(meta['summary'], key=key, regenerated=False)
+
+        if path_prefix:
+            _check_absolute(path_prefix, "'path-prefix'")
+
+        def prefixed(path, what):
+            _check_absolute(path, what)
+            if path_prefix:
+                # Strip the initial '/' such that os.path.join will treat
+                # it as a relative path
+                return os.path.join(path_prefix, path.lstrip(os.sep))
+            return path
+
+        roots = excludes = 0
+        with atomic_file(self.path) as f:
+            def root(path):
+                nonlocal roots
+                f.write(f'R {prefixed(path, "Includes")}\n'.encode('utf8'))
+                roots += 1
+
+            def exclude(pattern):
+                nonlocal excludes
+                f.write(f'- fm:{prefixed(pattern, "Excludes")}\n'
+                        .encode('utf8'))
+                excludes += 1
+
+            for path in includes:
+                root(path)
+            if include_file:
+                for line in _lines(include_file):
+                    if line.startswith('- '):
+                        exclude(line[2:])
+                    else:
+                        root(line)
+            if exclude_file:
+                for line in _lines(exclude_file):
+                    exclude(line)
+
+        summary = {'roots': roots, 'excludes': excludes}
+        write_atomically(self._meta_file,
+                         json.dumps({'key': key, 'summary': summary})
+                         .encode('utf8'))
+        return dict(summary, key=key, regenerated=True)
+
+    def _entries(self, marker, strip):
+        with open(self.path, 'rb') as f:
+            for line in f:
+                if line.startswith(marker):
+                    path = line[len(marker):].rstrip(b'\n').decode('utf8')
+                    if strip:
+                        path = os.path.join(os.sep,
+                                            os.path.relpath(path, strip))
+                    yield path
+
+    def roots(self, strip=''):
+        """The paths to back up, with the `path_prefix` applied unless it is
+        given as `strip`.
+        """
+        return self._entries(b'R ', strip)
+
+    def excludes(self, strip=''):
+        """The exclude patterns (`fm:` style), with the `path_prefix` applied
+        unless it is given as `strip`.
+        """
+        return self._entries(b'- fm:', strip)
@@ -0,0 +1,138 @@
+""" Schedules for running tasks from the daemon, configured per task as
+either an interval or a calendar spec:
+
+    schedule: 6h                # every 6 hours (units: s, m, h, d, w)
+    schedule: 1h30m
+    schedule: hourly :15        # at quarter past every hour
+    schedule: daily 02:30
+    schedule: weekly sun 03:00
+    jitter: 20m                 # spread runs by up to 20 minutes
+
+The jitter is a fixed offset per task (derived from its name), such that the
+load on the backup server is spread out, but predictable.
+"""
+
+from datetime import datetime, timedelta
+import re
+import zlib
+
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+_DURATION = re.compile(r'(\d+)([smhdw])')
+_WEEKDAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def parse_duration(text):
+    """Seconds from e.g. '90s', '15m', '1h30m' or a plain number of seconds.
+    """
+    if isinstance(text, (int, float)):
+        return text
+    text = str(text).strip().lower().replace(' ', '')
+    if text.isdigit():
+        return int(text)
+    pos = 0
+    seconds = 0
+    for m in _DURATION.finditer(text):
+        if m.start() != pos:
+            break
+        seconds += int(m.group(1)) * _UNITS[m.group(2)]
+        pos = m.end()
+    if pos != len(text) or not text:
+        raise ValueError(f"Invalid duration: '{text}'")
+    return seconds
+
+
+def _parse_time(text):
+    m = re.fullmatch(r'(\d{1,2})?:(\d{2})', text)
+    if not m:
+        raise ValueError(f"Invalid time of day: '{text}'")
+    hour = int(m.group(1)) if m.group(1) is not None else None
+    minute = int(m.group(2))
+    if (hour is not None and hour > 23) or minute > 59:
+        raise ValueError(f"Invalid time of day: '{text}'")
+    return hour, minute
+
+
+class Interval():
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("The interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, t):
+        return t + self.seconds
+
+    def __str__(self):
+        return f'{self.seconds}s'
+
+
+class Calendar():
+    """`hourly :MM`, `daily HH:MM` or `weekly DAY HH:MM`, in local time.
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        words = spec.lower().split()
+        try:
+            if words[0] == 'hourly' and len(words) == 2:
+                hour, self.minute = _parse_time(words[1])
+                assert(hour is None)
+                self.period, self.hour, self.weekday = 'hourly', None, None
+            elif words[0] == 'daily' and len(words) == 2:
+                self.hour, self.minute = _parse_time(words[1])
+                self.period, self.weekday = 'daily', None
+            elif words[0] == 'weekly' and len(words) == 3:
+                self.weekday = _WEEKDAYS.index(words[1][:3])
+                self.hour, self.minute = _parse_time(words[2])
+                self.period = 'weekly'
+            else:
+                raise ValueError()
+            if self.period != 'hourly' and self.hour is None:
+                raise ValueError()
+        except (ValueError, IndexError, AssertionError):
+            raise ValueError(f"Invalid schedule: '{spec}'")
+
+    def next_after(self, t):
+        now = datetime.fromtimestamp(t)
+        if self.period == 'hourly':
+            candidate = now.replace(minute=self.minute, second=0,
+                                    microsecond=0)
+            step = timedelta(hours=1)
+        else:
+            candidate = now.replace(hour=self.hour, minute=self.minute,
+                                    second=0, microsecond=0)
+            step = timedelta(days=1)
+        while (candidate <= now
+               or (self.weekday is not None
+                   and candidate.weekday() != self.weekday)):
+            candidate += step
+        return candidate.timestamp()
+
+    def __str__(self):
+        return self.spec
+
+
+class Schedule():
+    def __init__(self, spec, jitter=0, seed=''):
+        self.spec = spec
+        try:
+            self.trigger = Interval(parse_duration(spec))
+        except ValueError:
+            self.trigger = Calendar(spec)
+        self.jitter = parse_duration(jitter or 0)
+        # A stable offset, such that restarts don't reshuffle the runs.
+        self.offset = (zlib.crc32(seed.encode('utf8')) % self.jitter
+                       if self.jitter else 0)
+
+    def next_run(self, last, now):
+        """When to run next, given the start of the `last` run (None if it
+        never ran). Runs which were missed (e.g. while the host was down)
+        are caught up on immediately, but only once.
+        """
+        if last is None:
+            return now
+        # `last` includes the offset, which mustn't accumulate.
+        due = self.trigger.next_after(last - self.offset) + self.offset
+        return max(due, now)
+
+    def __str__(self):
+        return str(self.spec)
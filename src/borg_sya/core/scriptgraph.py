@@ -0,0 +1,159 @@
+""" Running the scripts of a `pre`/`post` list as a dependency graph.
+
+Items of the list are either scripts or mappings
+
+    - name: dump-db
+      run: !sh pg_dumpall > /var/backup/db.sql
+      after: []
+
+An item without `after` runs after the preceding item, thus plain lists run
+one after another as they always did. Items whose dependencies finished run
+concurrently (up to `jobs` at a time). After the first failure, no further
+items are started; the running ones are waited for, and the failure
+propagates.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+
+
+DEFAULT_JOBS = 4
+
+
+class Step():
+    def __init__(self, name, script, after):
+        self.name = name
+        self.script = script
+        self.after = after
+
+    def __repr__(self):
+        return f"Step({self.name!r}, after={self.after!r})"
+
+
+def steps(items):
+    """The `Step`s for a `pre`/`post` list. Raises ValueError for unknown or
+    circular dependencies.
+    """
+    result = []
+    previous = None
+    for i, item in enumerate(items):
+        if item is None:
+            continue
+        if isinstance(item, dict):
+            unknown = set(item) - {'name', 'run', 'after'}
+            if unknown or 'run' not in item:
+                raise ValueError(f"Script items need 'run' and may have "
+                                 f"'name' and 'after', not: {item}")
+            name = str(item.get('name', f'#{i + 1}'))
+            after = item.get('after', [previous] if previous else [])
+            if isinstance(after, str):
+                after = [after]
+            step = Step(name, item['run'], [str(a) for a in after])
+        else:
+            step = Step(f'#{i + 1}', item, [previous] if previous else [])
+        result.append(step)
+        previous = step.name
+
+    names = [s.name for s in result]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Script names must be unique: {names}")
+    for step in result:
+        for dep in step.after:
+            if dep not in names:
+                raise ValueError(f"Script '{step.name}' runs after unknown "
+                                 f"script '{dep}'")
+    _order(result)
+    return result
+
+
+def _order(steps):
+    """The steps in an order compatible with their dependencies.
+    """
+    done = set()
+    ordered = []
+    remaining = list(steps)
+    while remaining:
+        ready = [s for s in remaining if all(d in done for d in s.after)]
+        if not ready:
+            raise ValueError(f"Circular dependencies between the scripts "
+                             f"{', '.join(s.name for s in remaining)}")
+        for s in ready:
+            remaining.remove(s)
+            ordered.append(s)
+            done.add(s.name)
+    return ordered
+
+
+def is_sequential(steps):
+    """Whether each step only runs after the preceding one.
+    """
+    return all(s.after == ([steps[i - 1].name] if i else [])
+               for i, s in enumerate(steps))
+
+
+def run(steps, func, jobs=DEFAULT_JOBS, clock=time.perf_counter):
+    """Call `func(step)` for all steps, respecting their dependencies.
+    Returns `{name: (start, end)}`.
+    """
+    times = dict()
+    if is_sequential(steps):
+        for step in steps:
+            start = clock()
+            func(step)
+            times[step.name] = (start, clock())
+        return times
+
+    waiting = list(steps)
+    running = dict()
+    failure = None
+
+    def timed(step):
+        start = clock()
+        func(step)
+        return start, clock()
+
+    with ThreadPoolExecutor(max_workers=jobs,
+                            thread_name_prefix='sya-script') as executor:
+        while waiting or running:
+            if failure is None:
+                for step in list(waiting):
+                    if len(running) >= jobs:
+                        break
+                    if all(d in times for d in step.after):
+                        waiting.remove(step)
+                        running[executor.submit(timed, step)] = step
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                try:
+                    times[step.name] = future.result()
+                except BaseException as e:
+                    if failure is None:
+                        failure = e
+    if failure is not None:
+        raise failure
+    return times
+
+
+def critical_path(steps, times):
+    """The chain of steps which determined the total duration, as a list of
+    `(name, seconds)`: Starting from the step which finished last, follow
+    the dependency which finished last.
+    """
+    if not times:
+        return []
+    after = {s.name: s.after for s in steps}
+    name = max(times, key=lambda n: times[n][1])
+    path = []
+    while name is not None:
+        start, end = times[name]
+        path.append((name, end - start))
+        deps = [d for d in after[name] if d in times]
+        name = max(deps, key=lambda n: times[n][1]) if deps else None
+    return path[::-1]
+
+
+def format_path(path):
+    return ' -> '.join(f'{name} ({seconds:.2f}s)' for name, seconds in path)
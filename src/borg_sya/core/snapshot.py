@@ -0,0 +1,187 @@
+""" Snapshots of a task's sources, such that `borg create` reads a consistent
+state while services only need to be stopped (by the task's `pre` and `post`
+scripts) for as long as taking the snapshot takes, instead of for the whole
+backup.
+
+A provider makes each source `/some/path` available as
+`<prefix>/some/path`, and the task's patterns use `prefix` as their
+`path_prefix`. Snapshots are kept at a fixed location per task, thus the
+patterns only change with the configuration, and a snapshot left behind by
+an interrupted run is replaced by the next one.
+"""
+
+import os
+import shlex
+import shutil
+import subprocess
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _below(path, parent):
+    return os.path.commonpath([path, parent]) == parent
+
+
+class SnapshotProvider():
+    """Base class of the providers. `take` creates the snapshot of the given
+    sources below `prefix`, `release` removes it (and is also called for any
+    leftovers before taking a new one).
+    """
+    def __init__(self, name, cx, dir=None):
+        self.name = name
+        self.cx = cx
+        dir = dir or os.path.join(cx.cachedir, 'snapshots')
+        self.prefix = os.path.join(dir, name)
+
+    def _target(self, path):
+        """Where `path` appears in the snapshot.
+        """
+        return os.path.normpath(os.path.join(self.prefix,
+                                             path.lstrip(os.sep)))
+
+    def _run(self, *cmdline):
+        cmdline = [str(a) for a in cmdline]
+        text = ' '.join(shlex.quote(a) for a in cmdline)
+        if self.cx.dryrun:
+            self.cx.info(f"Would run {text}")
+            return
+        self.cx.debug(f"Running {text}")
+        try:
+            subprocess.run(cmdline, check=True, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise SnapshotError(f"'{cmdline[0]}' not found")
+        except subprocess.CalledProcessError as e:
+            raise SnapshotError(
+                f"'{text}' returned {e.returncode}:\n"
+                f"{e.stderr.decode('utf8', 'replace')}")
+
+    def _makedirs(self, path):
+        if not self.cx.dryrun:
+            os.makedirs(path, exist_ok=True)
+
+    def _release_leftovers(self):
+        if not self.cx.dryrun:
+            self.release()
+
+    def take(self, roots):
+        raise NotImplementedError()
+
+    def release(self):
+        raise NotImplementedError()
+
+
+class BtrfsSnapshot(SnapshotProvider):
+    """A read-only snapshot of the btrfs `subvolume`, which must contain all
+    sources (but not on nested subvolumes, which are empty in snapshots).
+    It's kept on the same filesystem, by default below
+    `<subvolume>/.sya-snapshots/`.
+    """
+    def __init__(self, name, cx, subvolume, dir=None):
+        self.subvolume = os.path.normpath(subvolume)
+        super().__init__(name, cx,
+                         dir or os.path.join(self.subvolume, '.sya-snapshots'))
+        self.target = self._target(self.subvolume)
+
+    def take(self, roots):
+        for root in roots:
+            if not _below(root, self.subvolume):
+                raise SnapshotError(f"'{root}' is not on the subvolume "
+                                    f"'{self.subvolume}'")
+        self._release_leftovers()
+        self._makedirs(os.path.dirname(self.target))
+        self._run('btrfs', 'subvolume', 'snapshot', '-r',
+                  self.subvolume, self.target)
+
+    def release(self):
+        if self.cx.dryrun or os.path.lexists(self.target):
+            self._run('btrfs', 'subvolume', 'delete', self.target)
+
+
+class LvmSnapshot(SnapshotProvider):
+    """A snapshot of the thin logical `volume` ('vg/lv') mounted at
+    `mountpoint`, which must contain all sources. It's mounted (read-only
+    by default) below `<cachedir>/snapshots/`.
+    """
+    def __init__(self, name, cx, volume, mountpoint, mount_options='ro',
+                 dir=None):
+        super().__init__(name, cx, dir)
+        vg, sep, lv = volume.partition('/')
+        if not (vg and sep and lv):
+            raise ValueError(f"'volume' must be given as 'vg/lv': '{volume}'")
+        self.origin = volume
+        self.volume = f'{vg}/{lv}-sya-{name}'
+        self.device = os.path.join(os.sep, 'dev', self.volume)
+        self.mountpoint = os.path.normpath(mountpoint)
+        self.mount_options = mount_options
+        self.target = self._target(self.mountpoint)
+
+    def take(self, roots):
+        for root in roots:
+            if not _below(root, self.mountpoint):
+                raise SnapshotError(f"'{root}' is not on the volume mounted "
+                                    f"at '{self.mountpoint}'")
+        self._release_leftovers()
+        # Thin snapshots need no size, but are skipped on activation by
+        # default.
+        self._run('lvcreate', '--snapshot', '--setactivationskip', 'n',
+                  '--name', os.path.basename(self.volume), self.origin)
+        try:
+            self._makedirs(self.target)
+            self._run('mount', '-o', self.mount_options, self.device,
+                      self.target)
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        if self.cx.dryrun or os.path.ismount(self.target):
+            self._run('umount', self.target)
+        if self.cx.dryrun or os.path.exists(self.device):
+            self._run('lvremove', '--yes', self.volume)
+
+
+class CopySnapshot(SnapshotProvider):
+    """Copies of the sources (reflinks where the filesystem supports them)
+    below `<cachedir>/snapshots/`. Excludes are only applied by borg, thus
+    this is mostly useful for small sources, and for testing.
+    """
+    def __init__(self, name, cx, dir=None, reflink='auto'):
+        super().__init__(name, cx, dir)
+        self.reflink = reflink
+
+    def take(self, roots):
+        self._release_leftovers()
+        for root in roots:
+            target = self._target(root)
+            self._makedirs(os.path.dirname(target))
+            self._run('cp', '-a', f'--reflink={self.reflink}', root, target)
+
+    def release(self):
+        if self.cx.dryrun:
+            self.cx.info(f"Would remove {self.prefix}")
+        elif os.path.lexists(self.prefix):
+            shutil.rmtree(self.prefix)
+
+
+PROVIDERS = {
+    'btrfs': BtrfsSnapshot,
+    'lvm': LvmSnapshot,
+    'copy': CopySnapshot,
+}
+
+
+def from_config(name, cx, cfg):
+    """The provider for the `snapshot` section of task `name`.
+    """
+    cfg = dict(cfg)
+    kind = cfg.pop('type', None)
+    if kind not in PROVIDERS:
+        raise ValueError(f"'snapshot' needs a 'type' out of "
+                         f"{', '.join(PROVIDERS)}")
+    provider = PROVIDERS[kind](name, cx, **{k.replace('-', '_'): v
+                                            for k, v in cfg.items()})
+    provider.config = dict(cfg, type=kind)
+    return provider
@@ -0,0 +1,165 @@
+""" Accounting of the time spent in the phases of task runs (acquiring the
+repository lock, mount/umount and pre/post scripts, connecting to remote
+repositories, scanning for changes, borg create and prune), accumulated over
+all tasks in one invocation.
+"""
+
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+
+# In the order in which they happen during a task run.
+PHASES = ('acquire-lock', 'mount', 'connect', 'pre', 'scan', 'snapshot',
+          'create', 'prune', 'post', 'release', 'disconnect', 'umount')
+
+
+class Timings():
+    """Wall-clock and CPU time per `(scope, phase)`, where `scope` is the name
+    of a task or repository and `phase` is one of `PHASES`. A phase may have
+    a `detail`, e.g. the intervals of a prune pass, which is recorded
+    separately.
+
+    `cpu` is the CPU time used by sya itself in the thread running the phase,
+    `children_cpu` is the CPU time used by borg and the scripts. The latter
+    is accounted by the OS when the child processes exit, and is only
+    accurate if no other task runs concurrently.
+
+    For phases which run scripts concurrently, the critical path (the chain
+    of scripts which determined the phase's duration) is recorded, too.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self._paths = dict()
+
+    def timer(self, scope):
+        """A callable that maps a phase (and optional detail) to a context
+        manager timing it for `scope`, cf. `Timer`.
+        """
+        return Timer(self, scope)
+
+    @contextmanager
+    def phase(self, scope, phase, detail=None):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        children = os.times()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            now = os.times()
+            children = ((now.children_user - children.children_user)
+                        + (now.children_system - children.children_system))
+            self._add((scope, phase, detail), wall, cpu, children)
+
+    def _add(self, key, wall, cpu, children):
+        with self._lock:
+            entry = self._entries.setdefault(key, [0, 0.0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += wall
+            entry[2] += cpu
+            entry[3] += children
+
+    def critical_path(self, scope, phase, path):
+        """Record the critical path `[(name, seconds), ...]` of the latest
+        run of `phase`.
+        """
+        with self._lock:
+            self._paths[(scope, phase)] = list(path)
+
+    def __bool__(self):
+        return bool(self._entries)
+
+    def report(self):
+        """A JSON-serializable breakdown by scope and phase, and totals per
+        phase over all scopes.
+        """
+        with self._lock:
+            entries = sorted(self._entries.items(), key=_order)
+            paths = sorted(self._paths.items(),
+                           key=lambda p: (p[0][0], _rank(p[0][1])))
+        phases = []
+        totals = dict()
+        for (scope, phase, detail), (count, wall, cpu, children) in entries:
+            phases.append({
+                'scope': scope, 'phase': phase, 'detail': detail,
+                'count': count, 'wall': wall, 'cpu': cpu,
+                'children_cpu': children,
+            })
+            total = totals.setdefault(phase, {'count': 0, 'wall': 0.0,
+                                              'cpu': 0.0,
+                                              'children_cpu': 0.0})
+            total['count'] += count
+            total['wall'] += wall
+            total['cpu'] += cpu
+            total['children_cpu'] += children
+        totals = dict(sorted(totals.items(), key=lambda t: _rank(t[0])))
+        critical_paths = [{'scope': scope, 'phase': phase,
+                           'path': [{'name': n, 'wall': w} for n, w in path]}
+                          for (scope, phase), path in paths]
+        return {'phases': phases, 'totals': totals,
+                'critical_paths': critical_paths}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def format_table(self):
+        report = self.report()
+        rows = [('scope', 'phase', 'n', 'wall [s]', 'cpu [s]',
+                 'children [s]')]
+        for e in report['phases']:
+            phase = e['phase'] + (f" ({e['detail']})" if e['detail'] else '')
+            rows.append((e['scope'], phase, str(e['count']),
+                         f"{e['wall']:.2f}", f"{e['cpu']:.2f}",
+                         f"{e['children_cpu']:.2f}"))
+        for phase, t in report['totals'].items():
+            rows.append(('(total)', phase, str(t['count']),
+                         f"{t['wall']:.2f}", f"{t['cpu']:.2f}",
+                         f"{t['children_cpu']:.2f}"))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(rows[0]))]
+        lines = [
+            '  '.join(c.ljust(w) if i < 2 else c.rjust(w)
+                      for i, (c, w) in enumerate(zip(row, widths)))
+            for row in rows
+        ]
+        for p in report['critical_paths']:
+            path = ' -> '.join(f"{s['name']} ({s['wall']:.2f}s)"
+                               for s in p['path'])
+            lines.append(f"Critical path of {p['scope']} {p['phase']}: "
+                         f"{path}")
+        return '\n'.join(lines)
+
+
+def _rank(phase):
+    return PHASES.index(phase) if phase in PHASES else len(PHASES)
+
+
+def _order(item):
+    (scope, phase, detail), _ = item
+    return (scope, _rank(phase), detail or '')
+
+
+class Timer():
+    """Times phases of `scope`, cf. `Timings.phase`. Without `timings`,
+    nothing is recorded.
+    """
+    def __init__(self, timings, scope):
+        self.timings = timings
+        self.scope = scope
+
+    def __call__(self, phase, detail=None):
+        if self.timings is None:
+            return nullcontext()
+        return self.timings.phase(self.scope, phase, detail)
+
+    def critical_path(self, phase, path):
+        if self.timings is not None:
+            self.timings.critical_path(self.scope, phase, path)
+
+
+no_timer = Timer(None, None)
@@ -0,0 +1,160 @@
+""" SSH connection multiplexing for remote repositories (`[user@]host:path`
+or `ssh://[user@]host[:port]/path`).
+
+Without it, each borg invocation (create, every prune pass, list, ...) opens
+a new SSH connection and pays for the key exchange. Instead, a master
+connection is opened when the repository is first used in a session and
+closed at its end, and borg's ssh commands (cf. `BORG_RSH`) connect through
+its control socket. `persist` bounds how long an orphaned master (e.g. after
+sya was killed) stays around. If the master can't be opened non-interactively
+within `connect_timeout` seconds, borg connects directly as before.
+"""
+
+import hashlib
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from .util import LazyReentrantContextmanager
+
+
+def remote_destination(path):
+    """The ssh destination arguments for a repository `path`, or None if it
+    is local.
+    """
+    if path.startswith('ssh://'):
+        url = urlsplit(path)
+        host = url.hostname
+        if url.username:
+            host = f'{url.username}@{host}'
+        return ['-p', str(url.port), host] if url.port else [host]
+    host, sep, _ = path.partition(':')
+    if sep and host and '/' not in host:
+        return [host]
+    return None
+
+
+class SSHTransport(LazyReentrantContextmanager):
+    """The ssh settings of a remote repository, and the context manager
+    holding its master connection (lazily, cf. `Repository.__enter__`).
+    """
+    def __init__(self, name, destination, control_dir, cx,
+                 command=None, multiplex=True, persist=60, cipher=None,
+                 compression=None, keepalive=None, connect_timeout=10,
+                 options=()):
+        super().__init__()
+        self.name = name
+        self.destination = destination
+        self.cx = cx
+        # Respect a BORG_RSH set by the user, e.g. to select a key.
+        command = command or os.environ.get('BORG_RSH', 'ssh')
+        self.command = (shlex.split(command) if isinstance(command, str)
+                        else list(command))
+        self.multiplex = multiplex
+        self.persist = persist
+        self.cipher = cipher
+        self.compression = compression
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.options = list(options)
+        # Short, since the path of UNIX sockets is limited to ~100 bytes.
+        key = hashlib.sha1(name.encode('utf8')).hexdigest()[:12]
+        self.socket = os.path.join(control_dir, f'{key}.sock')
+        self.active = False
+
+    @classmethod
+    def from_config(cls, name, path, cfg, cx):
+        """The transport of the repository `name` for its `ssh` section
+        `cfg`, or None if the repository is local.
+        """
+        destination = remote_destination(path)
+        if destination is None:
+            return None
+        cfg = {k.replace('-', '_'): v for k, v in (cfg or {}).items()}
+        return cls(name, destination, os.path.join(cx.cachedir, 'ssh'), cx,
+                   **cfg)
+
+    def _options(self):
+        options = []
+        if self.cipher:
+            options.extend(['-c', self.cipher])
+        if self.compression is not None:
+            options.extend(['-o', f"Compression="
+                                  f"{'yes' if self.compression else 'no'}"])
+        if self.keepalive:
+            options.extend(['-o', f'ServerAliveInterval={self.keepalive}'])
+        return options + self.options
+
+    def rsh(self):
+        """The ssh command for borg (`BORG_RSH`).
+        """
+        args = self.command + self._options()
+        if self.active:
+            args.extend(['-o', f'ControlPath={self.socket}',
+                         '-o', 'ControlMaster=no'])
+        return ' '.join(shlex.quote(a) for a in args)
+
+    def _enter(self):
+        if not self.multiplex:
+            return
+        if self.cx.dryrun:
+            self.cx.info(f"Would open an SSH master connection for "
+                         f"{self.name}")
+            return
+        os.makedirs(os.path.dirname(self.socket), mode=0o700, exist_ok=True)
+        cmdline = self.command + self._options() + [
+            # Never prompt (for passwords or unknown host keys), borg
+            # connecting directly still can.
+            '-o', 'BatchMode=yes',
+            '-o', f'ConnectTimeout={self.connect_timeout}',
+            '-o', 'ControlMaster=yes',
+            '-o', f'ControlPath={self.socket}',
+            '-o', f'ControlPersist={self.persist}',
+            # Go to the background once connected
+            '-f', '-N', *self.destination,
+        ]
+        t0 = time.perf_counter()
+        with self.cx.timings.phase(self.name, 'connect'), \
+                tempfile.TemporaryFile() as err:
+            # The master keeps stdout open, thus don't wait for a pipe.
+            try:
+                p = subprocess.run(cmdline, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=err,
+                                   # Authentication might hang as well.
+                                   timeout=2 * self.connect_timeout)
+                error = f"ssh returned {p.returncode}"
+            except subprocess.TimeoutExpired:
+                p = None
+                error = "timed out"
+            err.seek(0)
+            err = err.read().decode('utf8', 'replace').strip()
+        if p is None or p.returncode:
+            self.cx.warning(f"-- Could not open an SSH master connection "
+                            f"for {self.name}, connecting directly "
+                            f"({error}: {err})")
+            return
+        self.active = True
+        self.cx.info(f"-- Connected to {self.destination[-1]} for "
+                     f"{self.name} in {time.perf_counter() - t0:.2f}s.")
+
+    def _exit(self, type, value, traceback):
+        if not self.active:
+            return
+        self.active = False
+        with self.cx.timings.phase(self.name, 'disconnect'):
+            try:
+                returncode = subprocess.run(
+                    self.command + ['-o', f'ControlPath={self.socket}',
+                                    '-O', 'exit', *self.destination],
+                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL, timeout=self.connect_timeout,
+                ).returncode
+            except subprocess.TimeoutExpired:
+                returncode = None
+        if returncode != 0:
+            self.cx.debug(f"Closing the SSH master connection for "
+                          f"{self.name} failed, it exits after "
+                          f"{self.persist}s.")
@@ -1,25 +1,69 @@
-from io import BytesIO
+import builtins
+from collections import deque
+from contextlib import contextmanager
+from importlib.util import MAGIC_NUMBER
 import logging
+import marshal
 import os
+import selectors
 import socket
 import subprocess
 import sys
 from subprocess import Popen
-from threading import Thread
+import threading
+from threading import get_ident
 from wcwidth import wcswidth
 from yaml import YAMLObject
-from yaml.loader import SafeLoader
+from yaml.constructor import ConstructorError
+try:
+    # LibYAML, which is much faster
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml.loader import SafeLoader
 
 
 def which(command):
-    for d in os.environ['PATH'].split(':'):
+    for d in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        path = os.path.join(d, command)
+        if isexec(path):
+            return path
+    raise RuntimeError(f"Command not found: {command}.")
+
+
+def user_cache_dir(appname):
+    """The per-user cache directory for the application, according to the
+    XDG base directory specification.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, appname)
+
+
+@contextmanager
+def atomic_file(path, mode=0o600):
+    """A binary file to be written in the with-block, which replaces the file
+    at `path` only once the block succeeds, such that concurrent readers
+    never observe a partially written file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
         try:
-            for binary in os.listdir(d):
-                if binary == command:
-                    return os.path.join(d, command)
+            os.unlink(tmp)
         except OSError:
             pass
-    raise RuntimeError(f"Command not found: {command}.")
+        raise
+
+
+def write_atomically(path, data, mode=0o600):
+    """Replace the file at `path` by `data` (bytes), cf. `atomic_file`.
+    """
+    with atomic_file(path, mode) as f:
+        f.write(data)
 
 
 def isexec(path):
@@ -66,6 +110,10 @@ class ProcessLock():
     def __exit__(self, type, value, traceback):
         self.release()
 
+    @property
+    def held(self):
+        return self._recursion_level > 0
+
     def acquire(self):
         if not self._recursion_level:
             self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
@@ -124,6 +172,8 @@ def indent(text, by=4):
 
 
 def truncate_path(path, width):
+    if width < 1:
+        return ''
     if wcswidth(path) <= width:
         # This includes the case wcswidth(path) == -1, i.e. non-printable (borg/issues/1090)
         return path
@@ -138,6 +188,43 @@ def truncate_path(path, width):
 
 
 
+# Bytes read from the output of scripts at once, and kept of each stream for
+# error messages.
+READ_SIZE = 64 * 1024
+OUTPUT_TAIL = 64 * 1024
+
+
+class RingBuffer():
+    """Keeps the last `size` bytes written to it.
+    """
+    def __init__(self, size=OUTPUT_TAIL):
+        self.size = size
+        self.truncated = False
+        self._chunks = deque()
+        self._len = 0
+
+    def write(self, data):
+        self._chunks.append(data)
+        self._len += len(data)
+        while self._len > self.size:
+            excess = self._len - self.size
+            first = self._chunks[0]
+            if len(first) <= excess:
+                self._chunks.popleft()
+                self._len -= len(first)
+            else:
+                self._chunks[0] = first[excess:]
+                self._len -= excess
+            self.truncated = True
+
+    def getvalue(self):
+        return b''.join(self._chunks)
+
+    def text(self):
+        text = self.getvalue().decode('utf8', 'replace')
+        return '[...]\n' + text if self.truncated else text
+
+
 class Script(YAMLObject):
     """A YAML object with a tag to be set by subclasses that reads a scalar
     node and returns a callable that executes the node's text.
@@ -149,38 +236,36 @@ class Script(YAMLObject):
         self.script = script
 
     def run_popen(self, cmdline, **popen_args):
-        # https://stackoverflow.com/questions/4984428/python-subprocess-get-childrens-output-to-file-and-terminal
-        # https://stackoverflow.com/questions/17190221/subprocess-popen-cloning-stdout-and-stderr-both-to-terminal-and-variables
-        def tee(infile, *files):
-            def fanout(infile, *files):
-                while True:
-                    d = infile.readline(128)
-                    if len(d):
-                        for f, flush in files:
-                            f.write(d)
-                            if flush:
-                                f.flush()
-                    else:
-                        break
-                infile.close()
-            t = Thread(target=fanout, args=(infile, *files))
-            t.daemon = True
-            t.start()
-            return(t)
-
+        """Run `cmdline`, copying its output to ours as it arrives if
+        `passthrough` is set. Only the tail of the output is kept (cf.
+        `RingBuffer`), and returned or included in the error.
+        """
         p = Popen(cmdline, env=self.env,
                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                   **popen_args)
-        out = BytesIO()
-        err = BytesIO()
-        t_out = tee(p.stdout, (sys.stdout.buffer, True), (out, False))
-        t_err = tee(p.stderr, (sys.stderr.buffer, True), (err, False))
-        t_out.join()
-        t_err.join()
-        p.wait()
-        # TODO: Are there encoding issues here? (or above?)
-        out = out.getvalue().decode('utf8')
-        err = err.getvalue().decode('utf8')
+        tails = {p.stdout: RingBuffer(), p.stderr: RingBuffer()}
+        targets = {p.stdout: sys.stdout, p.stderr: sys.stderr}
+        try:
+            with selectors.DefaultSelector() as selector:
+                for f in tails:
+                    selector.register(f, selectors.EVENT_READ)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        data = os.read(key.fd, READ_SIZE)
+                        if not data:
+                            selector.unregister(key.fileobj)
+                            continue
+                        tails[key.fileobj].write(data)
+                        if self.passthrough:
+                            target = targets[key.fileobj]
+                            target.buffer.write(data)
+                            target.flush()
+        finally:
+            p.stdout.close()
+            p.stderr.close()
+            p.wait()
+        out = tails[p.stdout].text()
+        err = tails[p.stderr].text()
 
         if p.returncode:
             raise RuntimeError(f"{cmdline} returned {p.returncode}:\n{err}")
@@ -189,7 +274,8 @@ class Script(YAMLObject):
     def run(self,
             log, args=None, env=None,
             dryrun=False, capture_out=True,
-            dir=None):
+            dir=None, passthrough=True,
+            context=None, python_worker=None):
         if self.script:
             self.log = log
             self.args = args
@@ -197,6 +283,9 @@ class Script(YAMLObject):
             self.dryrun = dryrun
             self.capture_out = capture_out
             self.dir = dir
+            self.passthrough = passthrough
+            self.context = context
+            self.python_worker = python_worker
             self._run()
 
     def _run(self):
@@ -226,10 +315,11 @@ class ExternalScript(Script):
     yaml_tag = '!external_script'
 
     def _run(self):
-        if not os.path.isabs(self.script):
-            script = os.path.join(self.dir, self.script)
+        script = self.script
+        if not os.path.isabs(script):
+            script = os.path.join(self.dir, script)
         if not os.path.isfile(script):
-            raise RuntimeError()
+            raise RuntimeError(f"{script} does not exist.")
 
         if isexec(script):
             cmdline = [script]
@@ -264,18 +354,114 @@ class ShellScript(Script):
 
 
 class PythonScript(Script):
-    """
+    """Python code, compiled when the configuration is loaded (and cached
+    with it, cf. `config.ConfigCache`). It runs in a namespace of its own
+    with `log`, `args`, `env` and `context` (the names of the task and
+    repository, and the phase), either in sya's process or, if configured,
+    in the `PythonWorker`.
     """
     yaml_tag = '!python'
+    filename = '<!python script>'
 
-    def _run(self):
-        if self.args or self.env:
-            raise NotImplementedError()
+    def __init__(self, script):
+        super().__init__(script)
+        # Raises SyntaxError
+        self.code = compile(script, self.filename, 'exec')
 
+    @classmethod
+    def from_yaml(cls, loader, node):
+        try:
+            return super().from_yaml(loader, node)
+        except SyntaxError as e:
+            raise ConstructorError(None, None,
+                                   f"invalid !python script: {e}",
+                                   node.start_mark)
+
+    def __getstate__(self):
+        # Code objects can't be pickled, but marshalled for the same
+        # version of Python.
+        return {'script': self.script, 'magic': MAGIC_NUMBER,
+                'code': marshal.dumps(self.code)}
+
+    def __setstate__(self, state):
+        self.script = state['script']
+        if state.get('magic') == MAGIC_NUMBER:
+            self.code = marshal.loads(state['code'])
+        else:
+            self.code = compile(self.script, self.filename, 'exec')
+
+    def _run(self):
         if self.dryrun:
-            msg = indent(f">>> {'... '.join(script.splitlines(keepends=True))}")
+            msg = indent(f">>> "
+                         f"{'... '.join(self.script.splitlines(keepends=True))}")
             self.log.info(msg)
             return msg
-        else:
-            # Propagate exceptions
-            return(exec(self.script))
+
+        namespace = {'args': list(self.args or []), 'env': self.env,
+                     'context': dict(self.context or {})}
+        # Propagate exceptions
+        if self.python_worker:
+            return self.python_worker.run(self.code, namespace)
+        return exec_script(self.code, dict(namespace, log=self.log))
+
+
+def exec_script(code, namespace):
+    namespace = {
+        '__name__': '__sya_script__',
+        '__builtins__': builtins,
+        'logging': logging,
+        'log': logging.getLogger(),
+        **namespace,
+    }
+    exec(code, namespace)
+
+
+def _init_worker(level):
+    logging.basicConfig(format='{name}: {message}', style='{', level=level)
+
+
+def _exec_in_worker(code, namespace):
+    exec_script(marshal.loads(code), namespace)
+
+
+class PythonWorker():
+    """A process in which `!python` scripts run, such that slow or
+    memory-hungry ones neither hold up nor bloat sya. It's started on first
+    use and then reused; scripts run in it one after another.
+    """
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def run(self, code, namespace):
+        from concurrent.futures import ProcessPoolExecutor
+        from concurrent.futures.process import BrokenProcessPool
+        import multiprocessing
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    # Don't fork sya's threads
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(logging.getLogger().level,),
+                )
+            executor = self._executor
+        future = executor.submit(_exec_in_worker, marshal.dumps(code),
+                                 namespace)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # Start a new one next time
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise RuntimeError("The worker process running the !python "
+                               "script died.")
+
+    def close(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
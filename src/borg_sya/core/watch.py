@@ -0,0 +1,331 @@
+""" Near-continuous backups: watch the paths of tasks with inotify, and back
+them up shortly after they changed.
+
+Changes are debounced per repository: A session (i.e. the repository's
+lock and mount scripts, then all changed tasks on it) starts once no further
+change was seen for `quiet` seconds, but at the latest `max_delay` seconds
+after the first change. Changes during a session cause another one.
+
+Each watched directory costs kernel memory, and their number is limited by
+`fs.inotify.max_user_watches`. If the limit is reached, the affected task is
+backed up every `max_delay` seconds instead. If the kernel's event queue
+overflows, all tasks are considered changed and the watches are renewed.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+
+from .patterns import fm_match
+from .util import LockInUse
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM
+              | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+              | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+_EVENT = struct.Struct('iIII')
+
+
+class WatchLimitReached(Exception):
+    pass
+
+
+class Inotify():
+    """A minimal wrapper of the inotify API of Linux.
+    """
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOSPC, errno.ENOMEM):
+                raise WatchLimitReached(path)
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """The pending `(wd, mask, name)` events, without blocking.
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher():
+    """Call `func(repo, tasks)` for the tasks with changes, once per
+    repository and debounced as described above, until `stop` is called.
+    Up to `jobs` repositories are backed up concurrently.
+
+    If `func` raises `LockInUse`, its tasks are tried again after another
+    quiet period.
+    """
+    def __init__(self, cx, func, tasks, quiet=60, max_delay=600, jobs=1,
+                 clock=time.monotonic):
+        self.cx = cx
+        self.func = func
+        self.tasks = [t for t in tasks if t.enabled]
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.jobs = jobs
+        self.clock = clock
+        # wd -> (path, {task: None, or the names of the files to watch})
+        self._watches = dict()
+        self._excludes = dict()
+        self._unwatched = set()
+        # repo -> [first change, last change, set of tasks]
+        self._changes = dict()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self.inotify = None
+        # Written to in order to wake up the main loop
+        self._wakeup_r = self._wakeup_w = None
+
+    def _wakeup(self):
+        if self._wakeup_w is None:
+            # Not running
+            return
+        try:
+            os.write(self._wakeup_w, b'\0')
+        except BlockingIOError:
+            # Already pending
+            pass
+
+    def stop(self):
+        """Stop once the running sessions finished. Can be called from a
+        signal handler.
+        """
+        self._stopping = True
+        self._wakeup()
+
+    def _excluded(self, task, path):
+        return any(fm_match(p, path) for p in self._excludes[task])
+
+    def _add_watch(self, task, path, name=None):
+        """Watch the directory `path` for `task`, either entirely or only
+        the entry `name`. Returns whether that succeeded.
+        """
+        if task in self._unwatched:
+            return False
+        try:
+            wd = self.inotify.add_watch(path)
+        except WatchLimitReached:
+            self.cx.warning(
+                f"-- Reached the limit of inotify watches "
+                f"(fs.inotify.max_user_watches) at '{path}', {task} is "
+                f"backed up every {self.max_delay}s instead.")
+            self._unwatched.add(task)
+            self._changed(task)
+            return False
+        except OSError:
+            # Vanished, or not a directory
+            return False
+        tasks = self._watches.setdefault(wd, (path, dict()))[1]
+        if name is None:
+            tasks[task] = None
+        elif task not in tasks:
+            tasks[task] = {name}
+        elif tasks[task] is not None:
+            tasks[task].add(name)
+        return True
+
+    def _watch_tree(self, task, root):
+        """Watch `root` and all directories below it which aren't excluded.
+        If `root` is a file, watch it in its parent directory.
+        """
+        if not os.path.isdir(root) or os.path.islink(root):
+            if not self._excluded(task, root):
+                self._add_watch(task, *os.path.split(root))
+            return
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            if self._excluded(task, path):
+                continue
+            if not self._add_watch(task, path):
+                continue
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+            except OSError:
+                pass
+
+    def _watch_all(self):
+        for task in self.tasks:
+            task.update_patterns()
+            self._excludes[task] = list(task.excludes())
+            for root in task.roots():
+                self._watch_tree(task, root)
+        self.cx.info(f"-- Watching {len(self._watches)} directories.")
+
+    def _changed(self, task, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            change = self._changes.setdefault(task.repo, [now, now, set()])
+            change[1] = now
+            change[2].add(task)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.cx.warning("-- Events were lost (the inotify queue "
+                            "overflowed), backing up all tasks.")
+            for task in self.tasks:
+                self._changed(task)
+            self._watch_all()
+            return
+        if wd not in self._watches:
+            return
+        path, tasks = self._watches[wd]
+        if mask & IN_IGNORED:
+            # The directory was removed (or unmounted)
+            del self._watches[wd]
+            return
+        full = os.path.join(path, name) if name else path
+        for task, names in list(tasks.items()):
+            if names is not None and name not in names:
+                continue
+            if self._excluded(task, full):
+                continue
+            self._changed(task)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(task, full)
+
+    def _pop_due(self, now):
+        """Remove the repositories whose changes are due from the queue.
+        Returns them with their tasks, and the time until the next one is
+        due (or None).
+        """
+        ready = []
+        timeout = None
+        with self._lock:
+            for repo, (first, last, tasks) in list(self._changes.items()):
+                if repo in self._running or len(self._running) >= self.jobs:
+                    # Once a session finishes, its done-callback wakes up
+                    # the main loop, no need for a timeout.
+                    continue
+                due = min(last + self.quiet, first + self.max_delay)
+                if due > now:
+                    delay = due - now
+                    timeout = (delay if timeout is None
+                               else min(timeout, delay))
+                    continue
+                del self._changes[repo]
+                self._running.add(repo)
+                ready.append((repo, tasks))
+        return ready, timeout
+
+    def _session(self, repo, tasks):
+        tasks = [t for t in self.tasks if t in tasks]
+        try:
+            with self.cx.pooled_borg():
+                self.func(repo, tasks)
+        except LockInUse:
+            self.cx.info(f"-- Repository {repo.name} is busy, retrying "
+                         f"later.")
+            for task in tasks:
+                self._changed(task)
+        except Exception as e:
+            self.cx.error(f"Backing up {', '.join(map(str, tasks))} "
+                          f"failed: {e!r}")
+        finally:
+            with self._lock:
+                self._running.discard(repo)
+
+    def run(self):
+        if not self.tasks:
+            self.cx.warning("No enabled task to watch.")
+            return
+        self.inotify = Inotify()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_w, False)
+        futures = set()
+        try:
+            self._watch_all()
+            with ThreadPoolExecutor(max_workers=self.jobs,
+                                    thread_name_prefix='sya-worker',
+                                    ) as executor:
+                try:
+                    while not self._stopping:
+                        now = self.clock()
+                        # Unwatched tasks are always considered changed.
+                        for task in self._unwatched:
+                            self._changed(task, now)
+                        ready, timeout = self._pop_due(now)
+                        for repo, tasks in ready:
+                            future = executor.submit(self._session,
+                                                     repo, tasks)
+                            # Changes might have been deferred until the
+                            # session finished.
+                            future.add_done_callback(
+                                lambda f: self._wakeup())
+                            futures.add(future)
+                        futures = {f for f in futures if not f.done()}
+                        r, _, _ = select.select(
+                            [self.inotify.fd, self._wakeup_r], [], [],
+                            timeout)
+                        if self._wakeup_r in r:
+                            os.read(self._wakeup_r, 1024)
+                        for event in self.inotify.read():
+                            self._handle(*event)
+                    wait(futures)
+                except KeyboardInterrupt:
+                    self.cx.borg_pool.interrupt()
+                    raise
+        finally:
+            self.inotify.close()
+            wakeup_fds = (self._wakeup_r, self._wakeup_w)
+            self._wakeup_r = self._wakeup_w = None
+            for fd in wakeup_fds:
+                os.close(fd)
@@ -0,0 +1,7 @@
+""" Defaults which are needed without loading the core, e.g. to show the help
+of the commandline interface.
+"""
+
+DEFAULT_CONFDIR = '/etc/borg-sya'
+DEFAULT_CONFFILE = 'config.yaml'
+APP_NAME = 'borg-sya'
@@ -292,6 +292,8 @@ def main(confdir):
     atexit.register(logging.shutdown)
     cx.verbose = True
 
-    cx.handler_factory = lambda **kw: BorgHandlers(cx.log, **kw)
+    cx.handler_factory = (
+        lambda log=None, **kw: BorgHandlers(log or cx.log, **kw)
+    )
 
     gui_main(cx)
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import signal
+import sys
+import threading
+import time
+
+import pytest
+
+from borg_sya.core.borg import Borg, Repository, binary
+from borg_sya.core.borg.aio import AsyncBorg
+from borg_sya.core.borg.recording import STDERR, STDOUT, Recording
+
+
+class Repo(Repository):
+    def __init__(self):
+        super().__init__('repo', '/srv/repo', borg=None)
+        self.threads = []
+
+    def __enter__(self):
+        self.threads.append(threading.current_thread())
+
+    def __exit__(self, *exc):
+        pass
+
+
+def record(path, command, chunks):
+    rec = Recording(str(path), ['borg', command])
+    for stream, data in chunks:
+        rec.write(stream, data)
+    rec.close(0)
+
+
+def json_lines(n):
+    return b''.join(json.dumps({'path': f'etc/file{i}', 'size': i}).encode()
+                    + b'\n' for i in range(n))
+
+
+def chunked(data, size=64 * 1024):
+    return [(STDOUT, data[i:i + size]) for i in range(0, len(data), size)]
+
+
+@pytest.fixture
+def recordings(tmp_path, monkeypatch):
+    """Run borg-sya-replay in place of borg, replaying the recordings in the
+    returned directory as fast as possible.
+    """
+    stand_in = tmp_path / 'borg'
+    stand_in.write_text(f'#!/bin/sh\n'
+                        f'[ -n "$IGNORE_SIGINT" ] && trap "" INT\n'
+                        f'exec {sys.executable} '
+                        f'-m borg_sya.core.borg.recording "$@"\n')
+    stand_in.chmod(0o755)
+    monkeypatch.setenv('SYA_BORG_BINARY', str(stand_in))
+    monkeypatch.setenv('SYA_REPLAY', str(tmp_path / 'rec'))
+    monkeypatch.setenv('SYA_REPLAY_SPEED', '0')
+    binary.cache_clear()
+    yield tmp_path / 'rec'
+    binary.cache_clear()
+
+
+def list_messages(*messages):
+    return b''.join(json.dumps({'type': 'log_message', 'time': 0,
+                                'levelname': 'INFO',
+                                'name': 'borg.output.list',
+                                'message': m}).encode() + b'\n'
+                    for m in messages)
+
+
+class TestBorg():
+    ARCHIVE = 'host-2020-01-01      Wed, 2020-01-01 00:00:00 [{}]'
+
+    def test_prune(self, recordings):
+        # borg 1.1 and borg >= 1.2
+        record(recordings / '1-prune.borgrec', 'prune',
+               [(STDERR, list_messages(
+                   'Keeping archive (rule: daily #1): ' + self.ARCHIVE.format(
+                       'cc' * 32),
+                   'Pruning archive: ' + self.ARCHIVE.format('aa' * 32),
+                   'Pruning archive (2/2): ' + self.ARCHIVE.format('bb' * 32),
+               ))])
+        borg = Borg(dryrun=False)
+        assert(borg.prune(Repo(), {'daily': 1})
+               == [('host-2020-01-01', 'aa' * 32),
+                   ('host-2020-01-01', 'bb' * 32)])
+        assert(borg.prune(Repo(), {'daily': 1}, verbose=False) is None)
+
+    def test_stop_early(self, recordings, monkeypatch):
+        monkeypatch.setenv('IGNORE_SIGINT', '1')
+        record(recordings / '1-list.borgrec', 'list',
+               chunked(json_lines(200000)))
+        borg = Borg(dryrun=False)
+        listing = borg.iter_list(Repo(), 'a')
+        assert(next(listing)['path'] == 'etc/file0')
+        start = time.monotonic()
+        listing.close()
+        # borg can't block on writing to the pipes, and exits promptly
+        assert(time.monotonic() - start < borg.INTERRUPT_TIMEOUT / 2)
+        assert(borg._p.returncode not in [-signal.SIGTERM, -signal.SIGKILL])
+        assert(not borg._running)
+
+    def test_streamed(self, recordings, monkeypatch):
+        monkeypatch.setenv('SYA_REPLAY_SPEED', '1')
+        rec = Recording(str(recordings / '1-list.borgrec'), ['borg', 'list'])
+        rec.write(STDOUT, json_lines(1))
+        # The next item arrives 1.5s later
+        rec._last -= 1.5
+        rec.write(STDOUT, json_lines(2)[len(json_lines(1)):])
+        rec.close(0)
+
+        start = time.monotonic()
+        listing = Borg(dryrun=False).iter_list(Repo(), 'a')
+        assert(next(listing)['path'] == 'etc/file0')
+        assert(time.monotonic() - start < 1)
+        assert([f['path'] for f in listing] == ['etc/file1'])
+        assert(time.monotonic() - start >= 1.5)
+
+    def test_prune_unknown_format(self, recordings):
+        record(recordings / '1-prune.borgrec', 'prune',
+               [(STDERR, list_messages('Pruning archive [2/2] host-2020'))])
+        assert(Borg(dryrun=False).prune(Repo(), {'daily': 1}) is None)
+
+
+class TestAsyncBorg():
+    def test_create_list(self, recordings):
+        progress = {'type': 'archive_progress', 'original_size': 1,
+                    'compressed_size': 1, 'deduplicated_size': 1,
+                    'nfiles': 1, 'path': '/etc/file0', 'time': 0}
+        record(recordings / '1-create.borgrec', 'create',
+               [(STDERR, json.dumps(progress).encode() + b'\n'),
+                (STDOUT, b'{"archive": {"name": "a"}}\n')])
+        record(recordings / '2-list.borgrec', 'list',
+               [(STDOUT, json_lines(3))])
+        repo = Repo()
+
+        async def run():
+            borg = AsyncBorg(dryrun=False)
+            msgs = [msg async for msg in borg.create(repo, ['/etc'])]
+            files = [f async for f in borg.list(repo, 'a')]
+            return msgs, files
+
+        msgs, files = asyncio.run(run())
+        assert([m['type'] for m in msgs] == ['archive_progress'])
+        assert([f['path'] for f in files]
+               == ['etc/file0', 'etc/file1', 'etc/file2'])
+        # The repository is entered outside of the event loop
+        assert(repo.threads and threading.main_thread() not in repo.threads)
+
+    def test_stop_early(self, recordings, monkeypatch):
+        # Keep writing after SIGINT, such that borg only exits if its output
+        # is still read.
+        monkeypatch.setenv('IGNORE_SIGINT', '1')
+        record(recordings / '1-list.borgrec', 'list',
+               chunked(json_lines(200000)))
+        borg = AsyncBorg(dryrun=False)
+
+        async def run():
+            listing = borg.list(Repo(), 'a')
+            async for f in listing:
+                break
+            start = time.monotonic()
+            await listing.aclose()
+            return f, time.monotonic() - start
+
+        first, elapsed = asyncio.run(run())
+        assert(first['path'] == 'etc/file0')
+        # borg exited without escalating to SIGTERM
+        assert(elapsed < borg.INTERRUPT_TIMEOUT / 2)
+        assert(borg._p.returncode not in [-signal.SIGTERM, -signal.SIGKILL])
+        assert(not borg._running)
+
+    def test_list_repository(self, recordings):
+        record(recordings / '1-list.borgrec', 'list',
+               [(STDOUT, b'{"archives": [{"name": "a"}], '
+                         b'"repository": {"id": "r"}}\n')])
+        borg = AsyncBorg(dryrun=False)
+
+        async def run():
+            listing = await borg.list_repository(Repo())
+            archives = [a async for a in borg.iter_list(Repo())]
+            return listing, archives
+
+        listing, archives = asyncio.run(run())
+        assert(listing['repository'] == {'id': 'r'})
+        assert(archives == [{'name': 'a'}])
@@ -0,0 +1,45 @@
+import os
+
+from borg_sya.core.cache import ArchiveCatalogue
+
+
+def listing(*names):
+    return {
+        'archives': [{'name': n, 'id': n * 4, 'start': f'2020-01-0{i + 1}'}
+                     for i, n in enumerate(names)],
+        'repository': {'id': 'ab' * 32, 'last_modified': '2020-01-03'},
+    }
+
+
+class TestArchiveCatalogue():
+    def test_local(self, tmp_path):
+        repo = tmp_path / 'repo'
+        repo.mkdir()
+        cat = ArchiveCatalogue(str(tmp_path / 'cache'), str(repo))
+        assert(cat.get() is None)
+
+        cat.store(listing('a', 'b'))
+        assert([a['name'] for a in cat.get()] == ['a', 'b'])
+
+        cat.update(added=[{'name': 'c', 'id': 'cccc', 'start': '2020-01-03'}],
+                   removed=['aaaa'])
+        assert([a['name'] for a in cat.get()] == ['b', 'c'])
+        # Pruned archives unknown
+        cat.update(removed=None)
+        assert(cat.get() is None)
+        cat.store(listing('b', 'c'))
+
+        # Modified by somebody else
+        stamp = os.stat(repo).st_mtime_ns
+        os.utime(repo, ns=(stamp + 10**9, stamp + 10**9))
+        assert(cat.get() is None)
+        cat.validate()
+        cat.update(added=[{'name': 'd', 'id': 'dddd', 'start': '2020-01-04'}])
+        assert(cat.get() is None)
+
+    def test_remote(self, tmp_path):
+        cat = ArchiveCatalogue(str(tmp_path), 'user@host:repo')
+        cat.store(listing('a'))
+        assert([a['name'] for a in cat.get()] == ['a'])
+        cat.REMOTE_MAX_AGE = 0
+        assert(cat.get() is None)
@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pytest
+
+from borg_sya.core.borg.columns import (Columns, FILE_SCHEMA, ARCHIVE_SCHEMA,
+                                        INT, CATEGORY, DATETIME, OBJECT)
+
+
+def files(n):
+    for i in range(n):
+        yield {'type': '-', 'user': 'root', 'path': f'etc/file{i % 3}',
+               'mtime': '2020-01-01T00:00:00.000000', 'size': i}
+
+
+class TestColumns():
+    def test_columns(self):
+        table = Columns(FILE_SCHEMA)
+        table.CHUNK_SIZE = 4
+        table.extend(files(10))
+        # A key that is not in the schema and missing from earlier records
+        table.append({'path': 'extra', 'size': 1, 'other': 'x'})
+
+        assert(len(table) == 11)
+        assert(table.dtypes() == {'type': CATEGORY, 'user': CATEGORY,
+                                  'path': CATEGORY, 'mtime': DATETIME,
+                                  'size': INT, 'other': OBJECT})
+        assert(table['size'] == list(range(10)) + [1])
+        assert(table['path'][:4] == ['etc/file0', 'etc/file1', 'etc/file2',
+                                     'etc/file0'])
+        assert(table['user'][-1] is None)
+        assert(table['mtime'][0] == datetime(2020, 1, 1))
+        assert(table['mtime'][-1] is None)
+        assert(table['other'] == [None] * 10 + ['x'])
+        assert(list(table)[1]['path'] == 'etc/file1')
+
+    def test_pandas(self):
+        pd = pytest.importorskip('pandas')
+        archives = [{'name': 'a', 'start': '2020-01-01T00:00:00.000000'},
+                    {'name': 'b', 'start': '2020-01-02T12:00:00.000000'}]
+        df = Columns(ARCHIVE_SCHEMA).extend(archives).to_pandas()
+        assert(str(df['start'].dtype) == 'datetime64[ns]')
+        assert(df['start'][1] == pd.Timestamp('2020-01-02 12:00'))
+
+        df = Columns(FILE_SCHEMA).extend(files(5)).to_pandas()
+        assert(str(df['path'].dtype) == 'category')
+        assert(str(df['size'].dtype) == 'int64')
+        assert(list(df['path'].cat.categories)
+               == ['etc/file0', 'etc/file1', 'etc/file2'])
+        assert(df['size'].sum() == 10)
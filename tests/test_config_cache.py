@@ -0,0 +1,74 @@
+import logging
+import os
+
+import pytest
+
+from borg_sya.core import Context, config
+from borg_sya.core.util import ExternalScript, ShellScript
+
+CONFIG = """\
+sya:
+    verbose: false
+repositories:
+    repo:
+        path: /tmp/repo
+        passphrase-file: passphrase
+        mount:
+            - mount.sh
+            - !sh echo mounted
+tasks:
+    task:
+        repository: repo
+        includes: [/etc]
+        exclude-file: excludes
+        pre: pre.sh
+"""
+
+
+@pytest.fixture
+def confdir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    confdir = tmp_path / 'conf'
+    confdir.mkdir()
+    (confdir / 'config.yaml').write_text(CONFIG)
+    (confdir / 'passphrase').write_text('secret\n')
+    (confdir / 'excludes').write_text('/etc/shadow\n')
+    return str(confdir)
+
+
+def load(confdir):
+    return Context.from_configuration(logging.NullHandler(), confdir,
+                                      'config.yaml')
+
+
+class TestConfigCache():
+    def test_cache(self, confdir, monkeypatch):
+        cx = load(confdir)
+        repo = cx.repos['repo']
+        assert(repo.passphrase == 'secret')
+        # The path resolvers still apply with the LibYAML loader
+        assert([type(s) for s in repo.scripts.pre]
+               == [ExternalScript, ShellScript])
+        assert([type(s) for s in cx.tasks['task'].scripts.pre]
+               == [ExternalScript])
+        cache = config.ConfigCache(cx.cachedir,
+                                   os.path.join(confdir, 'config.yaml'))
+        assert(os.stat(cache.path).st_mode & 0o077 == 0)
+
+        def parse(conffile):
+            raise AssertionError("Not cached")
+        with monkeypatch.context() as m:
+            m.setattr(config, 'parse', parse)
+            cx = load(confdir)
+        assert(cx.repos['repo'].passphrase == 'secret')
+        assert(cx.tasks['task'].exclude_file
+               == os.path.join(confdir, 'excludes'))
+
+        # Any referenced file invalidates the cache
+        with open(os.path.join(confdir, 'passphrase'), 'w') as f:
+            f.write('changed, and longer\n')
+        assert(cache.load() is None)
+        assert(load(confdir).repos['repo'].passphrase == 'changed, and longer')
+        assert(cache.load() is not None)
+        os.unlink(os.path.join(confdir, 'excludes'))
+        assert(cache.load() is None)
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from borg_sya.core import Context
+
+
+class FakeTask():
+    def __init__(self, name, repo):
+        self.name = name
+        self.repo = repo
+        self.enabled = True
+
+
+class TestRunTasks():
+    def make_cx(self):
+        return Context('/nonexistent', False, False, None, None, None)
+
+    def test_sequential(self):
+        cx = self.make_cx()
+        tasks = [FakeTask(n, 'r') for n in 'abc']
+        seen = []
+        cx.run_tasks(lambda t: seen.append(t.name), tasks)
+        assert(seen == ['a', 'b', 'c'])
+
+    def test_same_repo_serialized(self):
+        cx = self.make_cx()
+        tasks = [FakeTask('a', 'r1'), FakeTask('b', 'r2'),
+                 FakeTask('c', 'r1'), FakeTask('d', 'r2')]
+        active = {'r1': 0, 'r2': 0}
+        overlap = []
+        borgs = dict()
+        lock = threading.Lock()
+
+        def run(task):
+            with lock:
+                active[task.repo] += 1
+                overlap.append(active[task.repo])
+                borgs[task.name] = cx.borg
+            time.sleep(0.05)
+            with lock:
+                active[task.repo] -= 1
+
+        cx.run_tasks(run, tasks, jobs=4)
+        assert(max(overlap) == 1)
+        assert(borgs['a'] is borgs['c'])
+        assert(borgs['a'] is not borgs['b'])
+        assert(cx.borg not in borgs.values())
+
+    def test_exception_propagates(self):
+        cx = self.make_cx()
+        tasks = [FakeTask('a', 'r1'), FakeTask('b', 'r2')]
+
+        def run(task):
+            if task.name == 'b':
+                raise ValueError()
+
+        try:
+            cx.run_tasks(run, tasks, jobs=2)
+        except ValueError:
+            pass
+        else:
+            assert(False)
@@ -0,0 +1,47 @@
+import json
+import random
+
+from borg_sya.core.borg.framing import JsonFramer, LineFramer
+
+
+def feed_in_chunks(framer, data, maxsize):
+    items = []
+    pos = 0
+    while pos < len(data):
+        size = random.randint(1, maxsize)
+        items.extend(framer.feed(data[pos:pos + size]))
+        pos += size
+    items.extend(framer.close())
+    return items
+
+
+class TestJsonFramer():
+    def test_single_line(self):
+        framer = JsonFramer()
+        assert(framer.feed(b'{"type": "a"}\n{"type": "b"}\n')
+               == [{'type': 'a'}, {'type': 'b'}])
+        assert(framer.close() == [])
+
+    def test_multi_line_and_not_json(self):
+        msgs = [{'type': 'log_message', 'message': 'a {brace} and "quotes"\\'},
+                {'nested': {'list': [1, 2, {'x': '}'}]}},
+                ]
+        data = (b'some text {\n'
+                + json.dumps(msgs[0]).encode() + b'\n'
+                + json.dumps(msgs[1], indent=4).encode() + b'\n'
+                + b'trailing')
+        for maxsize in [1, 3, 17, len(data)]:
+            items = feed_in_chunks(JsonFramer(), data, maxsize)
+            assert(items == [b'some text {\n', msgs[0], msgs[1],
+                             b'trailing\n'])
+
+    def test_no_trailing_newline(self):
+        framer = JsonFramer()
+        assert(framer.feed(b'{"a": 1}') == [])
+        assert(framer.close() == [{'a': 1}])
+
+
+class TestLineFramer():
+    def test_lines(self):
+        items = feed_in_chunks(LineFramer(), b'ab\ncd\n\nef', 2)
+        assert(items == [b'ab\n', b'cd\n', b'\n', b'ef'])
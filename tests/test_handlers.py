@@ -0,0 +1,64 @@
+import logging
+
+import pytest
+
+from borg_sya.core.borg import BorgError, DefaultHandlers, handles
+from borg_sya.core.borg.messages import ArchiveProgress, FileStatus
+
+
+class RecordingHandlers(DefaultHandlers):
+    def __init__(self):
+        super().__init__(logging.getLogger('test'))
+        self.seen = []
+
+    def onArchiveProgress(self, msg):
+        self.seen.append(msg)
+
+    @handles('file_status')
+    def onFile(self, msg):
+        self.seen.append(msg)
+
+    @handles('question_prompt')
+    def onQuestion(self, **msg):
+        self.seen.append(msg)
+
+    def onBorgOutput(self, **msg):
+        self.seen.append(('borg', msg['message']))
+
+    def onOtherMessage(self, **msg):
+        self.seen.append(('other', msg['message']))
+
+
+class TestDispatch():
+    def test_typed_messages(self):
+        h = RecordingHandlers()
+        h._dispatch({'type': 'archive_progress', 'path': '/a', 'nfiles': 2,
+                     'original_size': 1, 'compressed_size': 1,
+                     'deduplicated_size': 1, 'time': 0})
+        h._dispatch({'type': 'archive_progress', 'finished': True, 'time': 1})
+        h._dispatch({'type': 'file_status', 'status': 'A', 'path': '/b'})
+        a, finished, f = h.seen
+        assert(isinstance(a, ArchiveProgress))
+        assert(a.path == '/a' and a.nfiles == 2 and not a.finished)
+        assert(finished.finished)
+        assert(isinstance(f, FileStatus) and f.status == 'A')
+
+    def test_declarative_registration(self):
+        h = RecordingHandlers()
+        h._dispatch({'type': 'question_prompt', 'msgid': 'X', 'message': ''})
+        assert(h.seen == [{'type': 'question_prompt', 'msgid': 'X',
+                           'message': ''}])
+        # Registrations of subclasses don't leak into the base class
+        assert(('question_prompt', None) not in DefaultHandlers._HANDLERS)
+
+    def test_log_messages(self):
+        h = RecordingHandlers()
+        h._dispatch({'type': 'log_message', 'name': 'borg.output.stats',
+                     'message': 'x'})
+        h._dispatch({'type': 'log_message', 'name': 'borg.repository',
+                     'message': 'y', 'msgid': 'cache.sync'})
+        h._dispatch({'type': 'log_message', 'name': 'other', 'message': 'z'})
+        assert(h.seen == [('borg', 'x'), ('borg', 'y'), ('other', 'z')])
+        with pytest.raises(BorgError):
+            h._dispatch({'type': 'log_message', 'name': 'borg.archiver',
+                         'message': 'failed', 'msgid': 'LockError'})
@@ -0,0 +1,12 @@
+import socket
+
+from borg_sya.core.borg.helpers import replace_placeholders
+
+
+def test_replace_placeholders():
+    hostname = socket.gethostname()
+    assert(replace_placeholders('{hostname}-') == f'{hostname}-')
+    # Placeholders which borg replaces when creating the archive
+    assert(replace_placeholders('{hostname}-{now:%Y-%m-%d}-{pid}')
+           == f'{hostname}-{{now:%Y-%m-%d}}-{{pid}}')
+    assert(replace_placeholders('{utcnow.year}') == '{utcnow.year}')
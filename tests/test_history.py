@@ -0,0 +1,76 @@
+import pytest
+
+from borg_sya.core.borg import BorgError
+from borg_sya.core.history import History, trends
+from borg_sya.core.operation import track
+
+DAY = 86400
+
+
+def create(history, start, duration, original, deduplicated):
+    with track('create', 'repo', 'task', [history]) as op:
+        op.start = start
+        op.archive = {'name': f'task-{start}', 'id': 'ab',
+                      'stats': {'original_size': original,
+                                'deduplicated_size': deduplicated,
+                                'compressed_size': original, 'nfiles': 1}}
+    # `track` measures the real duration, override it for the test.
+    history._db.execute('UPDATE runs SET start = ?, duration = ? '
+                        'WHERE id = (SELECT max(id) FROM runs)',
+                        (start, duration))
+
+
+class TestHistory():
+    def test_trends(self, tmp_path):
+        history = History(str(tmp_path / 'history.sqlite'))
+        create(history, 0 * DAY, 10, 1000, 1000)
+        create(history, 1 * DAY, 10, 1200, 200)
+        create(history, 2 * DAY, 40, 1400, 200)
+        with pytest.raises(BorgError):
+            with track('create', 'repo', 'task', [history]):
+                raise BorgError(message='locked', msgid='LockErrorT')
+        with track('prune', 'repo', 'task', [history]) as op:
+            op.pruned = 2
+
+        runs = history.runs('task')
+        assert([r['archive'] for r in runs[:3]]
+               == ['task-0', f'task-{DAY}', f'task-{2 * DAY}'])
+        assert(len(history.runs('task', since=DAY)) == 3)
+        assert(history.runs('task', operation='prune')[0]['pruned'] == 2)
+
+        t = trends(runs)
+        assert(t['runs'] == 4 and t['failed'] == 1)
+        assert(t['errors'] == ['LockErrorT'])
+        assert(t['original_growth_per_day'] == 200)
+        assert(t['deduplicated_per_day'] == 200)
+        assert(t['dedup_ratio'] == 7)
+        assert(t['slower'])
+        history.close()
+
+    def test_dryrun(self, tmp_path):
+        history = History(str(tmp_path / 'history.sqlite'))
+        history.dryrun = True
+        with track('check', 'repo', sinks=[history]):
+            pass
+        history.dryrun = False
+        assert(history.runs(operation='check') == [])
+
+
+def test_failing_sink(tmp_path):
+    class Broken():
+        def record(self, op):
+            raise OSError('disk full')
+
+    history = History(str(tmp_path / 'history.sqlite'))
+    warnings = []
+    with track('create', 'repo', 'task', [Broken(), history],
+               warn=warnings.append):
+        pass
+    # The error of the operation itself is kept
+    with pytest.raises(BorgError):
+        with track('create', 'repo', 'task', [Broken(), history],
+                   warn=warnings.append):
+            raise BorgError(message='locked', msgid='LockErrorT')
+    assert([r['success'] for r in history.runs('task')] == [1, 0])
+    assert(len(warnings) == 2 and 'disk full' in warnings[0])
+    history.close()
@@ -0,0 +1,70 @@
+import pytest
+
+from borg_sya.core.index import ContentIndex, index_repository
+
+
+def items(n):
+    for i in range(n):
+        yield {'path': f'etc/d{i % 2}/file{i}', 'size': i,
+               'mtime': '2020-01-01T00:00:00.000000'}
+
+
+class FakeRepo():
+    path = '/repo'
+
+
+class FakeBorg():
+    def __init__(self):
+        self.listed = []
+
+    def iter_list(self, repo, archive, handlers=None):
+        self.listed.append(archive)
+        return items(4)
+
+
+def archive(name, start):
+    return {'name': name, 'id': name * 4, 'start': start}
+
+
+class TestContentIndex():
+    def test_find(self, tmp_path):
+        with ContentIndex(str(tmp_path / 'index.sqlite')) as index:
+            index.add('/repo', archive('a', '2020-01-01'), items(4))
+            index.add('/repo', archive('b', '2020-01-02'), items(3))
+            index.add('/other', archive('a', '2020-01-03'), items(1))
+
+            found = list(index.find('/etc/d0/file2'))
+            assert([(a, p, s) for a, p, s, _ in found]
+                   == [('a', 'etc/d0/file2', 2), ('b', 'etc/d0/file2', 2)])
+            assert(len(list(index.find('etc/*/file*', repository='/repo')))
+                   == 7)
+            assert(len(list(index.find('etc/d1/*', prefix='b'))) == 1)
+
+    def test_rollback(self, tmp_path):
+        def failing():
+            yield {'path': 'new/dir/file'}
+            raise RuntimeError()
+
+        with ContentIndex(str(tmp_path / 'index.sqlite')) as index:
+            with pytest.raises(RuntimeError):
+                index.add('/repo', archive('a', '2020-01-01'), failing())
+            assert(index.indexed('/repo') == set())
+            # The directory inserted by the failed add is inserted again
+            index.add('/repo', archive('a', '2020-01-01'),
+                      [{'path': 'new/dir/file'}])
+            assert([p for _, p, *_ in index.find('new/dir/file')]
+                   == ['new/dir/file'])
+
+    def test_index_repository(self, tmp_path):
+        borg = FakeBorg()
+        with ContentIndex(str(tmp_path / 'index.sqlite')) as index:
+            archives = [archive('a', '2020-01-01'), archive('b', '2020-01-02')]
+            assert(list(index_repository(index, FakeRepo(), borg,
+                                         archives=archives)) == ['a', 'b'])
+            # Already indexed archives are skipped, deleted ones dropped.
+            archives = [archive('b', '2020-01-02'), archive('c', '2020-01-03')]
+            assert(list(index_repository(index, FakeRepo(), borg,
+                                         archives=archives)) == ['c'])
+            assert(borg.listed == ['a', 'b', 'c'])
+            assert(set(a for a, *_ in index.find('etc/d0/file0'))
+                   == {'b', 'c'})
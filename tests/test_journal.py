@@ -0,0 +1,106 @@
+import logging
+import os
+import time
+
+from borg_sya.core import Context, Repository, Task
+from borg_sya.core.borg import Borg
+from borg_sya.core.journal import ChangeJournal, changed_since
+from borg_sya.core.snapshot import CopySnapshot
+from borg_sya.core.util import ShellScript
+
+
+def checkpoint():
+    time.sleep(0.02)
+    since = time.time()
+    time.sleep(0.02)
+    return since
+
+
+class TestChangedSince():
+    def test_scan(self, tmp_path):
+        deep = tmp_path / 'a' / 'b' / 'c'
+        deep.mkdir(parents=True)
+        for i in range(20):
+            (tmp_path / 'a' / f'file{i}').write_text('x')
+        (deep / 'file').write_text('x')
+        os.symlink('/nonexistent', str(tmp_path / 'link'))
+        root = str(tmp_path)
+
+        since = checkpoint()
+        path, scanned = changed_since([root], since, jobs=4)
+        assert(path is None and scanned == 25)
+
+        (deep / 'file').write_text('y')
+        assert(changed_since([root], since)[0] == str(deep / 'file'))
+
+        since = checkpoint()
+        (deep / 'file').unlink()
+        assert(changed_since([root], since)[0] == str(deep))
+
+        missing = str(tmp_path / 'missing')
+        assert(changed_since([root, missing], checkpoint())[0] == missing)
+
+    def test_journal(self, tmp_path):
+        journal = ChangeJournal(str(tmp_path), 'task')
+        assert(journal.last() is None)
+        journal.record(1000.0, 'abc')
+        assert(journal.last() == {'start': 1000.0, 'key': 'abc'})
+
+
+class TestSkip():
+    def test_backup(self, tmp_path):
+        (tmp_path / 'data').mkdir()
+        (tmp_path / 'data' / 'file').write_text('x')
+        marker = tmp_path / 'pre-ran'
+        cx = Context(str(tmp_path), dryrun=False, verbose=False, log=None,
+                     repos=None, tasks=None, cachedir=str(tmp_path / 'cache'))
+        repo = Repository('repo', str(tmp_path / 'repo'), cx)
+        task = Task('task', cx, repo, enabled=True, prefix='task',
+                    keep=[{'daily': 7}], includes=[str(tmp_path / 'data')],
+                    include_file=None, exclude_file=None, path_prefix=None,
+                    pre=ShellScript(f'touch {marker}'), pre_desc='',
+                    post=None, post_desc='', skip_if_unchanged=True)
+        pruned = []
+        task.prune = lambda: pruned.append(task)
+        task.journal.record(checkpoint(), task.update_patterns()['key'])
+
+        task.backup(progress=False)
+        # Neither the pre-scripts nor prune ran
+        assert(not marker.exists() and not pruned)
+        # The daemon counts the skipped run
+        assert(cx.history.last_run('task') is not None)
+
+    def test_snapshot(self, tmp_path, monkeypatch):
+        (tmp_path / 'data').mkdir()
+        data = tmp_path / 'data' / 'file'
+        data.write_text('x')
+        # The lock's name is derived from the paths and must be short.
+        cx = Context('/tmp', dryrun=False, verbose=False,
+                     log=logging.getLogger('test'), repos=None, tasks=None,
+                     cachedir=str(tmp_path / 'cache'))
+        repo = Repository('repo', '/nonexistent/repo', cx,
+                          pre_desc='mount script', post_desc='umount script')
+        task = Task('task', cx, repo, enabled=True, prefix='task',
+                    keep=[{'daily': 7}], includes=[str(tmp_path / 'data')],
+                    include_file=None, exclude_file=None, path_prefix=None,
+                    pre=None, pre_desc='pre script', post=None,
+                    post_desc='post script', skip_if_unchanged=True,
+                    snapshot=CopySnapshot('task', cx))
+        take = task.snapshot.take
+
+        def take_then_modify(roots):
+            take(roots)
+            # Too late for the archive
+            time.sleep(0.02)
+            data.write_text('y')
+            time.sleep(0.02)
+
+        monkeypatch.setattr(task.snapshot, 'take', take_then_modify)
+        monkeypatch.setattr(Borg, 'create', lambda *args, **kwargs: {
+            'archive': {'name': 'task-1', 'id': 'aa' * 32}})
+
+        assert(task.create(progress=False))
+        # The next run doesn't skip the change
+        key = task.update_patterns()['key']
+        assert(task.journal.last()['start'] < data.stat().st_mtime)
+        assert(not task._unchanged(key))
@@ -0,0 +1,44 @@
+import pytest
+
+from borg_sya.core.borg import BorgError
+from borg_sya.core.metrics import Metrics
+from borg_sya.core.operation import track
+
+
+class TestMetrics():
+    def test_operations(self, tmp_path):
+        path = tmp_path / 'textfile' / 'sya.prom'
+        state = tmp_path / 'cache' / 'metrics.json'
+        metrics = Metrics(str(path), str(state))
+        with track('create', 'repo', 'task', [metrics]) as op:
+            op.archive = {'stats': {'original_size': 100, 'nfiles': 2}}
+        with pytest.raises(BorgError):
+            with track('prune', 'repo', 'task', [metrics]) as op:
+                raise BorgError(message='locked', msgid='LockErrorT')
+
+        text = path.read_text()
+        labels = 'task="task",repository="repo"'
+        assert(f'sya_archive_original_size_bytes{{{labels}}} 100\n' in text)
+        assert(f'sya_archive_files{{{labels}}} 2\n' in text)
+        assert(f'sya_last_run_success{{{labels},operation="prune"}} 0\n'
+               in text)
+        assert(f'sya_borg_errors_total{{{labels},operation="prune",'
+               f'msgid="LockErrorT"}} 1\n' in text)
+        assert('sya_last_success_timestamp_seconds{' + labels
+               + ',operation="prune"}' not in text)
+
+        # Values persist across invocations
+        metrics = Metrics(str(path), str(state))
+        with track('create', 'repo', 'task', [metrics]):
+            pass
+        text = path.read_text()
+        assert(f'sya_runs_total{{{labels},operation="create",'
+               f'result="success"}} 2\n' in text)
+        assert('LockErrorT' in text)
+
+    def test_disabled(self, tmp_path):
+        metrics = Metrics(str(tmp_path / 'sya.prom'), str(tmp_path / 's'))
+        metrics.dryrun = True
+        with track('check', 'repo', sinks=[metrics]):
+            pass
+        assert(not (tmp_path / 'sya.prom').exists())
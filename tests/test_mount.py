@@ -0,0 +1,50 @@
+import os
+import shutil
+import signal
+import tempfile
+
+from click.testing import CliRunner
+
+import borg_sya.cli as cli
+from borg_sya.core.borg import Borg
+from borg_sya.core.borg.helpers import replace_placeholders
+from borg_sya.core.cache import ArchiveCatalogue
+
+
+def test_mount_default_prefix(tmp_path, monkeypatch):
+    # The lock's name is derived from the paths and must be short.
+    d = tempfile.mkdtemp(prefix='sya')
+    repo = f'{d}/r'
+    with open(f'{d}/config.yaml', 'w') as f:
+        f.write(f"sya:\n"
+                f"    verbose: false\n"
+                f"repositories:\n"
+                f"    repo:\n"
+                f"        path: {repo}\n"
+                f"tasks:\n"
+                f"    task:\n"
+                f"        repository: repo\n"
+                f"        includes: [/etc/hostname]\n")
+    os.mkdir(repo)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    prefix = replace_placeholders('{hostname}-')
+    names = ['other-1', f'{prefix}1', f'{prefix}2', 'other-2']
+    ArchiveCatalogue(str(tmp_path / 'borg-sya'), repo).store({
+        'archives': [{'name': n, 'id': str(i) * 4, 'start': f'2020-01-0{i}'}
+                     for i, n in enumerate(names, 1)],
+        'repository': {'id': 'ab' * 32},
+    })
+    mounted = []
+    monkeypatch.setattr(Borg, 'mount', lambda self, repo, archive, *args,
+                        **kwargs: mounted.append(archive))
+
+    sigwinch = signal.getsignal(signal.SIGWINCH)
+    try:
+        result = CliRunner().invoke(cli.main, ['-d', d, 'mount', '-t',
+                                               'task^', '/mnt'])
+    finally:
+        signal.signal(signal.SIGWINCH, sigwinch)
+        shutil.rmtree(d)
+    assert(result.exit_code == 0), result.output
+    # The next-to-last archive of the task
+    assert(mounted == [f'{prefix}1'])
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from borg_sya.core.patterns import PatternsFile
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class TestPatternsFile():
+    def test_update(self, tmp_path):
+        include_file = str(tmp_path / 'includes')
+        exclude_file = str(tmp_path / 'excludes')
+        write(include_file, '/home\n- /home/*/.cache\n\n# comment\n')
+        write(exclude_file, '/var/tmp\n')
+        patterns = PatternsFile(str(tmp_path / 'cache'), 'task')
+
+        summary = patterns.update(['/etc'], include_file, exclude_file,
+                                  path_prefix='/snap')
+        key = summary.pop('key')
+        assert(summary == {'roots': 2, 'excludes': 2, 'regenerated': True})
+        assert(list(patterns.roots()) == ['/snap/etc', '/snap/home'])
+        with open(patterns.path) as f:
+            assert(f.read().splitlines() == [
+                'R /snap/etc',
+                'R /snap/home',
+                '- fm:/snap/home/*/.cache',
+                '- fm:/snap/var/tmp',
+            ])
+
+        summary = patterns.update(['/etc'], include_file, exclude_file,
+                                  path_prefix='/snap')
+        assert(not summary['regenerated'] and summary['key'] == key)
+        # Any of the sources changed
+        assert(patterns.update(['/etc', '/root'], include_file, exclude_file,
+                               path_prefix='/snap')['regenerated'])
+        write(exclude_file, '/var/tmp\n/var/cache\n')
+        summary = patterns.update(['/etc', '/root'], include_file,
+                                  exclude_file, path_prefix='/snap')
+        assert(summary['key'] != key)
+        assert((summary['roots'], summary['excludes']) == (3, 3))
+
+    def test_relative(self, tmp_path):
+        patterns = PatternsFile(str(tmp_path), 'task')
+        with pytest.raises(ValueError):
+            patterns.update(['etc'])
+        assert(not os.path.exists(patterns.path))
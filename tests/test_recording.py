@@ -0,0 +1,47 @@
+import os
+
+from borg_sya.core.borg import recording
+from borg_sya.core.borg.recording import (Recording, read_recording,
+                                          find_recording, replay)
+
+
+def record(path, commandline, chunks, returncode=0):
+    rec = Recording(str(path), commandline)
+    for stream, data in chunks:
+        rec.write(stream, data)
+    rec.close(returncode)
+
+
+class TestRecording():
+    def test_roundtrip(self, tmp_path):
+        path = tmp_path / 'a.borgrec'
+        chunks = [(recording.STDERR, b'{"type": "archive_progress"}\n'),
+                  (recording.STDOUT, b'{"archive": {}}\n')]
+        record(path, ['borg', 'create', 'repo::a'], chunks, returncode=1)
+
+        header, records = read_recording(str(path))
+        assert(header['commandline'] == ['borg', 'create', 'repo::a'])
+        records = list(records)
+        assert([(s, d) for s, _, d in records[:-1]] == chunks)
+        assert(records[-1][0] == recording.EXIT)
+        assert(records[-1][2] == 1)
+
+    def test_replay(self, tmp_path):
+        record(tmp_path / f'1-list{recording.SUFFIX}', ['borg', 'list', 'r'],
+               [(recording.STDOUT, b'listing\n')])
+        record(tmp_path / f'2-create{recording.SUFFIX}',
+               ['borg', 'create', 'r::a'],
+               [(recording.STDERR, b'progress\n'),
+                (recording.STDOUT, b'stats\n')], returncode=2)
+
+        path = find_recording(str(tmp_path), ['create', 'r::b'])
+        assert(path.endswith('2-create' + recording.SUFFIX))
+        assert(find_recording(str(tmp_path), ['check', 'r']) is None)
+
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        assert(replay(path, speed=0, stdout=out_w, stderr=err_w) == 2)
+        os.close(out_w)
+        os.close(err_w)
+        assert(os.read(out_r, 100) == b'stats\n')
+        assert(os.read(err_r, 100) == b'progress\n')
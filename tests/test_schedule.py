@@ -0,0 +1,129 @@
+from datetime import datetime
+
+import pytest
+
+from borg_sya.core import Context
+from borg_sya.core.daemon import Scheduler
+from borg_sya.core.operation import track
+from borg_sya.core.schedule import Schedule, parse_duration
+from borg_sya.core.util import LockInUse
+
+HOUR = 3600
+
+
+class Stub():
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def ts(*args):
+    return datetime(*args).timestamp()
+
+
+class TestSchedule():
+    def test_parse_duration(self):
+        assert(parse_duration('90s') == 90)
+        assert(parse_duration('1h30m') == 90 * 60)
+        assert(parse_duration('2d') == 48 * HOUR)
+        assert(parse_duration(600) == 600)
+        for invalid in ('', 'h', '1x', '1h foo'):
+            with pytest.raises(ValueError):
+                parse_duration(invalid)
+
+    def test_interval(self):
+        s = Schedule('6h')
+        assert(s.next_run(None, 1000) == 1000)
+        assert(s.next_run(1000, 2000) == 1000 + 6 * HOUR)
+        # Missed while down: caught up on once, immediately
+        assert(s.next_run(1000, 1000 + 30 * HOUR) == 1000 + 30 * HOUR)
+
+    def test_calendar(self):
+        daily = Schedule('daily 02:30').trigger
+        assert(daily.next_after(ts(2024, 3, 5, 1, 0))
+               == ts(2024, 3, 5, 2, 30))
+        assert(daily.next_after(ts(2024, 3, 5, 2, 30))
+               == ts(2024, 3, 6, 2, 30))
+        weekly = Schedule('weekly sun 03:00').trigger
+        # 2024-03-05 is a Tuesday
+        assert(weekly.next_after(ts(2024, 3, 5, 12, 0))
+               == ts(2024, 3, 10, 3, 0))
+        hourly = Schedule('hourly :15').trigger
+        assert(hourly.next_after(ts(2024, 3, 5, 12, 20))
+               == ts(2024, 3, 5, 13, 15))
+        for invalid in ('daily', 'daily 25:00', 'weekly 03:00', 'hourly 3:15',
+                        'yearly 03:00'):
+            with pytest.raises(ValueError):
+                Schedule(invalid)
+
+    def test_jitter(self):
+        a = Schedule('1d', jitter='1h', seed='a')
+        assert(0 <= a.offset < HOUR)
+        assert(a.offset == Schedule('1d', jitter='1h', seed='a').offset)
+        assert(a.next_run(a.offset, 1) == 24 * HOUR + a.offset)
+
+    def test_jitter_period(self):
+        # Consecutive runs keep the nominal period, even if the jitter
+        # exceeds it.
+        for spec, jitter, seed in [('1h', '30m', 'a'),
+                                   ('hourly :00', '2h', 'b')]:
+            s = Schedule(spec, jitter=jitter, seed=seed)
+            assert(s.offset > 0)
+            last = s.next_run(None, ts(2024, 3, 5, 0, 0))
+            last = s.next_run(last, last)
+            for _ in range(10):
+                t = s.next_run(last, last)
+                assert(t - last == HOUR)
+                last = t
+
+
+class TestScheduler():
+    def test_busy_and_catch_up(self, tmp_path):
+        cx = Context('/tmp', dryrun=True, verbose=False, log=None,
+                     repos=None, tasks=None, cachedir=str(tmp_path))
+        cx.history.dryrun = False
+        repo = Stub(name='repo')
+        never = Stub(name='never', repo=repo, enabled=True,
+                     schedule=Schedule('1d'))
+        recent = Stub(name='recent', repo=repo, enabled=True,
+                      schedule=Schedule('1d'))
+        unscheduled = Stub(name='x', repo=repo, enabled=True,
+                           schedule=None)
+        with track('create', 'repo', 'recent', [cx.history]):
+            pass
+
+        calls = []
+
+        def func(task):
+            calls.append(task.name)
+            if len(calls) == 1:
+                raise LockInUse()
+            scheduler.stop()
+
+        scheduler = Scheduler(cx, func, [never, recent, unscheduled],
+                              jobs=2, busy_retry=0)
+        scheduler.run()
+        # Retried after the repository was busy; 'recent' is not due yet.
+        assert(calls == ['never', 'never'])
+        last = cx.history.last_run('recent')
+        assert(scheduler.due[recent] == last + 24 * HOUR)
+        assert(scheduler.due[never] > scheduler.clock() + 23 * HOUR)
+        assert(unscheduled not in scheduler.due)
+
+    def test_requeue_before_wakeup(self, tmp_path):
+        cx = Context('/tmp', dryrun=True, verbose=False, log=None,
+                     repos=None, tasks=None, cachedir=str(tmp_path))
+        task = Stub(name='task', repo=Stub(name='repo'), enabled=True,
+                    schedule=Schedule('1d'))
+        scheduler = Scheduler(cx, lambda task: None, [task])
+        queued = []
+
+        class Wakeup():
+            def set(self):
+                queued.append(task in scheduler.due)
+
+        scheduler._wakeup = Wakeup()
+        scheduler._running.add(task.repo)
+        scheduler._run(task)
+        # The main loop sees the next run once woken up.
+        assert(queued == [True])
+        assert(not scheduler._running)
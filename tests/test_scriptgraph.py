@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pytest
+
+from borg_sya.core import config
+from borg_sya.core.scriptgraph import (critical_path, is_sequential, run,
+                                       steps)
+from borg_sya.core.timing import Timings
+from borg_sya.core.util import ExternalScript, ShellScript
+
+
+def item(name, after=None):
+    d = {'name': name, 'run': name}
+    if after is not None:
+        d['after'] = after
+    return d
+
+
+class TestScriptGraph():
+    def test_steps(self):
+        plain = steps(['a', None, 'b'])
+        assert([(s.name, s.after) for s in plain]
+               == [('#1', []), ('#3', ['#1'])])
+        assert(is_sequential(plain))
+
+        graph = steps([item('db', []), item('ldap', []),
+                       item('sync', ['db', 'ldap']), 'cleanup'])
+        assert([s.after for s in graph] == [[], [], ['db', 'ldap'], ['sync']])
+        assert(not is_sequential(graph))
+
+        for invalid in ([item('a'), item('a')],
+                        [item('a', ['b'])],
+                        [item('a', ['b']), item('b', ['a'])],
+                        [{'name': 'a'}]):
+            with pytest.raises(ValueError):
+                steps(invalid)
+
+    def test_run(self):
+        graph = steps([item('db', []), item('ldap', []),
+                       item('sync', ['db', 'ldap'])])
+        running = set()
+        concurrent = []
+        lock = threading.Lock()
+
+        def func(step):
+            with lock:
+                running.add(step.name)
+                concurrent.append(set(running))
+            time.sleep(0.05)
+            with lock:
+                running.discard(step.name)
+
+        times = run(graph, func, jobs=2)
+        assert({'db', 'ldap'} in concurrent)
+        assert(times['sync'][0] >= max(times['db'][1], times['ldap'][1]))
+        assert([n for n, _ in critical_path(graph, times)][-1] == 'sync')
+
+        # With a cap of 1, nothing runs concurrently
+        concurrent.clear()
+        run(graph, func, jobs=1)
+        assert(all(len(c) == 1 for c in concurrent))
+
+    def test_failure(self):
+        graph = steps([item('a', []), item('b', []), item('c', ['a'])])
+        ran = []
+
+        def func(step):
+            ran.append(step.name)
+            if step.name == 'a':
+                raise RuntimeError('a failed')
+            time.sleep(0.05)
+
+        with pytest.raises(RuntimeError):
+            run(graph, func, jobs=2)
+        assert(sorted(ran) == ['a', 'b'])
+
+    def test_critical_path(self):
+        graph = steps([item('a', []), item('b', []), item('c', ['a', 'b'])])
+        times = {'a': (0, 1), 'b': (0, 3), 'c': (3, 4)}
+        assert(critical_path(graph, times) == [('b', 3), ('c', 1)])
+
+        timings = Timings()
+        timings.timer('task').critical_path('pre', [('b', 3), ('c', 1)])
+        assert(timings.report()['critical_paths'][0]['path'][0]
+               == {'name': 'b', 'wall': 3})
+        assert('Critical path of task pre: b (3.00s) -> c (1.00s)'
+               in timings.format_table())
+
+    def test_yaml(self, tmp_path):
+        conffile = tmp_path / 'config.yaml'
+        conffile.write_text(
+            "tasks:\n"
+            "  t:\n"
+            "    pre:\n"
+            "      - name: db\n"
+            "        run: dump.sh\n"
+            "        after: []\n"
+            "      - !sh sync\n"
+        )
+        pre = config.parse(str(conffile))['tasks']['t']['pre']
+        assert(isinstance(pre[0]['run'], ExternalScript))
+        assert(isinstance(pre[1], ShellScript))
@@ -0,0 +1,82 @@
+import logging
+import os
+import pickle
+import textwrap
+import types
+
+import pytest
+import yaml
+
+from borg_sya.core import config
+from borg_sya.core.util import (PythonScript, PythonWorker, RingBuffer,
+                                ShellScript)
+
+
+def test_ring_buffer():
+    buf = RingBuffer(size=10)
+    buf.write(b'0123')
+    assert(buf.getvalue() == b'0123' and not buf.truncated)
+    buf.write(b'456789abc')
+    assert(buf.getvalue() == b'3456789abc' and buf.truncated)
+    buf.write(b'x' * 25)
+    assert(buf.getvalue() == b'x' * 10)
+    assert(buf.text() == '[...]\n' + 'x' * 10)
+
+
+def test_output_tail(capfdbinary):
+    log = logging.getLogger('test')
+    # 8 MB of output on stdout, then an error on stderr
+    script = ShellScript("head -c 8000000 /dev/zero | tr '\\0' x; "
+                         "echo; echo failed >&2; exit 3")
+    with pytest.raises(RuntimeError) as e:
+        script.run(log, passthrough=False)
+    assert(str(e.value).endswith('returned 3:\nfailed\n'))
+    assert(capfdbinary.readouterr().out == b'')
+
+    script = ShellScript("printf 'a%.0s' $(seq 100000); echo")
+    script.run(log)
+    assert(capfdbinary.readouterr().out == b'a' * 100000 + b'\n')
+
+
+class TestPythonScript():
+    SCRIPT = ("import os\n"
+              "log.info('in %s', context['task'])\n"
+              "with open(env['OUT'], 'w') as f:\n"
+              "    f.write(f\"{context['task']} {args} {os.getpid()}\")\n")
+
+    def run(self, script, tmp_path, **kwargs):
+        out = tmp_path / 'out'
+        script.run(logging.getLogger('test'), args=['0'],
+                   env={'OUT': str(out)}, context={'task': 't'}, **kwargs)
+        return out.read_text().split()
+
+    def test_compiled(self, tmp_path):
+        conffile = tmp_path / 'config.yaml'
+        conffile.write_text("pre: !python |\n" + textwrap.indent(
+            self.SCRIPT, '  '))
+        script = config.parse(str(conffile))['pre']
+        assert(isinstance(script.code, types.CodeType))
+        # The code is cached with the configuration
+        script = pickle.loads(pickle.dumps(script))
+        assert(isinstance(script.code, types.CodeType))
+        assert(self.run(script, tmp_path) == ['t', "['0']", str(os.getpid())])
+
+        script.run(logging.getLogger('test'), dryrun=True)
+
+        conffile.write_text("pre: !python 'print('\n")
+        with pytest.raises(yaml.YAMLError):
+            config.parse(str(conffile))
+
+    def test_worker(self, tmp_path):
+        worker = PythonWorker()
+        try:
+            script = PythonScript(self.SCRIPT)
+            t, args, pid = self.run(script, tmp_path, python_worker=worker)
+            assert(pid != str(os.getpid()))
+            # The worker is reused
+            assert(self.run(script, tmp_path, python_worker=worker)[2] == pid)
+            with pytest.raises(ZeroDivisionError):
+                PythonScript('1 / 0').run(logging.getLogger('test'),
+                                          python_worker=worker)
+        finally:
+            worker.close()
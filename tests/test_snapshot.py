@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from borg_sya.core import Context
+from borg_sya.core.patterns import PatternsFile
+from borg_sya.core.snapshot import (BtrfsSnapshot, CopySnapshot,
+                                    SnapshotError, from_config)
+
+
+def make_cx(tmp_path, dryrun=False):
+    return Context('/tmp', dryrun=dryrun, verbose=False, log=None,
+                   repos=None, tasks=None, cachedir=str(tmp_path / 'cache'))
+
+
+class TestSnapshot():
+    def test_copy(self, tmp_path):
+        src = tmp_path / 'src'
+        (src / 'dir').mkdir(parents=True)
+        (src / 'dir' / 'file').write_text('x')
+        (src / 'other').write_text('y')
+        snapshot = CopySnapshot('task', make_cx(tmp_path))
+        roots = [str(src / 'dir'), str(src / 'other')]
+
+        # Leftovers from an interrupted run are replaced
+        os.makedirs(snapshot.prefix + str(src / 'stale'))
+        snapshot.take(roots)
+        copy = snapshot.prefix + str(src)
+        assert(sorted(os.listdir(copy)) == ['dir', 'other'])
+        (src / 'dir' / 'file').write_text('changed')
+        with open(os.path.join(copy, 'dir', 'file')) as f:
+            assert(f.read() == 'x')
+
+        snapshot.release()
+        assert(not os.path.exists(snapshot.prefix))
+
+    def test_patterns(self, tmp_path):
+        snapshot = CopySnapshot('task', make_cx(tmp_path))
+        patterns = PatternsFile(str(tmp_path / 'cache'), 'task')
+        patterns.update(['/etc'], path_prefix=snapshot.prefix)
+        assert(list(patterns.roots()) == [snapshot.prefix + '/etc'])
+        assert(list(patterns.roots(strip=snapshot.prefix)) == ['/etc'])
+
+    def test_btrfs(self, tmp_path):
+        snapshot = BtrfsSnapshot('task', make_cx(tmp_path, dryrun=True),
+                                 '/home')
+        assert(snapshot.prefix == '/home/.sya-snapshots/task')
+        assert(snapshot.target == '/home/.sya-snapshots/task/home')
+        with pytest.raises(SnapshotError):
+            snapshot.take(['/etc'])
+        snapshot.take(['/home/user'])
+
+    def test_from_config(self, tmp_path):
+        cx = make_cx(tmp_path)
+        lvm = from_config('task', cx, {'type': 'lvm', 'volume': 'vg/root',
+                                       'mountpoint': '/',
+                                       'mount-options': 'ro,nouuid'})
+        assert(lvm.volume == 'vg/root-sya-task')
+        assert(lvm.mount_options == 'ro,nouuid')
+        assert(lvm.config['type'] == 'lvm')
+        with pytest.raises(ValueError):
+            from_config('task', cx, {'type': 'zfs'})
+        with pytest.raises(ValueError):
+            from_config('task', cx, {'type': 'lvm', 'volume': 'root',
+                                     'mountpoint': '/'})
+        with pytest.raises(TypeError):
+            from_config('task', cx, {'type': 'copy', 'subvolume': '/'})
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import borg_sya
+
+
+SRC = os.path.dirname(os.path.dirname(borg_sya.__file__))
+
+
+def python(code, *args, **env):
+    return subprocess.run(
+        [sys.executable, '-c', code, *args],
+        env={**os.environ, 'PYTHONPATH': SRC, **env},
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+
+
+class TestStartup():
+    def test_lazy_imports(self):
+        p = python("import sys, borg_sya.cli; "
+                   "print(sorted(m for m in sys.modules if m in "
+                   "{'borg_sya.core', 'yaml', 'blessings', 'sqlite3'}))")
+        assert(p.stdout.strip() == '[]')
+
+    @pytest.mark.parametrize('args', [['--help'], ['create', '--help'],
+                                      ['daemon', '--help']])
+    def test_help_without_config(self, args):
+        p = python("from borg_sya.cli import main; main()",
+                   '-d', '/nonexistent', *args, PATH='')
+        assert(p.returncode == 0)
+        assert('Usage:' in p.stdout)
+
+    def test_borg_lookup_deferred(self):
+        p = python("import borg_sya.core.borg as b; print('ok'); b.binary()",
+                   PATH='', SYA_BORG_BINARY='')
+        assert(p.stdout.strip() == 'ok')
+        assert('Command not found: borg' in p.stderr)
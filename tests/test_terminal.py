@@ -0,0 +1,71 @@
+import io
+import os
+import signal
+import time
+
+import blessings
+
+from borg_sya.cli.terminal import DummySpinner, Terminal
+
+
+def make_terminal(styling=True):
+    stderr = blessings.Terminal(kind='xterm', stream=io.StringIO(),
+                                force_styling=styling)
+    t = Terminal(stdout=blessings.Terminal(stream=io.StringIO()),
+                 stderr=stderr)
+    redraws = []
+    print_ = t._print
+
+    def _print(msg, end='\n', term=None, flush=False):
+        redraws.append(msg)
+        print_(msg, end=end, term=term, flush=flush)
+
+    t._print = _print
+    return t, redraws
+
+
+class TestTerminal():
+    def test_coalesced(self):
+        t, redraws = make_terminal()
+        t.MAX_FPS = 20
+        try:
+            with t.spinner('start') as s:
+                del redraws[:]
+                start = time.monotonic()
+                for i in range(1000):
+                    s(f'msg {i}')
+                    time.sleep(0.0003)
+                elapsed = time.monotonic() - start
+                time.sleep(3 / t.MAX_FPS)
+                # Rate limited to MAX_FPS, plus the final frame
+                assert(1 <= len(redraws) <= elapsed * t.MAX_FPS + 2)
+                assert(t._rendered[0].endswith(' msg 999'))
+                assert('msg 999' in redraws[-1])
+        finally:
+            signal.signal(signal.SIGWINCH, t._prev_sigwinch)
+
+    def test_pipe(self):
+        t, redraws = make_terminal(styling=False)
+        try:
+            with t.spinner('start') as s:
+                assert(isinstance(s, DummySpinner))
+                s('update')
+                assert(s.msg == 'update')
+            # Nothing is rendered in the background
+            assert(t._render_thread is None)
+            assert(not any('update' in r for r in redraws))
+        finally:
+            signal.signal(signal.SIGWINCH, t._prev_sigwinch)
+
+    def test_sigwinch(self):
+        t, _ = make_terminal()
+        try:
+            t._size = (24, 80)
+            assert(t.width == 80)
+            os.kill(os.getpid(), signal.SIGWINCH)
+            assert(t._size is None)
+            assert(t._render_requested.is_set())
+            # The size is queried again
+            assert(t.width == 0)
+        finally:
+            signal.signal(signal.SIGWINCH, t._prev_sigwinch)
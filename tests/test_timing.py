@@ -0,0 +1,47 @@
+import logging
+import time
+
+from borg_sya.core import Context, Repository
+from borg_sya.core.timing import Timings
+
+
+class TestTimings():
+    def test_report(self):
+        timings = Timings()
+        assert(not timings)
+        timer = timings.timer('task')
+        with timer('create'):
+            time.sleep(0.01)
+        for detail in ['daily=7', 'weekly=4', 'daily=7']:
+            with timer('prune', detail):
+                pass
+        with timings.phase('repo', 'acquire-lock'):
+            pass
+
+        report = timings.report()
+        phases = [(e['scope'], e['phase'], e['detail'], e['count'])
+                  for e in report['phases']]
+        assert(phases == [('repo', 'acquire-lock', None, 1),
+                          ('task', 'create', None, 1),
+                          ('task', 'prune', 'daily=7', 2),
+                          ('task', 'prune', 'weekly=4', 1)])
+        assert(list(report['totals'])
+               == ['acquire-lock', 'create', 'prune'])
+        assert(report['totals']['prune']['count'] == 3)
+        assert(report['totals']['create']['wall'] >= 0.01)
+        assert('(total)' in timings.format_table())
+
+    def test_lock_once(self, tmp_path):
+        cx = Context('/tmp', dryrun=False, verbose=False,
+                     log=logging.getLogger('test'),
+                     repos=None, tasks=None, cachedir=str(tmp_path))
+        # The lock's name is derived from the path and must be short.
+        repo = Repository('repo', '/nonexistent/repo', cx,
+                          pre_desc='mount script', post_desc='umount script')
+        with repo:
+            with repo:
+                with repo:
+                    pass
+        with repo:
+            pass
+        assert(cx.timings.report()['totals']['acquire-lock']['count'] == 2)
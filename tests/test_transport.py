@@ -0,0 +1,110 @@
+import os
+import stat
+import time
+
+from borg_sya.core import Context
+from borg_sya.core.borg import Borg, Repository
+from borg_sya.core.transport import SSHTransport, remote_destination
+
+
+# Opens a fake master connection, i.e. creates the control socket, or
+# removes it on `-O exit`. Logs its arguments.
+FAKE_SSH = """#!/bin/sh
+echo "$@" >> "{log}"
+socket=
+for arg in "$@"; do
+    case "$arg" in ControlPath=*) socket="${{arg#ControlPath=}}";; esac
+done
+[ -n "$HANG" ] && exec sleep 30
+case "$*" in
+    *"-O exit"*) rm -f "$socket";;
+    *ControlMaster=yes*) [ -n "$FAIL" ] && exit 255; touch "$socket";;
+esac
+"""
+
+
+def make_cx(tmp_path):
+    return Context('/tmp', dryrun=False, verbose=False, log=None,
+                   repos=None, tasks=None, cachedir=str(tmp_path / 'cache'))
+
+
+def fake_ssh(tmp_path):
+    ssh = tmp_path / 'ssh'
+    ssh.write_text(FAKE_SSH.format(log=tmp_path / 'ssh.log'))
+    ssh.chmod(ssh.stat().st_mode | stat.S_IEXEC)
+    return str(ssh)
+
+
+def calls(tmp_path):
+    return (tmp_path / 'ssh.log').read_text().splitlines()
+
+
+def test_remote_destination():
+    assert(remote_destination('/srv/borg') is None)
+    assert(remote_destination('./rel:ative') is None)
+    assert(remote_destination('backup@host:repo') == ['backup@host'])
+    assert(remote_destination('ssh://backup@host:2222/./repo')
+           == ['-p', '2222', 'backup@host'])
+    assert(remote_destination('ssh://host/repo') == ['host'])
+
+
+class TestSSHTransport():
+    def test_lifecycle(self, tmp_path):
+        cx = make_cx(tmp_path)
+        transport = SSHTransport.from_config(
+            'repo', 'backup@host:repo',
+            {'command': fake_ssh(tmp_path), 'cipher': 'aes128-gcm@openssh.com',
+             'keepalive': 30},
+            cx)
+        assert('ControlPath' not in transport.rsh())
+
+        with transport(lazy=True):
+            with transport():
+                assert(transport.active)
+                assert(os.path.exists(transport.socket))
+                rsh = transport.rsh()
+                assert(f'ControlPath={transport.socket}' in rsh)
+                assert('-c aes128-gcm@openssh.com' in rsh)
+                assert('ServerAliveInterval=30' in rsh)
+            # Only torn down at the outermost exit
+            assert(transport.active)
+        assert(not transport.active)
+        assert(not os.path.exists(transport.socket))
+
+        master, close = calls(tmp_path)
+        assert('ControlMaster=yes' in master)
+        assert('BatchMode=yes' in master and 'ConnectTimeout=10' in master)
+        assert(master.endswith('backup@host'))
+        assert('-O exit' in close)
+        assert('connect' in cx.timings.format_table())
+
+    def test_failure(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('FAIL', '1')
+        transport = SSHTransport('repo', ['host'], str(tmp_path),
+                                 make_cx(tmp_path), command=fake_ssh(tmp_path))
+        with transport():
+            # borg connects directly
+            assert(not transport.active)
+            assert('ControlPath' not in transport.rsh())
+        assert(len(calls(tmp_path)) == 1)
+
+    def test_timeout(self, tmp_path, monkeypatch):
+        # E.g. an unreachable host, or a prompt
+        monkeypatch.setenv('HANG', '1')
+        transport = SSHTransport('repo', ['host'], str(tmp_path),
+                                 make_cx(tmp_path), command=fake_ssh(tmp_path),
+                                 connect_timeout=0.5)
+        start = time.monotonic()
+        with transport():
+            assert(not transport.active)
+        assert(time.monotonic() - start < 5)
+
+    def test_borg_env(self, tmp_path):
+        transport = SSHTransport('repo', ['host'], str(tmp_path),
+                                 make_cx(tmp_path), command='ssh -i key',
+                                 compression=False)
+        repo = Repository('repo', 'host:repo', borg=None, passphrase='secret',
+                          transport=transport)
+        env = Borg._env(repo)
+        assert(env['BORG_PASSPHRASE'] == 'secret')
+        assert(env['BORG_RSH'] == 'ssh -i key -o Compression=no')
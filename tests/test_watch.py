@@ -0,0 +1,158 @@
+import os
+import threading
+
+from borg_sya.core import Context
+from borg_sya.core.patterns import PatternsFile, fm_match
+from borg_sya.core.util import LockInUse
+from borg_sya.core.watch import Watcher
+
+
+class Stub():
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class Clock():
+    def __init__(self):
+        self.now = 0
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.now
+
+
+def make_cx(tmp_path):
+    return Context('/tmp', dryrun=True, verbose=False, log=None,
+                   repos=None, tasks=None, cachedir=str(tmp_path))
+
+
+def make_task(tmp_path, name, repo, includes, excludes=()):
+    patterns = PatternsFile(str(tmp_path / 'cache'), name)
+    exclude_file = str(tmp_path / f'{name}.excludes')
+    with open(exclude_file, 'w') as f:
+        f.write(''.join(f'{e}\n' for e in excludes))
+    task = Stub(name=name, repo=repo, enabled=True, patterns=patterns,
+                roots=patterns.roots, excludes=patterns.excludes)
+    task.update_patterns = lambda: patterns.update(includes, None,
+                                                   exclude_file)
+    task.update_patterns()
+    return task
+
+
+def test_fm_match():
+    assert(fm_match('/home/*/.cache', '/home/user/.cache'))
+    assert(fm_match('/home/*/.cache', '/home/user/.cache/x/y'))
+    assert(fm_match('/var/tmp/', '/var/tmp/x'))
+    assert(not fm_match('/home/*/.cache', '/home/user/.cached'))
+    assert(not fm_match('/var/tmp', '/var'))
+
+
+def test_debounce(tmp_path):
+    clock = Clock()
+    repo = Stub(name='repo')
+    other = Stub(name='other')
+    a = Stub(name='a', repo=repo, enabled=True)
+    b = Stub(name='b', repo=repo, enabled=True)
+    c = Stub(name='c', repo=other, enabled=True)
+    watcher = Watcher(make_cx(tmp_path), None, [a, b, c], quiet=10,
+                      max_delay=60, jobs=2, clock=clock)
+
+    watcher._changed(a)
+    clock.now = 5
+    watcher._changed(b)
+    assert(watcher._pop_due(clock.now) == ([], 10))
+    # Continuous changes are backed up after max_delay
+    for clock.now in range(5, 60, 5):
+        watcher._changed(a)
+        assert(watcher._pop_due(clock.now)[0] == [])
+    clock.now = 60
+    # Tasks on the same repository are coalesced
+    assert(watcher._pop_due(clock.now) == ([(repo, {a, b})], None))
+
+    # While a session for the repository runs, changes are kept
+    watcher._changed(a)
+    watcher._changed(c)
+    clock.now = 100
+    assert(watcher._pop_due(clock.now) == ([(other, {c})], None))
+    watcher._running.discard(repo)
+    assert(watcher._pop_due(clock.now) == ([(repo, {a})], None))
+
+
+def test_watch(tmp_path):
+    root = tmp_path / 'data'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'skip').mkdir()
+    cx = make_cx(tmp_path)
+    repo = Stub(name='repo')
+    a = make_task(tmp_path, 'a', repo, [str(root)],
+                  excludes=[str(root / 'skip')])
+    b = make_task(tmp_path, 'b', repo, [str(root / 'sub' / 'file')])
+    sessions = []
+
+    def func(repo, tasks):
+        sessions.append([t.name for t in tasks])
+        if len(sessions) == 1:
+            raise LockInUse()
+        watcher.stop()
+
+    watcher = Watcher(cx, func, [a, b], quiet=0.2, max_delay=10)
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        for _ in range(100):
+            if watcher._watches:
+                break
+            threading.Event().wait(0.01)
+        # Excluded directories are not watched
+        assert(sorted(p for p, _ in watcher._watches.values())
+               == [str(root), str(root / 'sub')])
+        (root / 'skip' / 'file').write_text('x')
+        # Also watch new directories
+        os.mkdir(root / 'new')
+        (root / 'new' / 'file').write_text('x')
+        (root / 'sub' / 'file').write_text('x')
+    finally:
+        thread.join(10)
+        watcher.stop()
+    assert(not thread.is_alive())
+    # Retried after the repository was busy
+    assert(sessions == [['a', 'b'], ['a', 'b']])
+    assert(str(root / 'new') in [p for p, _ in watcher._watches.values()])
+
+
+def test_saturated(tmp_path):
+    # While all jobs are busy, due repositories don't make the main loop spin
+    clock = Clock()
+    (tmp_path / 'data').mkdir()
+    repo, other = Stub(name='repo'), Stub(name='other')
+    a = make_task(tmp_path, 'a', repo, [str(tmp_path / 'data')])
+    b = make_task(tmp_path, 'b', other, [str(tmp_path / 'data')])
+    release = threading.Event()
+    sessions = []
+
+    def func(repo, tasks):
+        sessions.append((repo, clock.calls))
+        if len(sessions) == 1:
+            release.wait(10)
+        else:
+            watcher.stop()
+
+    watcher = Watcher(make_cx(tmp_path), func, [a, b], quiet=1,
+                      max_delay=10, jobs=1, clock=clock)
+    watcher._changed(a)
+    watcher._changed(b)
+    clock.now = 5
+    thread = threading.Thread(target=watcher.run)
+    thread.start()
+    try:
+        threading.Event().wait(0.3)
+        busy_calls = clock.calls
+    finally:
+        release.set()
+        thread.join(10)
+        watcher.stop()
+    assert(not thread.is_alive())
+    assert(len(sessions) == 2)
+    assert(busy_calls < 5)
+    assert(watcher._pop_due(clock.now) == ([], None))